@@ -0,0 +1,296 @@
+"""
+Band-math expressions (e.g. ``where(b1 > 45, b1, nan)``) compiled into vectorized evaluators
+"""
+
+import ast
+import logging
+import math
+import threading
+from typing import Callable, FrozenSet, Mapping, Sequence, Tuple, Union
+
+import numpy as np
+from cachetools import LRUCache
+from rio_tiler.models import ImageData
+
+logger = logging.getLogger(__name__)
+
+MAX_LENGTH = 512  # characters
+MAX_NODES = 128  # operators, calls, bands and numbers
+
+_expressions: LRUCache = LRUCache(maxsize=256)
+_lock = threading.Lock()
+
+# Evaluated node: float32 array plus whether it is a temporary owned by the
+# evaluation (safe to overwrite in place) rather than an input band
+Value = Tuple[np.ndarray, bool]
+# Input bands by 1-based index
+Bands = Mapping[int, np.ndarray]
+
+
+class _Op:
+    """Compiled non-constant subtree: its evaluator and the bands it reads"""
+
+    __slots__ = ("evaluate", "bands")
+
+    def __init__(self, evaluate: Callable[[Bands], Value], bands: FrozenSet[int]):
+        self.evaluate = evaluate
+        self.bands = bands
+
+    def __call__(self, bands: Bands) -> Value:
+        return self.evaluate(bands)
+
+
+Node = Union[float, _Op]
+
+CONSTANTS = {"nan": math.nan, "inf": math.inf, "pi": math.pi, "e": math.e}
+
+BINARY_OPS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide,
+    ast.Pow: np.power,
+    ast.Mod: np.fmod,
+    # Masks combine like numexpr/rio-tiler expressions: (b1 > 40) & (b2 < 10)
+    ast.BitAnd: np.logical_and,
+    ast.BitOr: np.logical_or,
+}
+
+COMPARE_OPS = {
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+}
+
+UNARY_FUNCTIONS = {
+    "abs": np.abs,
+    "sqrt": np.sqrt,
+    "exp": np.exp,
+    "log": np.log,
+    "log10": np.log10,
+    "floor": np.floor,
+    "ceil": np.ceil,
+}
+
+BINARY_FUNCTIONS = {
+    # NaN-aware, so a masked operand does not hide the other one
+    "minimum": np.fmin,
+    "maximum": np.fmax,
+}
+
+
+class InvalidExpression(ValueError):
+    pass
+
+
+class BandExpression:
+    """
+    A validated expression over bands ``b1``..``bN``, compiled once.
+
+    Only numbers, ``nan``/``inf``/``pi``/``e``, band names, arithmetic,
+    comparisons, ``&``/``|``/``~`` (and ``and``/``or``/``not``) and a few
+    numpy functions are accepted; anything else in the AST is rejected, so
+    evaluating an expression never runs arbitrary code. Constant subtrees are
+    folded at compile time. Evaluation works on float32 copies of the bands
+    and writes each operation into a temporary it already owns where it can,
+    so an expression allocates about one tile-sized buffer per nesting level
+    rather than one per operator.
+
+    ``bands`` are the 1-based band indexes the compiled expression reads, in
+    the order the reader must return them; a branch of ``where`` dropped by
+    a constant condition does not count.
+    """
+
+    def __init__(self, text: str):
+        if len(text) > MAX_LENGTH:
+            raise InvalidExpression(f"Expression longer than {MAX_LENGTH} characters")
+        try:
+            tree = ast.parse(text.strip(), mode="eval")
+        except (SyntaxError, ValueError) as e:
+            raise InvalidExpression(f"Invalid expression syntax: {getattr(e, 'msg', e)}")
+        nodes = sum(1 for _ in ast.walk(tree))
+        if nodes > MAX_NODES:
+            raise InvalidExpression(f"Expression with more than {MAX_NODES} terms")
+
+        functions = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+        referenced = sorted({
+            _band_index(node.id) for node in ast.walk(tree)
+            if isinstance(node, ast.Name) and id(node) not in functions and node.id not in CONSTANTS
+        })
+        if not referenced:
+            raise InvalidExpression("Expression must reference at least one band (b1, b2, ...)")
+        self.source = ast.unparse(tree)  # normalized spacing, for cache keys
+        self._root = self._compile(tree.body)
+        # A constant result still needs one band for the tile's shape and mask
+        self.bands: Tuple[int, ...] = (
+            tuple(sorted(self._root.bands)) if callable(self._root) else tuple(referenced[:1])
+        )
+
+    def evaluate(self, data: np.ndarray) -> np.ndarray:
+        """Evaluate over (bands, height, width) data holding ``bands`` in order; returns float32 (height, width)"""
+        bands = {index: np.asarray(band, dtype=np.float32) for index, band in zip(self.bands, data)}
+        with np.errstate(all="ignore"):
+            if callable(self._root):
+                result, owned = self._root(bands)
+                return result if owned else result.copy()
+            return np.full(data.shape[1:], self._root, dtype=np.float32)
+
+    def apply(self, image: ImageData) -> ImageData:
+        """
+        Single-band float32 image of the expression. Pixels masked in any
+        referenced band, or whose result is not finite, are masked.
+        """
+        array = image.array
+        result = self.evaluate(array.data)
+        hidden = ~np.isfinite(result)
+        mask = np.ma.getmask(array)
+        if mask is not np.ma.nomask:
+            np.logical_or(hidden, np.logical_or.reduce(mask, axis=0), out=hidden)
+        return ImageData(
+            np.ma.MaskedArray(result[np.newaxis], mask=hidden[np.newaxis]),
+            assets=image.assets,
+            bounds=image.bounds,
+            crs=image.crs,
+            band_names=[self.source],
+            metadata=image.metadata,
+        )
+
+    def _compile(self, node: ast.AST) -> Node:
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                raise InvalidExpression(f"Unsupported constant {node.value!r}")
+            return float(node.value)
+        if isinstance(node, ast.Name):
+            if node.id in CONSTANTS:
+                return CONSTANTS[node.id]
+            index = _band_index(node.id)
+            return _Op(lambda bands: (bands[index], False), frozenset((index,)))
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPS:
+            return _combine(BINARY_OPS[type(node.op)], self._compile(node.left), self._compile(node.right))
+        if isinstance(node, ast.UnaryOp):
+            operand = self._compile(node.operand)
+            if isinstance(node.op, ast.USub):
+                return _unary(np.negative, operand)
+            if isinstance(node.op, ast.UAdd):
+                return operand
+            if isinstance(node.op, (ast.Not, ast.Invert)):
+                return _unary(np.logical_not, operand)
+        if isinstance(node, ast.Compare):
+            # a < b < c means (a < b) & (b < c)
+            terms = [self._compile(node.left)] + [self._compile(c) for c in node.comparators]
+            result = None
+            for op, left, right in zip(node.ops, terms, terms[1:]):
+                if type(op) not in COMPARE_OPS:
+                    raise InvalidExpression(f"Unsupported comparison {type(op).__name__}")
+                comparison = _combine(COMPARE_OPS[type(op)], left, right)
+                result = comparison if result is None else _combine(np.logical_and, result, comparison)
+            return result
+        if isinstance(node, ast.BoolOp):
+            ufunc = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            result = self._compile(node.values[0])
+            for value in node.values[1:]:
+                result = _combine(ufunc, result, self._compile(value))
+            return result
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            return self._compile_call(node.func.id, [self._compile(arg) for arg in node.args])
+        raise InvalidExpression(f"Unsupported expression element {type(node).__name__}")
+
+    def _compile_call(self, name: str, args: Sequence[Node]) -> Node:
+        def arity(n: int):
+            if len(args) != n:
+                raise InvalidExpression(f"{name}() takes {n} arguments")
+
+        if name in UNARY_FUNCTIONS:
+            arity(1)
+            return _unary(UNARY_FUNCTIONS[name], args[0])
+        if name in BINARY_FUNCTIONS:
+            arity(2)
+            return _combine(BINARY_FUNCTIONS[name], *args)
+        if name == "clip":
+            arity(3)
+            # Unlike fmin/fmax, NaN (a masked pixel) stays NaN
+            return _combine(np.minimum, _combine(np.maximum, args[0], args[1]), args[2])
+        if name == "where":
+            arity(3)
+            return _where(*args)
+        raise InvalidExpression(f"Unknown function {name}()")
+
+
+def _band_index(name: str) -> int:
+    if name.startswith("b") and name[1:].isdigit() and int(name[1:]) >= 1:
+        return int(name[1:])
+    raise InvalidExpression(f"Unknown name {name!r} (bands are b1, b2, ...)")
+
+
+def _value(node: Node, bands: Bands) -> Tuple[Union[float, np.ndarray], bool]:
+    return (node, False) if not callable(node) else node(bands)
+
+
+def _bands_of(*nodes: Node) -> FrozenSet[int]:
+    return frozenset().union(*(node.bands for node in nodes if callable(node)))
+
+
+def _shape(bands: Bands) -> Tuple[int, ...]:
+    return next(iter(bands.values())).shape
+
+
+def _combine(ufunc: np.ufunc, left: Node, right: Node) -> Node:
+    """Binary operation, written into an operand's temporary when there is one"""
+    if not callable(left) and not callable(right):
+        with np.errstate(all="ignore"):
+            return float(ufunc(np.float32(left), np.float32(right)))
+
+    def evaluate(bands: Bands) -> Value:
+        a, a_owned = _value(left, bands)
+        b, b_owned = _value(right, bands)
+        if a_owned:
+            return ufunc(a, b, out=a), True
+        if b_owned:
+            return ufunc(a, b, out=b), True
+        out = np.empty(_shape(bands), dtype=np.float32)
+        return ufunc(a, b, out=out), True
+
+    return _Op(evaluate, _bands_of(left, right))
+
+
+def _unary(ufunc: np.ufunc, operand: Node) -> Node:
+    if not callable(operand):
+        with np.errstate(all="ignore"):
+            return float(ufunc(np.float32(operand)))
+
+    def evaluate(bands: Bands) -> Value:
+        a, owned = operand(bands)
+        return ufunc(a, out=a if owned else np.empty_like(a)), True
+
+    return _Op(evaluate, operand.bands)
+
+
+def _where(condition: Node, then: Node, otherwise: Node) -> Node:
+    if not callable(condition):
+        # The other branch is never evaluated, nor are its bands read
+        return then if condition else otherwise
+
+    def evaluate(bands: Bands) -> Value:
+        c, _ = condition(bands)
+        choose = c != 0
+        out, owned = _value(otherwise, bands)
+        if not owned:
+            out = np.full(_shape(bands), out, dtype=np.float32) if np.isscalar(out) else out.copy()
+        np.copyto(out, _value(then, bands)[0], where=choose)
+        return out, True
+
+    return _Op(evaluate, _bands_of(condition, then, otherwise))
+
+
+def compile_expression(text: str) -> BandExpression:
+    """Compiled expression, shared by every request with the same text; raises InvalidExpression"""
+    with _lock:
+        expression = _expressions.get(text)
+    if expression is None:
+        expression = BandExpression(text)
+        with _lock:
+            _expressions[text] = expression
+    return expression
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of tile post-processing: rio-tiler's rescale + colormap vs the fused lookup-table pipeline
+
+    python bench_render.py [--size 256] [--repeat 200]
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+from rio_tiler.colormap import cmap as colormap
+from rio_tiler.models import ImageData
+from rio_tiler.utils import render
+
+from render_pipeline import compile_pipeline
+
+CASES = [
+    # (name, dtype, bands, value range, rescale, color map)
+    ("rgb uint8 rescale", "uint8", 3, (0, 255), (20.0, 230.0), None),
+    ("thermal uint16 rescale+colormap", "uint16", 1, (27000, 33000), (28000.0, 32000.0), "inferno"),
+    ("thermal float32 rescale+colormap", "float32", 1, (15.0, 65.0), (20.0, 60.0), "inferno"),
+    ("index uint8 colormap", "uint8", 1, (0, 255), None, "viridis"),
+]
+
+
+def make_tile(dtype: str, bands: int, value_range, size: int) -> ImageData:
+    """Gradient tile with a nodata disc in one corner"""
+    lo, hi = value_range
+    yy, xx = np.mgrid[0:size, 0:size]
+    data = np.stack([lo + (hi - lo) * ((xx + yy * (b + 1)) % size) / size for b in range(bands)]).astype(dtype)
+    mask = np.broadcast_to((xx ** 2 + yy ** 2) < (size // 3) ** 2, data.shape)
+    return ImageData(np.ma.MaskedArray(data, mask=mask.copy()))
+
+
+def reference(tile: ImageData, rescale, color_map):
+    """The rio-tiler path: post_process for the rescale, render's colormap for the colors"""
+    if rescale:
+        tile = tile.post_process(in_range=(rescale,))
+    data, mask = tile.data, tile.mask
+    if color_map:
+        from rio_tiler.colormap import apply_cmap
+        data, alpha = apply_cmap(data[:1], colormap.get(color_map))
+        mask = np.bitwise_and(alpha, mask)
+    return data, mask
+
+
+def fused(tile: ImageData, rescale, color_map):
+    return compile_pipeline(rescale, color_map).apply(tile)
+
+
+def same_pixels(a, b) -> bool:
+    """Equal alpha, and equal bands wherever the pixel is visible"""
+    (data_a, alpha_a), (data_b, alpha_b) = a, b
+    visible = alpha_a > 0
+    return np.array_equal(alpha_a, alpha_b) and np.array_equal(data_a[:, visible], data_b[:, visible])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'case':36} {'rio-tiler':>12} {'fused':>12} {'speedup':>8} {'+png ref':>12} {'+png fused':>12}  match")
+    for name, dtype, bands, value_range, rescale, color_map in CASES:
+        tile = make_tile(dtype, bands, value_range, args.size)
+        match = same_pixels(reference(tile, rescale, color_map), fused(tile, rescale, color_map))
+
+        def time_us(fn) -> float:
+            return min(timeit.repeat(fn, number=args.repeat, repeat=3)) / args.repeat * 1e6
+
+        ref_us = time_us(lambda: reference(tile, rescale, color_map))
+        fused_us = time_us(lambda: fused(tile, rescale, color_map))
+        ref_png_us = time_us(lambda: render(*reference(tile, rescale, color_map), img_format="PNG"))
+        fused_png_us = time_us(lambda: render(*fused(tile, rescale, color_map), img_format="PNG"))
+        print(
+            f"{name:36} {ref_us:10.0f}us {fused_us:10.0f}us {ref_us / fused_us:7.1f}x "
+            f"{ref_png_us:10.0f}us {fused_png_us:10.0f}us  {'yes' if match else 'NO'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
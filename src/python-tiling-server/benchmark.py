@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+"""
+Reproducible tile-server benchmark: synthetic COGs, a local backend stub and replayed pan/zoom sessions
+
+    python benchmark.py [--size 8192] [--bands 3] [--dtype uint8] [--overviews auto]
+                        [--sessions 20] [--concurrency 4] [--output results.json]
+                        [--compare previous.json] [--env COG_STREAM=true ...]
+
+Each run generates (or reuses) a synthetic COG, serves it with a stand-in for
+the backend's ``/api/tiles/{id}/info`` endpoint and the COG download URL, and
+starts the server (``uvicorn main:app``) against fresh cache directories. The
+same seeded sessions are replayed in three scenarios:
+
+- cold: empty COG and tile caches (includes the COG download)
+- warm-memory: the same server again, tiles in the memory cache
+- warm-disk: a restarted server over the populated disk caches
+
+Latency percentiles and throughput per endpoint and scenario are printed and
+written as JSON so releases can be compared with ``--compare``.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import mercantile
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.transform import from_origin
+from rasterio.warp import transform_bounds
+
+SCENARIOS = ("cold", "warm-memory", "warm-disk")
+RESULTS_VERSION = 1
+
+
+# Synthetic COGs
+
+def cog_name(args: argparse.Namespace) -> str:
+    return f"bench-{args.size}-{args.bands}b-{args.dtype}-ov{args.overviews}-{args.compress.lower()}-s{args.seed}"
+
+
+def make_cog(path: str, size: int, bands: int, dtype: str, overviews: str, compress: str,
+             resolution: float, seed: int) -> None:
+    """
+    Orthomosaic-like COG: smooth terrain-ish values with noise inside an
+    irregular footprint and nodata outside it
+    """
+    rng = np.random.default_rng(seed)
+    # UTM 34N, roughly where the production orthomosaics are
+    transform = from_origin(500000, 4700000, resolution, resolution)
+    nodata = 0 if np.dtype(dtype).kind in "ui" else float("nan")
+    profile = dict(
+        driver="GTiff", width=size, height=size, count=bands, dtype=dtype, crs="EPSG:32634",
+        transform=transform, nodata=nodata, tiled=True, blockxsize=512, blockysize=512,
+    )
+    if np.dtype(dtype).kind == "f":
+        low, high = 15.0, 65.0  # thermal, degrees C
+    else:
+        low, high = 1, min(np.iinfo(dtype).max, 250 if dtype == "uint8" else 40000)
+
+    # Footprint: a wobbly disc covering most of the raster
+    angles = np.linspace(0, 2 * np.pi, 16, endpoint=False)
+    radii = size / 2 * (0.8 + 0.15 * rng.random(16))
+
+    tmp_path = f"{path}.src.tif"
+    with rasterio.open(tmp_path, "w", **profile) as dst:
+        for _, window in dst.block_windows(1):
+            yy, xx = np.mgrid[
+                window.row_off:window.row_off + window.height,
+                window.col_off:window.col_off + window.width,
+            ].astype(np.float32)
+            dy, dx = yy - size / 2, xx - size / 2
+            theta = np.mod(np.arctan2(dy, dx), 2 * np.pi)
+            limit = np.interp(theta, np.append(angles, 2 * np.pi), np.append(radii, radii[0]))
+            outside = np.hypot(dx, dy) > limit
+            for band in range(bands):
+                wave = np.sin(xx / (size / (3 + band))) * np.cos(yy / (size / (5 + band)))
+                noise = rng.standard_normal(xx.shape).astype(np.float32) * 0.05
+                values = low + (high - low) * np.clip((wave + 1) / 2 + noise, 0, 1)
+                values = values.astype(dtype)
+                if np.dtype(dtype).kind in "ui":
+                    values[values == 0] = 1
+                values[outside] = nodata
+                dst.write(values, band + 1, window=window)
+
+    options = {"compress": compress, "blocksize": 512}
+    if overviews == "none":
+        options["overviews"] = "NONE"
+    elif overviews != "auto":
+        options["overview_count"] = int(overviews)
+    try:
+        rasterio.shutil.copy(tmp_path, path, driver="COG", **options)
+    finally:
+        os.unlink(tmp_path)
+
+
+# Backend stub
+
+class BackendStub:
+    """
+    Stand-in for the NestJS ``/api/tiles/{id}/info`` endpoint plus the COG
+    download URL (with Range support, for streaming mode) on 127.0.0.1
+    """
+
+    def __init__(self, cog_dir: str):
+        self.cog_dir = cog_dir
+        stub = self
+
+        class Handler(SimpleHTTPRequestHandler):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, directory=stub.cog_dir, **kwargs)
+
+            def do_GET(self):
+                match = re.fullmatch(r"/api/tiles/([^/]+)/info", self.path.split("?")[0])
+                if match:
+                    return self._info(match.group(1))
+                if self.headers.get("Range"):
+                    return self._range()
+                return super().do_GET()
+
+            def _info(self, task_id: str):
+                if not os.path.exists(os.path.join(stub.cog_dir, f"{task_id}.tif")):
+                    self.send_error(404)
+                    return
+                body = json.dumps({
+                    "id": task_id,
+                    "projectId": 1,
+                    "cogUrl": f"{stub.url}/{task_id}.tif",
+                    "status": "COMPLETED",
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _range(self):
+                path = self.translate_path(self.path)
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    self.send_error(404)
+                    return
+                start, _, end = self.headers["Range"].split("=", 1)[1].partition("-")
+                start = int(start)
+                end = min(int(end) if end else size - 1, size - 1)
+                with open(path, "rb") as f:
+                    f.seek(start)
+                    data = f.read(end - start + 1)
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("Accept-Ranges", "bytes")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# Server under test
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ServerProcess:
+    """``uvicorn main:app`` in a subprocess with the benchmark's environment"""
+
+    def __init__(self, env: Dict[str, str], workers: int, log_path: str):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = {**os.environ, **env}
+        self.workers = workers
+        self.log_path = log_path
+        self._process: Optional[subprocess.Popen] = None
+
+    def start(self, timeout: float = 60.0) -> None:
+        log = open(self.log_path, "a")
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+             "--port", str(self.port), "--workers", str(self.workers), "--log-level", "warning"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=self.env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        log.close()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"Server exited with {self._process.returncode}; see {self.log_path}")
+            try:
+                if httpx.get(f"{self.url}/health", timeout=1.0).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"Server did not become healthy in {timeout}s; see {self.log_path}")
+
+    def stop(self) -> None:
+        if self._process is None:
+            return
+        self._process.terminate()
+        try:
+            self._process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._process = None
+
+
+# Access patterns
+
+def pan_zoom_sessions(bounds: Tuple[float, float, float, float], minzoom: int, maxzoom: int,
+                      sessions: int, steps: int, viewport: Tuple[int, int], seed: int) -> List[List[List[Tuple[int, int, int]]]]:
+    """
+    Map-viewer sessions: each starts at a random point a few levels above the
+    native zoom and pans (70%) or zooms in/out (15% each) one step at a time.
+    Every step is the viewport's tiles ordered from the centre outwards, as
+    map clients request them.
+    """
+    rng = random.Random(seed)
+    west, south, east, north = bounds
+    cols, rows = viewport
+    result = []
+    for _ in range(sessions):
+        lon = rng.uniform(west, east)
+        lat = rng.uniform(south, north)
+        z = rng.randint(max(minzoom, maxzoom - 3), maxzoom)
+        session = []
+        for _ in range(steps):
+            center = mercantile.tile(lon, lat, z)
+            tiles = [
+                (z, center.x + dx, center.y + dy)
+                for dy in range(-(rows // 2), rows - rows // 2)
+                for dx in range(-(cols // 2), cols - cols // 2)
+                if 0 <= center.x + dx < 2 ** z and 0 <= center.y + dy < 2 ** z
+            ]
+            tiles.sort(key=lambda t: (t[1] - center.x) ** 2 + (t[2] - center.y) ** 2)
+            session.append(tiles)
+
+            move = rng.random()
+            if move < 0.15:
+                z = min(maxzoom + 1, z + 1)
+            elif move < 0.30:
+                z = max(minzoom, z - 1)
+            else:
+                # Pan by up to half a viewport
+                tile_bounds = mercantile.bounds(center)
+                span_lon = (tile_bounds.east - tile_bounds.west) * cols / 2
+                span_lat = (tile_bounds.north - tile_bounds.south) * rows / 2
+                lon = min(max(lon + rng.uniform(-span_lon, span_lon), west), east)
+                lat = min(max(lat + rng.uniform(-span_lat, span_lat), south), north)
+        result.append(session)
+    return result
+
+
+# Replay and statistics
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[Tuple[float, int, int]]] = {}  # endpoint -> (seconds, status, bytes)
+
+    def add(self, endpoint: str, seconds: float, status: int, size: int) -> None:
+        self.samples.setdefault(endpoint, []).append((seconds, status, size))
+
+    def summary(self, wall: float) -> Dict[str, Any]:
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = np.array([s[0] for s in samples]) * 1000
+            statuses: Dict[str, int] = {}
+            for _, status, _ in samples:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                "errors": sum(1 for _, status, _ in samples if status == 0 or status >= 500),
+                "status": statuses,
+                "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+                "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+                "mean_ms": round(float(latencies.mean()), 2),
+                "max_ms": round(float(latencies.max()), 2),
+                "rps": round(len(samples) / wall, 2) if wall > 0 else None,
+                "bytes": sum(s[2] for s in samples),
+            }
+        total = sum(len(s) for s in self.samples.values())
+        return {"wall_s": round(wall, 3), "requests": total, "rps": round(total / wall, 2), "endpoints": endpoints}
+
+
+async def replay(base_url: str, task_id: str, sessions, concurrency: int, parallel: int,
+                 query: str, think: float) -> Dict[str, Any]:
+    """Replay sessions, ``concurrency`` at a time, fetching up to ``parallel`` tiles of a viewport at once"""
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=concurrency * parallel, max_keepalive_connections=concurrency * parallel)
+    headers = {"Accept": "image/avif,image/webp,*/*;q=0.8"}
+    gate = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120.0, headers=headers) as client:
+        async def fetch(endpoint: str, path: str) -> None:
+            started = time.perf_counter()
+            try:
+                response = await client.get(path)
+                status, size = response.status_code, len(response.content)
+            except httpx.HTTPError:
+                status, size = 0, 0
+            recorder.add(endpoint, time.perf_counter() - started, status, size)
+
+        async def run_session(session) -> None:
+            async with gate:
+                await fetch("tilejson", f"/api/tiles/{task_id}/tilejson")
+                await fetch("metadata", f"/api/tiles/{task_id}/metadata")
+                tile_gate = asyncio.Semaphore(parallel)
+
+                async def fetch_tile(z: int, x: int, y: int) -> None:
+                    async with tile_gate:
+                        await fetch("tile", f"/api/tiles/{task_id}/{z}/{x}/{y}.png{query}")
+
+                for viewport in session:
+                    await asyncio.gather(*(fetch_tile(*t) for t in viewport))
+                    if think:
+                        await asyncio.sleep(think)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(run_session(s) for s in sessions))
+        wall = time.perf_counter() - started
+    return recorder.summary(wall)
+
+
+# Reporting
+
+def print_summary(results: Dict[str, Any]) -> None:
+    print(f"\n{'scenario':12} {'endpoint':9} {'reqs':>6} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+    for scenario, summary in results["scenarios"].items():
+        for endpoint, stats in summary["endpoints"].items():
+            print(
+                f"{scenario:12} {endpoint:9} {stats['requests']:6d} {stats['errors']:4d} "
+                f"{stats['p50_ms']:9.1f} {stats['p95_ms']:9.1f} {stats['p99_ms']:9.1f} {stats['rps']:8.1f}"
+            )
+
+
+def print_comparison(results: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """Relative change of p50/p95/p99 and throughput against a previous results file"""
+    def change(new: float, old: float) -> str:
+        if not old:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"\nvs {baseline.get('git_commit') or 'baseline'} ({baseline.get('started_at')})")
+    print(f"{'scenario':12} {'endpoint':9} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>9}")
+    for scenario, summary in results["scenarios"].items():
+        old_summary = baseline.get("scenarios", {}).get(scenario)
+        if old_summary is None:
+            continue
+        for endpoint, stats in summary["endpoints"].items():
+            old = old_summary["endpoints"].get(endpoint)
+            if old is None:
+                continue
+            print(
+                f"{scenario:12} {endpoint:9} {change(stats['p50_ms'], old['p50_ms']):>9} "
+                f"{change(stats['p95_ms'], old['p95_ms']):>9} {change(stats['p99_ms'], old['p99_ms']):>9} "
+                f"{change(stats['rps'], old['rps']):>9}"
+            )
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Entry point
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python benchmark.py", description="Benchmark the tile server")
+    cog = parser.add_argument_group("synthetic COG")
+    cog.add_argument("--size", type=int, default=8192, help="width and height in pixels")
+    cog.add_argument("--bands", type=int, default=3)
+    cog.add_argument("--dtype", default="uint8", choices=["uint8", "uint16", "int16", "float32"])
+    cog.add_argument("--overviews", default="auto", help="auto, none or an overview count")
+    cog.add_argument("--compress", default="DEFLATE")
+    cog.add_argument("--resolution", type=float, default=0.05, help="metres per pixel")
+    load = parser.add_argument_group("load")
+    load.add_argument("--sessions", type=int, default=20)
+    load.add_argument("--steps", type=int, default=15, help="pan/zoom steps per session")
+    load.add_argument("--viewport", default="4x3", help="tiles per viewport, COLSxROWS")
+    load.add_argument("--concurrency", type=int, default=4, help="concurrent sessions")
+    load.add_argument("--parallel", type=int, default=6, help="concurrent tile requests per session")
+    load.add_argument("--think-ms", type=int, default=0, help="pause between viewport steps")
+    load.add_argument("--query", default="", help="extra tile query string, e.g. 'rescale=0,200&color_map=viridis'")
+    load.add_argument("--scenarios", default=",".join(SCENARIOS))
+    load.add_argument("--seed", type=int, default=1)
+    server = parser.add_argument_group("server")
+    server.add_argument("--workers", type=int, default=1)
+    server.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra server environment (repeatable), e.g. COG_STREAM=true")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "tile-bench"),
+                        help="generated COGs (kept between runs) and caches (reset every run)")
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    parser.add_argument("--compare", default=None, help="previous results JSON to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        print(f"Unknown scenarios: {sorted(unknown)}", file=sys.stderr)
+        return 2
+    cols, rows = (int(v) for v in args.viewport.lower().split("x"))
+    query = f"?{args.query}" if args.query else ""
+
+    workdir = args.workdir
+    cog_dir = os.path.join(workdir, "cogs")
+    os.makedirs(cog_dir, exist_ok=True)
+    task_id = cog_name(args)
+    cog_path = os.path.join(cog_dir, f"{task_id}.tif")
+    if not os.path.exists(cog_path):
+        print(f"Generating {cog_path}")
+        make_cog(cog_path, args.size, args.bands, args.dtype, args.overviews, args.compress,
+                 args.resolution, args.seed)
+
+    from rio_tiler.io import COGReader
+    with COGReader(cog_path) as src:
+        bounds = transform_bounds(src.dataset.crs, "EPSG:4326", *src.dataset.bounds)
+        minzoom, maxzoom = src.minzoom, src.maxzoom
+    sessions = pan_zoom_sessions(bounds, minzoom, maxzoom, args.sessions, args.steps, (cols, rows), args.seed)
+
+    # Fresh caches for the cold run; warm runs reuse them
+    cache_dir = os.path.join(workdir, "cache")
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.makedirs(cache_dir)
+    stub = BackendStub(cog_dir)
+    stub.start()
+    env = {
+        "BACKEND_BASE_URL": stub.url,
+        "COG_CACHE_DIR": os.path.join(cache_dir, "cogs"),
+        "TILE_CACHE_DIR": os.path.join(cache_dir, "tiles"),
+        "WORKERS": str(args.workers),
+        "ENVIRONMENT": "benchmark",
+    }
+    os.makedirs(env["COG_CACHE_DIR"])
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    results: Dict[str, Any] = {
+        "version": RESULTS_VERSION,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": git_commit(),
+        "platform": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "gdal": rasterio.__gdal_version__,
+            "rasterio": rasterio.__version__,
+        },
+        "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "workdir")},
+        "cog": {"task_id": task_id, "bytes": os.path.getsize(cog_path), "minzoom": minzoom, "maxzoom": maxzoom},
+        "tiles_per_pass": sum(len(viewport) for session in sessions for viewport in session),
+        "scenarios": {},
+    }
+    log_path = os.path.join(workdir, "server.log")
+    print(f"Task {task_id}: z{minzoom}-{maxzoom}, {results['tiles_per_pass']} tile requests per pass; "
+          f"server log {log_path}")
+
+    def run(scenario: str, server: ServerProcess) -> None:
+        print(f"Running {scenario}...")
+        results["scenarios"][scenario] = asyncio.run(replay(
+            server.url, task_id, sessions, args.concurrency, args.parallel, query, args.think_ms / 1000,
+        ))
+
+    server = ServerProcess(env, args.workers, log_path)
+    try:
+        server.start()
+        if "cold" in scenarios:
+            run("cold", server)
+        elif "warm-memory" in scenarios or "warm-disk" in scenarios:
+            # Warm runs need the caches populated
+            asyncio.run(replay(server.url, task_id, sessions, args.concurrency, args.parallel, query, 0))
+        if "warm-memory" in scenarios:
+            run("warm-memory", server)
+        if "warm-disk" in scenarios:
+            server.stop()
+            server = ServerProcess(env, args.workers, log_path)
+            server.start()
+            run("warm-disk", server)
+    finally:
+        server.stop()
+        stub.close()
+
+    print_summary(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
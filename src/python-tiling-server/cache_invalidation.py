@@ -0,0 +1,131 @@
+"""
+Cross-worker cache invalidation through marker files in a shared directory
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidationBus:
+    """
+    Tell every worker on the pod that a task's content changed.
+
+    ``publish`` atomically (re)writes ``<directory>/<task_id>`` with the
+    publishing process id; each worker polls the directory every
+    ``poll_interval`` seconds and calls ``on_purge(task_id)`` for markers
+    that are new or rewritten since it last looked, except its own. Markers
+    found at startup are taken as already applied (a fresh worker has no
+    state to purge) and are pruned once older than ``retention``.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        on_purge: Callable[[str], None],
+        poll_interval: float = 1.0,
+        retention: float = 86400.0,
+    ):
+        self.directory = directory
+        self.on_purge = on_purge
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._seen: Dict[str, Tuple[int, int]] = {}
+        self._poller: Optional[asyncio.Task] = None
+        self.published = 0
+        self.applied = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def publish(self, task_id: str) -> None:
+        if task_id in ("", ".", "..") or os.path.basename(task_id) != task_id:
+            raise ValueError(f"Task id {task_id!r} cannot name a marker file")
+        path = os.path.join(self.directory, task_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"pid": os.getpid(), "at": time.time()}, f)
+        os.replace(tmp_path, path)
+        self._seen[task_id] = _stamp(os.stat(path))
+        self.published += 1
+
+    def poll(self) -> None:
+        """Apply markers written by other workers since the last poll"""
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if now - st.st_mtime > self.retention:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                self._seen.pop(name, None)
+                continue
+            stamp = _stamp(st)
+            if self._seen.get(name) == stamp:
+                continue
+            self._seen[name] = stamp
+            try:
+                with open(path) as f:
+                    pid = json.load(f).get("pid")
+            except (OSError, ValueError):
+                pid = None
+            if pid == os.getpid():
+                continue
+            try:
+                self.on_purge(name)
+                self.applied += 1
+            except Exception as e:
+                logger.error(f"Failed to apply invalidation of task {name}: {e}")
+
+    def start(self) -> None:
+        async def loop():
+            while True:
+                await asyncio.sleep(self.poll_interval)
+                try:
+                    self.poll()
+                except Exception as e:
+                    logger.warning(f"Polling invalidations failed: {e}")
+
+        if self._poller is None:
+            # Whatever is already there predates this worker's caches
+            for name in os.listdir(self.directory):
+                if not name.endswith(".tmp"):
+                    try:
+                        self._seen[name] = _stamp(os.stat(os.path.join(self.directory, name)))
+                    except FileNotFoundError:
+                        pass
+            self._poller = asyncio.create_task(loop())
+
+    async def stop(self) -> None:
+        if self._poller is None:
+            return
+        self._poller.cancel()
+        try:
+            await self._poller
+        except asyncio.CancelledError:
+            pass
+        self._poller = None
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "published": self.published,
+            "applied": self.applied,
+        }
+
+
+def _stamp(st: os.stat_result) -> Tuple[int, int]:
+    return st.st_ino, st.st_mtime_ns
@@ -0,0 +1,335 @@
+"""
+Size-bounded LRU disk cache for downloaded COG orthomosaics
+"""
+
+import asyncio
+import errno
+import fcntl
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from cog_downloader import CogDownloadManager
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Per-version metadata stored next to a cached COG, removed with it
+DERIVED_SUFFIXES = (".meta.json", ".coverage.npz", ".cog.json", ".source.json")
+
+
+@dataclass
+class _Pin:
+    fd: int
+    refs: int
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    evicted_bytes: int = 0
+
+
+class CogDiskCache:
+    """
+    Keep downloaded COGs under a byte budget, evicting least recently used files.
+
+    Files in use hold a shared ``flock`` (a pin). Eviction takes an exclusive
+    non-blocking ``flock`` before unlinking, so a file pinned by any worker is
+    never removed. Access time is recorded with an explicit ``utime`` on the
+    file itself, so every worker sees the same LRU order regardless of the
+    filesystem's atime mount options.
+
+    A COG counts against the budget together with its derived files. Lock
+    files and the ``state_dirs`` that live inside the cache directory (worker
+    state such as metrics and seed checkpoints, which default to
+    subdirectories of it) count too, but are never evicted. Caches with a
+    budget of their own are not passed as state directories.
+    """
+
+    def __init__(
+        self,
+        downloader: CogDownloadManager,
+        max_bytes: int,
+        sweep_interval: float = 60.0,
+        low_watermark: float = 0.9,
+        touch_interval: float = 30.0,
+        state_dirs: Iterable[str] = (),
+    ):
+        self.downloader = downloader
+        self.cache_dir = downloader.cache_dir
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.low_watermark = low_watermark
+        self.touch_interval = touch_interval
+        root = os.path.realpath(self.cache_dir)
+        self.state_dirs = [
+            d for d in map(os.path.realpath, state_dirs) if os.path.commonpath([root, d]) == root and d != root
+        ]
+        self.stats = CacheStats()
+        self._pins: Dict[str, _Pin] = {}
+        self._last_touch: Dict[str, float] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        self._sweep_requested: Optional[asyncio.Event] = None
+
+    # Pinning
+
+    async def acquire(self, task_id: str, cog_url: str) -> str:
+        """Pin the task's COG, downloading it first on a miss, and return its path"""
+        path = self._pin(task_id)
+        if path is not None:
+            self.stats.hits += 1
+            self._touch(task_id, path)
+            return path
+
+        self.stats.misses += 1
+        for _ in range(3):
+            with timed("download"):
+                await self.downloader.ensure(task_id, cog_url)
+            path = self._pin(task_id)
+            if path is not None:
+                self.request_sweep()
+                return path
+            # Evicted between download and pin by another worker; try again
+            await asyncio.sleep(0.05)
+        raise OSError(errno.ENOENT, f"COG for task {task_id} disappeared from cache")
+
+    def release(self, task_id: str) -> None:
+        """Drop one pin on the task's COG"""
+        pin = self._pins.get(task_id)
+        if pin is None:
+            return
+        pin.refs -= 1
+        if pin.refs <= 0:
+            del self._pins[task_id]
+            # Closing the descriptor drops the shared lock
+            os.close(pin.fd)
+
+    def dataset_path(self, task_id: str, path: str) -> str:
+        """Path GDAL should open for an acquired COG"""
+        return path
+
+    def is_pinned(self, task_id: str) -> bool:
+        return task_id in self._pins
+
+    def _pin(self, task_id: str) -> Optional[str]:
+        path = self.downloader.local_path(task_id)
+        pin = self._pins.get(task_id)
+        refs = 0
+        if pin is not None:
+            if os.fstat(pin.fd).st_nlink > 0:
+                pin.refs += 1
+                return path
+            # File was replaced under us; move the existing holders onto the
+            # new file (the unlinked inode stays readable for open readers)
+            refs = pin.refs
+            del self._pins[task_id]
+            os.close(pin.fd)
+
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except OSError:
+            # Held exclusively by an evictor that is about to unlink it
+            os.close(fd)
+            return None
+        if os.fstat(fd).st_nlink == 0:
+            os.close(fd)
+            return None
+        self._pins[task_id] = _Pin(fd=fd, refs=refs + 1)
+        return path
+
+    def _touch(self, task_id: str, path: str) -> None:
+        now = time.time()
+        if now - self._last_touch.get(task_id, 0.0) < self.touch_interval:
+            return
+        self._last_touch[task_id] = now
+        try:
+            st = os.stat(path)
+            os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+        except OSError:
+            pass
+
+    # Eviction
+
+    def usage_bytes(self) -> int:
+        entries, other = self._entries()
+        return sum(size for _, _, size in entries) + other
+
+    def _entries(self) -> Tuple[List[list], int]:
+        """
+        (atime, path, size) for every cached COG and in-progress download, and
+        the bytes of the cache's other files and state directories
+        """
+        entries: Dict[str, list] = {}
+        derived = []
+        other = 0
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return [], 0
+        for name in names:
+            is_entry = name.endswith(".tif") or name.endswith(".part")
+            if not (is_entry or name.endswith(DERIVED_SUFFIXES) or name.endswith(".lock")):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if is_entry:
+                entries[path] = [st.st_atime, path, st.st_size]
+            elif name.endswith(".lock"):
+                other += st.st_size
+            else:
+                derived.append((path, st.st_size))
+        for path, size in derived:
+            suffix = next(s for s in DERIVED_SUFFIXES if path.endswith(s))
+            entry = entries.get(path[: -len(suffix)])
+            if entry is not None:
+                entry[2] += size
+            else:
+                other += size
+        for state_dir in self.state_dirs:
+            for root, _, files in os.walk(state_dir):
+                for name in files:
+                    try:
+                        other += os.stat(os.path.join(root, name)).st_size
+                    except FileNotFoundError:
+                        continue
+        return list(entries.values()), other
+
+    def sweep(self) -> int:
+        """Evict LRU files until usage drops below the low watermark; returns bytes freed"""
+        lock_fd = os.open(os.path.join(self.cache_dir, ".sweep.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Another worker is already sweeping
+                return 0
+            entries, other = self._entries()
+            total = sum(size for _, _, size in entries) + other
+            if total <= self.max_bytes:
+                return 0
+
+            target = int(self.max_bytes * self.low_watermark)
+            freed = 0
+            for _, path, size in sorted(entries):
+                if total - freed <= target:
+                    break
+                if not path.endswith(".tif") or self._evict(path):
+                    continue
+                freed += size
+                self.stats.evictions += 1
+                self.stats.evicted_bytes += size
+                logger.info(f"Evicted cached COG {path} ({size} bytes)")
+            if total - freed > self.max_bytes:
+                logger.warning(
+                    f"COG cache over budget after sweep: {total - freed} > {self.max_bytes} bytes (pinned files or other state)"
+                )
+            return freed
+        finally:
+            os.close(lock_fd)
+
+    def _evict(self, path: str) -> bool:
+        """Unlink ``path`` unless it is pinned; returns True if it was kept"""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return True
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return True
+        finally:
+            os.close(fd)
+        # Derived per-version metadata goes with the file
+        _unlink_derived(path)
+        return False
+
+    async def purge(self, task_id: str) -> bool:
+        """
+        Delete the task's COG even if it is pinned (content changed upstream);
+        returns whether there was a file.
+
+        Open readers keep the unlinked inode until they are returned, and the
+        next acquire downloads the file again.
+        """
+        path = self.downloader.local_path(task_id)
+        async with self.downloader.locked(path):
+            try:
+                os.unlink(path)
+                existed = True
+            except FileNotFoundError:
+                existed = False
+            _unlink_derived(path)
+        self._last_touch.pop(task_id, None)
+        return existed
+
+    # Background sweeper
+
+    def request_sweep(self) -> None:
+        """Ask the background sweeper to run now"""
+        if self._sweep_requested is not None:
+            self._sweep_requested.set()
+
+    def start_sweeper(self) -> None:
+        if self._sweeper is None:
+            self._sweep_requested = asyncio.Event()
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop_sweeper(self) -> None:
+        if self._sweeper is None:
+            return
+        self._sweeper.cancel()
+        try:
+            await self._sweeper
+        except asyncio.CancelledError:
+            pass
+        self._sweeper = None
+        self._sweep_requested = None
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._sweep_requested.wait(), timeout=self.sweep_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._sweep_requested.clear()
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.error(f"COG cache sweep failed: {e}")
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "hits": self.stats.hits,
+            "misses": self.stats.misses,
+            "evictions": self.stats.evictions,
+            "evicted_bytes": self.stats.evicted_bytes,
+            "pinned": len(self._pins),
+            "max_bytes": self.max_bytes,
+            "downloads": self.downloader.downloads,
+            "downloaded_bytes": self.downloader.downloaded_bytes,
+        }
+
+
+def _unlink_derived(path: str) -> None:
+    for suffix in DERIVED_SUFFIXES:
+        try:
+            os.unlink(f"{path}{suffix}")
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,319 @@
+"""
+Single-flight COG download manager shared across coroutines and gunicorn workers
+"""
+
+import asyncio
+import base64
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class CogDownloadError(Exception):
+    """Raised when a COG could not be downloaded or failed verification"""
+
+
+class CogDownloadManager:
+    """
+    Download COGs into a local directory exactly once.
+
+    Concurrent callers for the same task inside one worker await a single
+    in-flight download task. Across gunicorn workers an exclusive ``flock`` on
+    a sidecar ``.lock`` file makes sure only one process transfers the file,
+    and the data is streamed into a temporary file that is only renamed into
+    place once its size (and MD5, when the server advertises one) match.
+
+    The MD5 of the downloaded bytes is recorded next to the file
+    (``<task>.tif.source.json``) and names the content version used in tile
+    URLs, which is the same on every worker and pod.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        timeout: float = 300.0,
+        connect_timeout: float = 60.0,
+        lock_timeout: float = 1800.0,
+        chunk_size: int = 1024 * 1024,
+    ):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.lock_timeout = lock_timeout
+        self.chunk_size = chunk_size
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._versions: Dict[str, Tuple[tuple, Optional[str]]] = {}
+        self.downloads = 0
+        self.downloaded_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def local_path(self, task_id: str) -> str:
+        """Final on-disk location of a task's COG"""
+        return os.path.join(self.cache_dir, f"{task_id}.tif")
+
+    def source_path(self, task_id: str) -> str:
+        """Record of the URL, ETag and MD5 the task's COG was downloaded from"""
+        return f"{self.local_path(task_id)}.source.json"
+
+    def content_version(self, task_id: str) -> Optional[str]:
+        """Digest of the downloaded COG's bytes (None if not downloaded or not recorded)"""
+        path = self.source_path(task_id)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stamp = (st.st_ino, st.st_mtime_ns)
+        memo = self._versions.get(task_id)
+        if memo is not None and memo[0] == stamp:
+            return memo[1]
+        try:
+            with open(path) as f:
+                version = json.load(f)["md5"][:16]
+        except (OSError, ValueError, KeyError, TypeError):
+            version = None
+        self._versions[task_id] = (stamp, version)
+        return version
+
+    def record_source(self, task_id: str, url: Optional[str] = None, etag: Optional[str] = None,
+                      md5: Optional[str] = None) -> Optional[str]:
+        """
+        Write the task's source record, hashing the local file when no MD5 is
+        given (files downloaded before records existed); returns the content version
+        """
+        if md5 is None:
+            digest = hashlib.md5()
+            try:
+                with open(self.local_path(task_id), "rb") as f:
+                    for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                        digest.update(chunk)
+            except OSError:
+                return None
+            md5 = digest.hexdigest()
+        path = self.source_path(task_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"url": url, "etag": etag, "md5": md5}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write COG source record {path}: {e}")
+            return None
+        return md5[:16]
+
+    def is_downloading(self, task_id: str) -> bool:
+        """Whether this worker currently has a download running for the task"""
+        return task_id in self._inflight
+
+    async def ensure(self, task_id: str, cog_url: str) -> str:
+        """Return the local path of the task's COG, downloading it if needed"""
+        local_path = self.local_path(task_id)
+        if os.path.exists(local_path):
+            return local_path
+
+        task = self._inflight.get(task_id)
+        if task is None:
+            task = asyncio.ensure_future(self._download(task_id, cog_url, local_path))
+            self._inflight[task_id] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(task_id, None))
+        # Shield so a disconnecting client does not cancel the shared download
+        return await asyncio.shield(task)
+
+    @asynccontextmanager
+    async def locked(self, local_path: str) -> AsyncIterator[None]:
+        """Hold the file's download lock, so no download replaces it meanwhile"""
+        fd = await self._acquire_lock(f"{local_path}.lock")
+        try:
+            yield
+        finally:
+            os.close(fd)
+
+    async def _acquire_lock(self, lock_path: str) -> int:
+        """Poll for an exclusive cross-process lock without blocking the loop"""
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.lock_timeout
+        delay = 0.05
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except OSError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                if loop.time() >= deadline:
+                    raise CogDownloadError(f"Timed out waiting for download lock {lock_path}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 1.0)
+        except BaseException:
+            os.close(fd)
+            raise
+
+    async def _download(self, task_id: str, cog_url: str, local_path: str) -> str:
+        lock_path = f"{local_path}.lock"
+        fd = await self._acquire_lock(lock_path)
+        try:
+            # Another worker may have finished the file while we were waiting
+            if os.path.exists(local_path):
+                logger.info(f"COG for task {task_id} downloaded by another worker")
+                return local_path
+
+            part_path = f"{local_path}.{os.getpid()}.part"
+            try:
+                md5, etag = await self._stream_to_file(task_id, cog_url, part_path)
+                # Recorded first so the file is never visible with a stale record
+                self.record_source(task_id, cog_url, etag, md5)
+                os.replace(part_path, local_path)
+                self.downloads += 1
+            finally:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+
+            logger.info(f"Downloaded COG to {local_path}")
+            return local_path
+        finally:
+            # Closing the descriptor releases the flock
+            os.close(fd)
+
+    async def _stream_to_file(self, task_id: str, cog_url: str, part_path: str) -> Tuple[str, Optional[str]]:
+        """Download into ``part_path``; returns the MD5 (hex) of the bytes and the response's ETag"""
+        timeout = httpx.Timeout(self.timeout, connect=self.connect_timeout)
+        written = 0
+        writer = _ChunkWriter(part_path)
+        try:
+            async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
+                async with client.stream("GET", cog_url) as response:
+                    response.raise_for_status()
+                    expected_size = _content_length(response.headers)
+                    expected_md5 = _advertised_md5(response.headers)
+                    etag = response.headers.get("etag")
+                    async for chunk in response.aiter_bytes(self.chunk_size):
+                        await writer.write(chunk)
+                        written += len(chunk)
+                        self.downloaded_bytes += len(chunk)
+            await writer.finish()
+            md5 = writer.md5
+        except httpx.HTTPError as e:
+            raise CogDownloadError(f"Failed downloading COG {task_id}: {e}") from e
+        finally:
+            writer.abort()
+
+        if expected_size is not None and written != expected_size:
+            raise CogDownloadError(
+                f"Size mismatch for COG {task_id}: expected {expected_size} bytes, got {written}"
+            )
+        if expected_md5 is not None and md5.digest() != expected_md5:
+            raise CogDownloadError(f"MD5 mismatch for COG {task_id}")
+        return md5.hexdigest(), etag
+
+
+class _ChunkWriter:
+    """
+    Write and hash downloaded chunks on a thread, so disk I/O never blocks the
+    event loop. At most ``depth`` chunks wait in the queue; a full queue makes
+    the download wait for the disk instead of buffering the whole file.
+    """
+
+    def __init__(self, path: str, depth: int = 4):
+        self.md5 = hashlib.md5()
+        self.error: Optional[OSError] = None
+        self._file = open(path, "wb")
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=depth)
+        self._aborted = False
+        self._thread = threading.Thread(target=self._run, name="cog-download-writer", daemon=True)
+        self._thread.start()
+
+    async def write(self, chunk: bytes) -> None:
+        if self.error is not None:
+            raise self.error
+        try:
+            self._queue.put_nowait(chunk)
+        except queue.Full:
+            await asyncio.to_thread(self._queue.put, chunk)
+
+    async def finish(self) -> None:
+        """Wait for queued chunks to be written and fsynced; ``md5`` then covers every byte"""
+        await asyncio.to_thread(self._finish)
+        if self.error is not None:
+            raise self.error
+
+    def abort(self) -> None:
+        """Stop the thread without waiting for it (no-op once finished)"""
+        if not self._thread.is_alive():
+            return
+        self._aborted = True
+        while True:
+            try:
+                self._queue.put_nowait(None)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _finish(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                chunk = self._queue.get()
+                if chunk is None:
+                    break
+                if self.error is not None or self._aborted:
+                    continue
+                try:
+                    self._file.write(chunk)
+                    self.md5.update(chunk)
+                except OSError as e:
+                    self.error = e
+            if self.error is None and not self._aborted:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+        except OSError as e:
+            self.error = e
+        finally:
+            self._file.close()
+
+
+def _content_length(headers: httpx.Headers) -> Optional[int]:
+    # Compressed transfers report the encoded length, not what we write to disk
+    if headers.get("content-encoding", "identity") != "identity":
+        return None
+    try:
+        return int(headers["content-length"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _advertised_md5(headers: httpx.Headers) -> Optional[bytes]:
+    """MD5 from GCS ``x-goog-hash`` or a standard ``Content-MD5`` header"""
+    candidates = []
+    for value in headers.get_list("x-goog-hash"):
+        candidates.extend(part.strip() for part in value.split(","))
+    for part in candidates:
+        if part.startswith("md5="):
+            return _b64decode(part[len("md5="):])
+    if "content-md5" in headers:
+        return _b64decode(headers["content-md5"])
+    return None
+
+
+def _b64decode(value: str) -> Optional[bytes]:
+    try:
+        return base64.b64decode(value)
+    except ValueError:
+        return None
@@ -0,0 +1,199 @@
+"""
+Per-COG-version derived metadata (bounds, native zooms, statistics, coverage) persisted next to the cached file
+"""
+
+import asyncio
+import logging
+import math
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import mercantile
+from pydantic import BaseModel
+from rasterio.warp import transform_bounds
+from rio_tiler.io import COGReader
+
+from cog_downloader import CogDownloadManager
+from tile_coverage import EMPTY, FULL, PARTIAL, CoverageIndex, build_coverage, coverage_path
+from cog_stream import CogStreamSource
+from reader_pool import ReaderPool, file_version, format_version
+
+logger = logging.getLogger(__name__)
+
+
+class CogSidecar(BaseModel):
+    version: str
+    bounds: List[float]  # WGS84 [west, south, east, north]
+    minzoom: int  # native zoom of the coarsest overview
+    maxzoom: int  # native zoom of the full-resolution raster
+    dtype: str
+    count: int
+    colorinterp: List[str]
+    nodata: Optional[float] = None
+    statistics: Dict[str, Any]
+
+    def tile_exists(self, x: int, y: int, z: int) -> bool:
+        """Whether the XYZ tile intersects the raster footprint"""
+        tile = mercantile.bounds(x, y, z)
+        west, south, east, north = self.bounds
+        return tile.west < east and tile.east > west and tile.south < north and tile.north > south
+
+
+def sidecar_path(local_path: str) -> str:
+    return f"{local_path}.meta.json"
+
+
+def build_sidecar(src: COGReader, version: str, stats_max_size: int) -> CogSidecar:
+    """Compute the sidecar from an open reader (blocking; statistics read an overview)"""
+    minx, miny, maxx, maxy = src.dataset.bounds
+    west, south, east, north = transform_bounds(
+        src.dataset.crs, "EPSG:4326", minx, miny, maxx, maxy
+    )
+    try:
+        stats = src.statistics(max_size=stats_max_size)
+        statistics = {
+            str(i + 1): {
+                'min': float(band_stats.min),
+                'max': float(band_stats.max),
+                'mean': float(band_stats.mean),
+                'count': int(band_stats.count),
+                'sum': float(band_stats.sum),
+                'std': float(band_stats.std),
+                'median': float(band_stats.median),
+                'majority': float(band_stats.majority),
+                'minority': float(band_stats.minority),
+                'unique': int(band_stats.unique),
+                'histogram': band_stats.histogram,
+                'valid_percent': float(band_stats.valid_percent),
+                'masked_percent': 100.0 - float(band_stats.valid_percent),
+                'percentile_2': float(band_stats.percentile_2),
+                'percentile_98': float(band_stats.percentile_98)
+            } for i, band_stats in enumerate(stats.values())
+        }
+    except Exception as e:
+        logger.warning(f"Could not compute statistics for {src.input}: {e}")
+        statistics = {}
+
+    nodata = src.dataset.nodata
+    return CogSidecar(
+        version=version,
+        bounds=[west, south, east, north],
+        minzoom=src.minzoom,
+        maxzoom=src.maxzoom,
+        dtype=src.dataset.dtypes[0],
+        count=src.dataset.count,
+        colorinterp=[ci.name for ci in src.dataset.colorinterp],
+        # NaN does not survive JSON; it is the default float nodata anyway
+        nodata=None if nodata is None or math.isnan(nodata) else float(nodata),
+        statistics=statistics,
+    )
+
+
+class CogSidecarStore:
+    """
+    Build each COG version's sidecar once and serve it from memory afterwards.
+
+    The sidecar is written atomically to ``<task>.tif.meta.json`` (and the
+    coverage index to ``<task>.tif.coverage.npz``) so other workers (and
+    restarted ones) load it instead of recomputing; a sidecar whose version
+    does not match the cached file is ignored and rebuilt.
+    """
+
+    def __init__(self, downloader: Union[CogDownloadManager, CogStreamSource], reader_pool: ReaderPool,
+                 stats_max_size: int = 1024, coverage_max_size: int = 1024):
+        self.downloader = downloader
+        self.reader_pool = reader_pool
+        self.stats_max_size = stats_max_size
+        self.coverage_max_size = coverage_max_size
+        self._memo: Dict[str, CogSidecar] = {}
+        self._coverage: Dict[str, CoverageIndex] = {}
+        self._building: Dict[str, asyncio.Task] = {}
+        self.classified = {EMPTY: 0, FULL: 0, PARTIAL: 0}
+
+    def lookup(self, task_id: str) -> Optional[CogSidecar]:
+        """Sidecar for the task's current local COG, if one has been built"""
+        local_path = self.downloader.local_path(task_id)
+        try:
+            version = format_version(file_version(local_path))
+        except OSError:
+            return None
+        sidecar = self._memo.get(task_id)
+        if sidecar is not None and sidecar.version == version:
+            return sidecar
+        try:
+            with open(sidecar_path(local_path), "rb") as f:
+                sidecar = CogSidecar.model_validate_json(f.read())
+        except (OSError, ValueError):
+            return None
+        if sidecar.version != version:
+            return None
+        # A sidecar without its coverage index (e.g. written by an older
+        # version) is rebuilt so the empty-tile fast path is always available
+        try:
+            coverage = CoverageIndex.load(coverage_path(local_path))
+        except (OSError, ValueError, KeyError):
+            return None
+        if coverage.version != version:
+            return None
+        self._memo[task_id] = sidecar
+        self._coverage[task_id] = coverage
+        return sidecar
+
+    def classify(self, task_id: str, version: str, x: int, y: int, z: int) -> str:
+        """EMPTY, FULL or PARTIAL for a tile of the given COG version (PARTIAL if unknown)"""
+        coverage = self._coverage.get(task_id)
+        kind = coverage.classify(x, y, z) if coverage is not None and coverage.version == version else PARTIAL
+        self.classified[kind] += 1
+        return kind
+
+    async def build(self, task_id: str, open_reader: Callable, run: Callable) -> CogSidecar:
+        """
+        Build and persist the sidecar, once per task across concurrent callers.
+
+        ``open_reader`` is an async context manager factory yielding a reader
+        for the task's COG and ``run`` executes the blocking build (e.g.
+        ``render_executor.run``). The shared build borrows its own reader so a
+        caller that disconnects cannot return a handle that is still in use.
+        """
+        task = self._building.get(task_id)
+        if task is None:
+            task = asyncio.ensure_future(self._build(task_id, open_reader, run))
+            self._building[task_id] = task
+            task.add_done_callback(lambda _t: self._building.pop(task_id, None))
+        return await asyncio.shield(task)
+
+    async def _build(self, task_id: str, open_reader: Callable, run: Callable) -> CogSidecar:
+        async with open_reader() as src:
+            version = format_version(self.reader_pool.version_of(src))
+            sidecar = self._memo.get(task_id)
+            if sidecar is None or sidecar.version != version:
+                sidecar, coverage = await run(self._build_and_write, task_id, src, version)
+                self._coverage[task_id] = coverage
+        self._memo[task_id] = sidecar
+        return sidecar
+
+    def _build_and_write(self, task_id: str, src: COGReader, version: str) -> Tuple[CogSidecar, CoverageIndex]:
+        sidecar = build_sidecar(src, version, self.stats_max_size)
+        coverage = build_coverage(src, version, self.coverage_max_size)
+        local_path = self.downloader.local_path(task_id)
+        path = sidecar_path(local_path)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            # Coverage first: the sidecar's presence implies a usable index
+            coverage.save(coverage_path(local_path))
+            with open(tmp_path, "w") as f:
+                f.write(sidecar.model_dump_json())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to persist sidecar for task {task_id}: {e}")
+        return sidecar, coverage
+
+    def invalidate(self, task_id: str) -> None:
+        self._memo.pop(task_id, None)
+        self._coverage.pop(task_id, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "sidecars": len(self._memo),
+            "coverage": dict(self.classified),
+        }
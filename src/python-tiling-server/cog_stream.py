@@ -0,0 +1,463 @@
+"""
+Range-read COG streaming through a persistent local block cache
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+from disk_usage import SharedDiskUsage
+
+logger = logging.getLogger(__name__)
+
+# GDAL /vsicurl/ settings for reading through the loopback block server
+GDAL_STREAM_OPTIONS = {
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+    "VSI_CACHE": "TRUE",
+}
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+)$")
+
+
+class CogStreamError(Exception):
+    """Raised when the COG's server cannot serve byte ranges or returned bad data"""
+
+
+@dataclass
+class RemoteIdentity:
+    url: str
+    size: int
+    etag: str  # ETag, or Last-Modified when the server sends no ETag
+
+    @property
+    def key(self) -> str:
+        """Short digest naming this exact remote object version"""
+        raw = f"{self.size}|{self.etag}"
+        return hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
+
+class CogStreamSource:
+    """
+    Serve COG bytes to GDAL on demand instead of downloading whole files.
+
+    GDAL opens ``/vsicurl/http://127.0.0.1:<port>/<task>/<identity>.tif``,
+    a per-worker loopback server that answers each range read from fixed-size
+    blocks under ``<cache_dir>/<task>.blocks/<identity>/``. Missing blocks are
+    fetched from the COG's URL with one pooled range request per contiguous
+    run (plus ``readahead`` following blocks) and written atomically, so the
+    cache is shared by workers and survives restarts; it is pruned oldest
+    first once it exceeds ``max_bytes``.
+
+    It exposes the same ``acquire``/``release``/``local_path`` interface as
+    the downloaded-file cache: ``local_path`` is a small record of the remote
+    object's size and ETag that is only rewritten when the object changes, so
+    its file version identifies the COG for reader pooling, sidecars and tile
+    cache keys.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        block_size: int = 256 * 1024,
+        max_bytes: int = 5 * 1024 ** 3,
+        readahead: int = 1,
+        revalidate_interval: float = 300.0,
+        timeout: float = 60.0,
+        max_connections: int = 20,
+    ):
+        self.cache_dir = cache_dir
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.readahead = readahead
+        self.revalidate_interval = revalidate_interval
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._lock = threading.Lock()
+        self._identities: Dict[str, RemoteIdentity] = {}
+        self._checked: Dict[str, float] = {}
+        self._inflight: Dict[Tuple[str, str, int], threading.Event] = {}
+        self._client: Optional[httpx.Client] = None
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._disk_usage = SharedDiskUsage(cache_dir, max_bytes, self._disk_files)
+        self.block_hits = 0
+        self.block_misses = 0
+        self.upstream_requests = 0
+        self.upstream_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # Lifecycle
+
+    def start(self) -> None:
+        """Start the pooled upstream client and the loopback block server"""
+        with self._lock:
+            if self._server is not None:
+                return
+            for name, value in GDAL_STREAM_OPTIONS.items():
+                os.environ.setdefault(name, value)
+            self._client = httpx.Client(
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+            self._server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, name="cog-stream", daemon=True).start()
+            logger.info(f"COG block server listening on 127.0.0.1:{self._server.server_address[1]}")
+
+    def close(self) -> None:
+        with self._lock:
+            server, self._server = self._server, None
+            client, self._client = self._client, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        if client is not None:
+            client.close()
+
+    # Cache-compatible interface
+
+    def local_path(self, task_id: str) -> str:
+        """Identity record of the task's remote COG (its file version changes with the object)"""
+        return os.path.join(self.cache_dir, f"{task_id}.tif.stream")
+
+    async def acquire(self, task_id: str, cog_url: str) -> str:
+        """Make sure the remote COG is identified and return its identity record path"""
+        self.start()
+        path = self.local_path(task_id)
+        checked = self._checked.get(task_id)
+        if checked is not None and time.monotonic() - checked < self.revalidate_interval:
+            self._identities[task_id].url = cog_url
+            return path
+        await asyncio.to_thread(self._identify, task_id, cog_url)
+        return path
+
+    def release(self, task_id: str) -> None:
+        """Streamed COGs hold no pins; blocks are evicted by the byte budget alone"""
+
+    def dataset_path(self, task_id: str, path: str) -> str:
+        """Path GDAL should open for an acquired COG"""
+        identity = self._identities[task_id]
+        return f"/vsicurl/http://127.0.0.1:{self._server.server_address[1]}/{task_id}/{identity.key}.tif"
+
+    def content_version(self, task_id: str) -> Optional[str]:
+        """Digest of the remote object's size and ETag (None if not identified yet)"""
+        identity = self._identities.get(task_id) or self._load_record(task_id)
+        return identity.key if identity is not None else None
+
+    def forget(self, task_id: str) -> None:
+        """Re-identify the remote object on next use (another worker purged it)"""
+        self._identities.pop(task_id, None)
+        self._checked.pop(task_id, None)
+
+    def purge(self, task_id: str) -> bool:
+        """Drop the task's identity record and cached blocks; returns whether there were any"""
+        self.forget(task_id)
+        path = self.local_path(task_id)
+        try:
+            os.unlink(path)
+            existed = True
+        except FileNotFoundError:
+            existed = False
+        for suffix in (".meta.json", ".coverage.npz"):
+            try:
+                os.unlink(f"{path}{suffix}")
+            except FileNotFoundError:
+                pass
+        shutil.rmtree(os.path.join(self.cache_dir, f"{task_id}.blocks"), ignore_errors=True)
+        self._disk_usage.reset()
+        return existed
+
+    def _identify(self, task_id: str, cog_url: str) -> None:
+        """Probe the remote object; rewrite the identity record only when it changed"""
+        record = self._load_record(task_id)
+        try:
+            # The first probe also fetches block 0, which holds the COG header
+            probe = self.block_size - 1 if record is None else 0
+            response = self._upstream_get(cog_url, 0, probe)
+            size = _content_range(response)[2]
+            etag = response.headers.get("etag") or response.headers.get("last-modified") or ""
+        except (httpx.HTTPError, CogStreamError) as e:
+            if record is None:
+                raise CogStreamError(f"Cannot stream COG for task {task_id}: {e}")
+            logger.warning(f"Revalidating streamed COG for task {task_id} failed, using cached identity: {e}")
+            record.url = cog_url
+            self._identities[task_id] = record
+            self._checked[task_id] = time.monotonic()
+            return
+
+        identity = RemoteIdentity(url=cog_url, size=size, etag=etag)
+        if record is None or record.key != identity.key:
+            if record is not None:
+                logger.info(f"Remote COG for task {task_id} changed; dropping its cached blocks")
+                shutil.rmtree(self._blocks_dir(task_id, record.key), ignore_errors=True)
+                self._disk_usage.reset()
+            self._write_record(task_id, identity)
+        if probe > 0:
+            self._store_block(task_id, identity.key, 0, response.content)
+        self._identities[task_id] = identity
+        self._checked[task_id] = time.monotonic()
+
+    def _load_record(self, task_id: str) -> Optional[RemoteIdentity]:
+        try:
+            with open(self.local_path(task_id)) as f:
+                return RemoteIdentity(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _write_record(self, task_id: str, identity: RemoteIdentity) -> None:
+        path = self.local_path(task_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"url": identity.url, "size": identity.size, "etag": identity.etag}, f)
+        os.replace(tmp_path, path)
+
+    # Block cache
+
+    def _blocks_dir(self, task_id: str, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{task_id}.blocks", key)
+
+    def _block_path(self, task_id: str, key: str, index: int) -> str:
+        return os.path.join(self._blocks_dir(task_id, key), str(index))
+
+    def read_range(self, task_id: str, key: str, start: int, end: int) -> Iterator[bytes]:
+        """Yield bytes ``start..end`` (inclusive) of the task's COG from the block cache"""
+        identity = self._identities.get(task_id)
+        if identity is None or identity.key != key:
+            raise CogStreamError(f"Unknown COG version {key} for task {task_id}")
+        end = min(end, identity.size - 1)
+        first, last = start // self.block_size, end // self.block_size
+        blocks = self._ensure_blocks(identity, task_id, first, last)
+        for index in range(first, last + 1):
+            data = blocks[index]
+            block_start = index * self.block_size
+            yield data[max(start - block_start, 0):end - block_start + 1]
+
+    def _ensure_blocks(self, identity: RemoteIdentity, task_id: str, first: int, last: int) -> Dict[int, bytes]:
+        key = identity.key
+        blocks: Dict[int, bytes] = {}
+        for index in range(first, last + 1):
+            data = self._read_block(task_id, key, index)
+            if data is not None:
+                blocks[index] = data
+        if len(blocks) == last - first + 1:
+            self.block_hits += len(blocks)
+            return blocks
+        self.block_misses += last - first + 1 - len(blocks)
+
+        # Claim the missing blocks (and read-ahead) nobody else is fetching
+        last_block = (identity.size - 1) // self.block_size
+        wanted = [i for i in range(first, last + 1) if i not in blocks]
+        ahead = range(last + 1, min(last + self.readahead, last_block) + 1)
+        claimed, waiting = [], []
+        with self._lock:
+            for index in wanted + [i for i in ahead if not os.path.exists(self._block_path(task_id, key, i))]:
+                event = self._inflight.get((task_id, key, index))
+                if event is not None:
+                    if index in wanted:
+                        waiting.append((index, event))
+                    continue
+                self._inflight[(task_id, key, index)] = threading.Event()
+                claimed.append(index)
+
+        try:
+            for run_first, run_last in _runs(claimed):
+                fetched = self._fetch_run(identity, run_first, run_last)
+                for offset, data in enumerate(fetched):
+                    index = run_first + offset
+                    self._store_block(task_id, key, index, data)
+                    if first <= index <= last:
+                        blocks[index] = data
+        finally:
+            with self._lock:
+                for index in claimed:
+                    self._inflight.pop((task_id, key, index)).set()
+
+        for index, event in waiting:
+            event.wait(self.timeout)
+            data = self._read_block(task_id, key, index)
+            if data is None:
+                # The other fetch failed; fetch it ourselves
+                data = self._fetch_run(identity, index, index)[0]
+                self._store_block(task_id, key, index, data)
+            blocks[index] = data
+        return blocks
+
+    def _fetch_run(self, identity: RemoteIdentity, first: int, last: int) -> List[bytes]:
+        """Fetch blocks ``first..last`` with a single range request"""
+        start = first * self.block_size
+        end = min((last + 1) * self.block_size, identity.size) - 1
+        response = self._upstream_get(identity.url, start, end)
+        got_start, got_end, size = _content_range(response)
+        data = response.content
+        if got_start != start or got_end != end or size != identity.size or len(data) != end - start + 1:
+            raise CogStreamError(f"Unexpected range {got_start}-{got_end}/{size} for {start}-{end}/{identity.size}")
+        return [data[i:i + self.block_size] for i in range(0, len(data), self.block_size)]
+
+    def _upstream_get(self, url: str, start: int, end: int) -> httpx.Response:
+        if self._client is None:
+            self.start()
+        response = self._client.get(url, headers={"Range": f"bytes={start}-{end}"})
+        self.upstream_requests += 1
+        if response.status_code != 206:
+            raise CogStreamError(f"Range request returned HTTP {response.status_code}")
+        self.upstream_bytes += len(response.content)
+        return response
+
+    def _read_block(self, task_id: str, key: str, index: int) -> Optional[bytes]:
+        path = self._block_path(task_id, key, index)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def _store_block(self, task_id: str, key: str, index: int, data: bytes) -> None:
+        path = self._block_path(task_id, key, index)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to cache COG block {path}: {e}")
+            return
+        # Shared with the other workers, which write blocks into the same tree
+        self._disk_usage.add(len(data) - replaced)
+
+    def _disk_files(self):
+        for root, _, names in os.walk(self.cache_dir):
+            if root == self.cache_dir:
+                continue  # identity records
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield st.st_mtime, path, st.st_size
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "tasks": len(self._identities),
+            "block_hits": self.block_hits,
+            "block_misses": self.block_misses,
+            "upstream_requests": self.upstream_requests,
+            "upstream_bytes": self.upstream_bytes,
+            "max_bytes": self.max_bytes,
+            "disk_prunes": self._disk_usage.prunes,
+        }
+
+
+def _runs(indexes: List[int]) -> Iterator[Tuple[int, int]]:
+    """Group block indexes into contiguous (first, last) runs"""
+    run = None
+    for index in sorted(indexes):
+        if run is not None and index == run[1] + 1:
+            run = (run[0], index)
+            continue
+        if run is not None:
+            yield run
+        run = (index, index)
+    if run is not None:
+        yield run
+
+
+def _content_range(response: httpx.Response) -> Tuple[int, int, int]:
+    match = _CONTENT_RANGE.match(response.headers.get("content-range", ""))
+    if match is None:
+        raise CogStreamError("Missing Content-Range in range response")
+    return int(match.group(1)), int(match.group(2)), int(match.group(3))
+
+
+def _make_handler(source: CogStreamSource):
+    class BlockRequestHandler(BaseHTTPRequestHandler):
+        """Loopback range server used by GDAL's /vsicurl/ driver"""
+
+        protocol_version = "HTTP/1.1"
+
+        def _target(self) -> Optional[Tuple[str, str, RemoteIdentity]]:
+            parts = self.path.strip("/").split("/")
+            if len(parts) != 2 or not parts[1].endswith(".tif"):
+                return None
+            task_id, key = parts[0], parts[1][:-4]
+            identity = source._identities.get(task_id)
+            if identity is None or identity.key != key:
+                return None
+            return task_id, key, identity
+
+        def do_HEAD(self):
+            target = self._target()
+            if target is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(target[2].size))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+
+        def do_GET(self):
+            target = self._target()
+            if target is None:
+                self.send_error(404)
+                return
+            task_id, key, identity = target
+            match = _RANGE.match(self.headers.get("Range", ""))
+            if match is None:
+                start, end, status = 0, identity.size - 1, 200
+            elif match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)) if match.group(2) else identity.size - 1, identity.size - 1)
+                status = 206
+            else:
+                # Suffix range: the last N bytes
+                start, end, status = max(identity.size - int(match.group(2)), 0), identity.size - 1, 206
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{identity.size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            try:
+                chunks = list(source.read_range(task_id, key, start, end))
+            except Exception as e:
+                logger.error(f"Streaming bytes {start}-{end} of task {task_id} failed: {e}")
+                self.send_error(502)
+                return
+            self.send_response(status)
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{identity.size}")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+            for chunk in chunks:
+                self.wfile.write(chunk)
+
+        def log_message(self, format, *args):
+            pass
+
+    return BlockRequestHandler
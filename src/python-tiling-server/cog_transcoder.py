@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Validation of downloaded COGs and background transcoding of poorly optimized ones
+
+    python -m cog_transcoder <source.tif> [<output.tif>] [--compress DEFLATE] [--blocksize 512]
+
+Without an output the file is only validated (exit status 1 if it does not
+conform). The server runs the same command in a child process to rewrite
+non-conforming downloads.
+"""
+
+import argparse
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import rasterio
+import rasterio.shutil
+
+from cog_downloader import CogDownloadManager
+from reader_pool import file_version, format_version
+
+logger = logging.getLogger(__name__)
+
+# Rasters up to this size are served fine from the full-resolution image
+SMALL_RASTER = 1024
+# Largest acceptable internal block edge and coarsest overview edge
+MAX_BLOCK = 1024
+MAX_COARSEST_OVERVIEW = 1024
+# Codecs that benefit from a horizontal differencing predictor
+PREDICTOR_CODECS = {"DEFLATE", "LZW", "ZSTD"}
+
+
+class CogTranscodeError(Exception):
+    """Raised when a COG could not be transcoded"""
+
+
+def validate_cog(path: str) -> List[str]:
+    """Problems that make tiles from this GeoTIFF slow (empty list if it is a usable COG)"""
+    problems = []
+    with rasterio.open(path) as src:
+        size = max(src.width, src.height)
+        if size <= SMALL_RASTER:
+            return problems
+        block_height, block_width = src.block_shapes[0]
+        if not src.profile.get("tiled", False):
+            problems.append(f"not tiled ({block_width}x{block_height} strips)")
+        elif max(block_width, block_height) > MAX_BLOCK:
+            problems.append(f"{block_width}x{block_height} blocks")
+        overviews = src.overviews(1)
+        if not overviews:
+            problems.append("no overviews")
+        elif size / max(overviews) > MAX_COARSEST_OVERVIEW:
+            problems.append(f"overviews stop at {round(size / max(overviews))}px")
+        if src.compression is None:
+            problems.append("uncompressed")
+    return problems
+
+
+def transcode_cog(source: str, output: str, compress: str = "DEFLATE", blocksize: int = 512,
+                  resampling: str = "average") -> None:
+    """Rewrite ``source`` as a tiled, compressed COG with a full overview pyramid (blocking)"""
+    options: Dict[str, Any] = {
+        "COMPRESS": compress.upper(),
+        "BLOCKSIZE": blocksize,
+        # Existing overviews may be partial or built with the wrong resampling
+        "OVERVIEWS": "IGNORE_EXISTING",
+        "RESAMPLING": resampling.upper(),
+        "BIGTIFF": "IF_SAFER",
+        "NUM_THREADS": "ALL_CPUS",
+    }
+    if compress.upper() in PREDICTOR_CODECS:
+        options["PREDICTOR"] = "YES"
+    with rasterio.Env(GDAL_CACHEMAX=512):
+        rasterio.shutil.copy(source, output, driver="COG", **options)
+
+
+def record_path(local_path: str) -> str:
+    """Validation record stored next to a cached COG"""
+    return f"{local_path}.cog.json"
+
+
+class CogTranscoder:
+    """
+    Validate each downloaded COG version once and rewrite non-conforming ones.
+
+    The check runs the first time a worker borrows a reader for a new file
+    version and its outcome is recorded in ``<task>.tif.cog.json``, so other
+    workers and restarts skip it. Files without tiling, overviews or
+    compression are rewritten by ``python -m cog_transcoder`` in a niced
+    child process (at most ``max_concurrent`` per worker; one per file across
+    workers through a ``flock``) while requests keep reading the original.
+    The result replaces the cached file with ``os.replace`` under the
+    download lock, only if the file is still the version that was
+    transcoded. Readers, sidecars and rendered tiles are keyed on the file
+    version, so the next requests switch to the new file on their own;
+    ``on_swap`` drops this worker's idle handles right away.
+    """
+
+    def __init__(
+        self,
+        downloader: CogDownloadManager,
+        compress: str = "DEFLATE",
+        blocksize: int = 512,
+        resampling: str = "average",
+        max_concurrent: int = 1,
+        timeout: float = 3600.0,
+        on_swap: Optional[Callable[[str], None]] = None,
+    ):
+        self.downloader = downloader
+        self.compress = compress
+        self.blocksize = blocksize
+        self.resampling = resampling
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.on_swap = on_swap
+        self._checked: Dict[str, str] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.conforming = 0
+        self.non_conforming = 0
+        self.transcoded = 0
+        self.failed = 0
+        self.transcode_seconds_total = 0.0
+
+    def check(self, task_id: str, version: str) -> None:
+        """Validate the task's COG version once, transcoding it in the background if needed"""
+        if self._checked.get(task_id) == version or task_id in self._tasks:
+            return
+        self._checked[task_id] = version
+        task = asyncio.ensure_future(self._check(task_id, version))
+        self._tasks[task_id] = task
+        task.add_done_callback(lambda _t: self._tasks.pop(task_id, None))
+
+    def is_transcoding(self, task_id: str) -> bool:
+        return task_id in self._tasks
+
+    async def _check(self, task_id: str, version: str) -> None:
+        path = self.downloader.local_path(task_id)
+        try:
+            record = _read_record(path)
+            if record is not None and record.get("version") == version:
+                # Already validated, transcoded, or failed for this version
+                if record["state"] != "non_conforming":
+                    return
+                problems = record["problems"]
+            else:
+                problems = await asyncio.to_thread(validate_cog, path)
+                if not problems:
+                    self.conforming += 1
+                    _write_record(path, {"version": version, "state": "ok", "problems": []})
+                    return
+                self.non_conforming += 1
+                _write_record(path, {"version": version, "state": "non_conforming", "problems": problems})
+            await self._transcode(task_id, path, version, problems)
+        except Exception as e:
+            logger.error(f"COG check for task {task_id} failed: {e}")
+
+    async def _transcode(self, task_id: str, path: str, version: str, problems: List[str]) -> None:
+        lock_fd = os.open(f"{path}.transcode.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Another worker is transcoding this file
+                return
+            record = _read_record(path)
+            if record is not None and record.get("version") != version:
+                return
+            logger.info(f"COG for task {task_id} is not optimized ({', '.join(problems)}); transcoding")
+            part_path = f"{path}.cog.{os.getpid()}.part"
+            started = time.monotonic()
+            try:
+                await self._run_transcoder(path, part_path)
+                remaining = await asyncio.to_thread(validate_cog, part_path)
+                if remaining:
+                    raise CogTranscodeError(f"output still not optimized: {', '.join(remaining)}")
+                new_version = await self._swap(task_id, path, part_path, version)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Transcoding COG for task {task_id} failed: {e}")
+                _write_record(path, {"version": version, "state": "failed", "problems": problems, "error": str(e)})
+                return
+            finally:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+        finally:
+            os.close(lock_fd)
+
+        if new_version is None:
+            logger.info(f"COG for task {task_id} changed while transcoding; result discarded")
+            return
+        seconds = time.monotonic() - started
+        self.transcoded += 1
+        self.transcode_seconds_total += seconds
+        self._checked[task_id] = new_version
+        logger.info(f"Transcoded COG for task {task_id} in {seconds:.1f}s")
+        if self.on_swap is not None:
+            self.on_swap(task_id)
+
+    async def _run_transcoder(self, source: str, output: str) -> None:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        async with self._slots:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, "-m", "cog_transcoder", source, output,
+                "--compress", self.compress,
+                "--blocksize", str(self.blocksize),
+                "--resampling", self.resampling,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                _, stderr = await asyncio.wait_for(process.communicate(), timeout=self.timeout)
+            except BaseException:
+                # Timeout, or the server is shutting down
+                process.kill()
+                await process.wait()
+                raise
+            if process.returncode != 0:
+                message = stderr.decode(errors="replace").strip().splitlines()
+                raise CogTranscodeError(message[-1] if message else f"exit status {process.returncode}")
+
+    async def _swap(self, task_id: str, path: str, part_path: str, version: str) -> Optional[str]:
+        """
+        Replace the cached file with the transcoded one if it is still
+        ``version``, and record the new bytes' checksum as the content version
+        so tile URLs and cache keys of the original are never reused
+        """
+        async with self.downloader.locked(path):
+            try:
+                current = format_version(file_version(path))
+            except OSError:
+                return None
+            if current != version:
+                return None
+            source = _read_json(self.downloader.source_path(task_id)) or {}
+            os.replace(part_path, path)
+            new_version = format_version(file_version(path))
+            await asyncio.to_thread(self.downloader.record_source, task_id, source.get("url"), source.get("etag"))
+        _write_record(path, {"version": new_version, "state": "transcoded", "problems": [], "replaced": version})
+        return new_version
+
+    async def close(self) -> None:
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "conforming": self.conforming,
+            "non_conforming": self.non_conforming,
+            "transcoding": len(self._tasks),
+            "transcoded": self.transcoded,
+            "failed": self.failed,
+            "transcode_seconds_total": round(self.transcode_seconds_total, 3),
+        }
+
+
+def _read_record(local_path: str) -> Optional[Dict[str, Any]]:
+    return _read_json(record_path(local_path))
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_record(local_path: str, record: Dict[str, Any]) -> None:
+    path = record_path(local_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Failed to write COG validation record {path}: {e}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m cog_transcoder", description="Validate or rewrite a GeoTIFF as a COG")
+    parser.add_argument("source")
+    parser.add_argument("output", nargs="?", help="write a COG here (validate only without it)")
+    parser.add_argument("--compress", default="DEFLATE", help="DEFLATE, ZSTD, LZW, JPEG, WEBP, ...")
+    parser.add_argument("--blocksize", type=int, default=512)
+    parser.add_argument("--resampling", default="average", help="overview resampling")
+    parser.add_argument("--nice", type=int, default=10, help="lower the process priority by this much")
+    args = parser.parse_args(argv)
+
+    problems = validate_cog(args.source)
+    for problem in problems:
+        print(f"{args.source}: {problem}", file=sys.stderr)
+    if args.output is None:
+        return 1 if problems else 0
+    if args.nice:
+        os.nice(args.nice)
+    transcode_cog(args.source, args.output, args.compress, args.blocksize, args.resampling)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
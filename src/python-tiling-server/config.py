@@ -3,7 +3,8 @@ Configuration module for the FastAPI Tiling Server
 """
 
 import os
-from typing import List, Optional
+import tempfile
+from typing import Any, Dict, List, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -21,12 +22,59 @@ class Settings(BaseSettings):
     
     # Cache Configuration
     cache_ttl: int = 300  # 5 minutes
+    cache_stale_ttl: int = 600  # serve stale metadata this long past cache_ttl while refreshing
+    cache_negative_ttl: int = 30  # remember backend 404s for unknown tasks
     cache_max_size: int = 1000
+    metadata_shared_db: Optional[str] = None  # SQLite file shared by all workers on the pod
+    metadata_max_connections: int = 20  # pooled connections to the backend
+    cog_cache_dir: str = os.getenv("COG_CACHE_DIR", tempfile.gettempdir())
+    cog_cache_max_bytes: int = 20 * 1024 ** 3  # 20 GiB of downloaded COGs per pod
+    cog_cache_sweep_interval: int = 60  # seconds between background eviction sweeps
+    reader_pool_max_open: int = 32  # open COG dataset handles kept per worker
+    cog_stream: bool = False  # read COGs with HTTP range requests instead of downloading them
+    cog_stream_dir: Optional[str] = None  # block cache (default: <cog_cache_dir>/stream)
+    cog_stream_block_size: int = 256 * 1024
+    cog_stream_max_bytes: int = 5 * 1024 ** 3
+    cog_stream_readahead: int = 1  # extra blocks fetched after each missing run
+    cog_transcode: bool = True  # rewrite downloaded COGs without tiling/overviews/compression
+    cog_transcode_compress: str = "DEFLATE"
+    cog_transcode_blocksize: int = 512
+    cog_transcode_resampling: str = "average"  # overview resampling
+    cog_transcode_concurrency: int = 1  # transcoder processes per worker
+    cog_transcode_timeout: int = 3600
+    tile_cache_max_bytes: int = 256 * 1024 ** 2  # in-memory rendered tiles per worker
+    tile_cache_dir: Optional[str] = None  # enables the shared on-disk tile tier
+    tile_cache_disk_max_bytes: int = 5 * 1024 ** 3
+    versioned_tile_urls: bool = True  # add the COG's content version (v=) to TileJSON/bounds tile URLs
+    invalidation_dir: Optional[str] = None  # cross-worker invalidation markers (default: <cog_cache_dir>/invalidations)
+    invalidation_poll_interval: float = 1.0  # seconds between checks for other workers' invalidations
     
     # Tile Server Configuration
     default_tile_size: int = 256
     zoom_extra_levels: int = 0
+    max_overzoom: int = 3  # zoom levels served past the COG's native resolution
+    sidecar_stats_max_size: int = 1024  # overview size used for per-band statistics
+    coverage_max_size: int = 1024  # mask grid size of the per-COG coverage index
+    encoder_profile: str = "default"  # default, fast, small, quality or a custom one
+    encoder_profiles: Dict[str, Dict[str, Any]] = {}  # JSON: {"name": {"png_zlevel": 9, ...}}
+    empty_tile_no_content: bool = False  # answer tiles with no valid pixels with 204 instead of a transparent image
     max_tile_size: int = 512
+    metatile_size: int = 4  # render N x N tile blocks per read (1 disables metatiling)
+    metatile_min_zoom: int = 0
+    batch_max_tiles: int = 256  # tiles per POST /api/tiles/{task_id}/batch
+    seed_state_dir: Optional[str] = None  # seed job checkpoints (default: <cog_cache_dir>/seed)
+    seed_concurrency: int = 0  # concurrent tiles per seed job; 0 = half the render threads
+    seed_max_tiles: int = 200000  # reject seed jobs larger than this
+    seed_checkpoint_interval: int = 5  # seconds between seed progress checkpoints
+    tile_archive_dir: Optional[str] = None  # serve <task_id>.pmtiles / .mbtiles from here
+    project_tasks_path: str = "/api/tiles/projects/{project_id}/tasks"  # backend list of a project's tasks
+    backend_api_key: Optional[str] = None  # backend API_KEY, sent as X-API-Key when listing a project's tasks
+    mosaic_max_layers: int = 8  # COGs composited per project mosaic tile
+    query_max_geometries: int = 1000  # points or areas per /point or /area request
+    query_max_size: int = 4096  # larger areas are measured on the overview that fits them in this many pixels
+    query_window_size: int = 512  # geometries in the same cell of this many pixels share one read
+    preview_default_size: int = 1024  # longer side of a preview without width or height
+    preview_max_size: int = 4096  # largest preview width/height
     
     # Development/Production Mode
     environment: str = "development"
@@ -37,9 +85,39 @@ class Settings(BaseSettings):
     # Performance Settings
     workers: int = 4
     max_concurrent_requests: int = 100
+    render_threads: int = 0  # 0 = derive from CPU count / workers
+    render_retry_after: int = 1  # Retry-After seconds when the render queue is full
+    render_deadline: float = 10.0  # shed render jobs of requests that cannot start within this many seconds (0 disables)
+    render_overview_max_zoom: int = 18  # tiles up to this zoom are rendered before deeper ones
+    cancel_on_disconnect: bool = True  # cancel GET requests (and their queued renders) when the client goes away
+    trusted_proxies: int = 1  # proxies in front of the server appending to X-Forwarded-For (0 ignores the header)
+    
+    # Warm restarts
+    warm_start: bool = True  # replay the pod's hot set in new workers (metadata, readers, top tiles)
+    hot_set_dir: Optional[str] = None  # per-worker hot set files (default: <cog_cache_dir>/hotset)
+    hot_set_interval: int = 60  # seconds between hot set writes
+    hot_set_half_life: int = 3600  # seconds for a task's or tile's request count to lose half its weight
+    warm_start_tasks: int = 20  # hottest tasks pre-resolved and opened by a new worker
+    warm_start_tiles: int = 200  # hottest tiles pre-rendered by a new worker
+    
+    # Metrics
+    metrics_dir: Optional[str] = None  # per-worker metrics files merged by /metrics (default: <cog_cache_dir>/metrics)
+    metrics_flush_interval: int = 5  # seconds between writes of a worker's metrics file
+    server_timing: bool = True  # add Server-Timing headers with per-stage durations
+    
+    # Profiling (admin endpoints, enabled by admin_api_key)
+    admin_api_key: Optional[str] = None  # sent in the api_key_header header to /admin endpoints
+    profile_dir: Optional[str] = None  # capture ring buffer (default: <cog_cache_dir>/profiles)
+    profile_max_captures: int = 50
+    profile_interval_ms: int = 10  # stack sampling interval
+    profile_max_seconds: int = 300  # longest on-demand profile
+    slow_tile_threshold_ms: int = 1000  # capture tile requests slower than this (0 disables)
+    slow_tile_window: int = 30  # seconds of samples kept for slow-request captures
     
     # Timeouts (seconds)
     metadata_timeout: int = 300  # wait longer for backend /info (300s)
+    cog_download_timeout: int = 300  # per-read timeout while streaming a COG
+    cog_download_lock_timeout: int = 1800  # max wait for another worker's download
     
     # Security Settings
     api_key_header: str = "X-API-Key"
@@ -0,0 +1,106 @@
+"""
+Byte budget of a cache directory shared by every worker through a flock'd counter file
+"""
+
+import fcntl
+import logging
+import os
+from typing import Callable, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (mtime, path, size) of a file the budget may evict
+DiskFile = Tuple[float, str, int]
+
+COUNTER_NAME = ".usage"
+PRUNE_LOCK_NAME = ".prune.lock"
+
+
+class SharedDiskUsage:
+    """
+    Total size of a cache directory, kept in ``<directory>/.usage``.
+
+    Every worker on the pod reads, changes and writes the counter back under
+    an exclusive ``flock``, so all their writes count against one budget
+    instead of each worker tracking only its own. A missing counter (first
+    use, or after ``reset`` following a bulk delete) is recounted from
+    ``files``. Once the total passes ``max_bytes``, one worker at a time
+    removes the oldest files down to ``low_watermark`` of the budget and
+    stores the recounted total, which also corrects any drift.
+
+    ``files`` must not yield the counter and lock files (both start with a dot).
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        files: Callable[[], Iterable[DiskFile]],
+        low_watermark: float = 0.9,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.files = files
+        self.low_watermark = low_watermark
+        self._counter = os.path.join(directory, COUNTER_NAME)
+        self.prunes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, delta: int) -> int:
+        """Count ``delta`` bytes written (or removed); prunes when over budget and returns the total"""
+        total = self._update(lambda current: current + delta)
+        if total > self.max_bytes:
+            total = self.prune()
+        return total
+
+    def total(self) -> int:
+        return self._update(lambda current: current)
+
+    def reset(self) -> None:
+        """Recount from the directory on next use (after removing files in bulk)"""
+        try:
+            os.unlink(self._counter)
+        except FileNotFoundError:
+            pass
+
+    def prune(self) -> int:
+        """Remove the oldest files down to the low watermark; returns the total afterwards"""
+        lock_fd = os.open(os.path.join(self.directory, PRUNE_LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Another worker is already pruning
+                return self.max_bytes
+            files = sorted(self.files())
+            total = sum(size for _, _, size in files)
+            target = int(self.max_bytes * self.low_watermark)
+            for _, path, size in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+            self.prunes += 1
+            self._update(lambda _current: total)
+            return total
+        finally:
+            os.close(lock_fd)
+
+    def _update(self, change: Callable[[int], int]) -> int:
+        fd = os.open(self._counter, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                total = max(0, change(int(os.pread(fd, 32, 0))))
+            except ValueError:
+                # Just created (or unreadable): count what is there, which
+                # already includes the change being recorded
+                total = sum(size for _, _, size in self.files())
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, str(total).encode(), 0)
+            return total
+        finally:
+            os.close(fd)
@@ -0,0 +1,90 @@
+"""
+Named tile encoder profiles (compression levels, quality tiers) and per-profile encode statistics
+"""
+
+import logging
+import threading
+from dataclasses import dataclass, fields, replace
+from typing import Any, Dict, Mapping
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class EncoderProfile:
+    """Encoder settings selected per request (``profile=``) or per deployment (``ENCODER_PROFILE``)"""
+    name: str = "default"
+    png_zlevel: int = 6  # zlib level, 1 (fast) to 9 (small)
+    png_palette: bool = False  # 8-bit palette PNG for colormapped tiles
+    jpeg_quality: int = 85
+    webp_quality: int = 75
+    webp_lossless_masked: bool = False  # lossless WebP when the tile has transparent pixels
+
+    def options(self, driver: str, transparent: bool) -> Dict[str, Any]:
+        """Creation options for rio-tiler's ``render``"""
+        if driver == "PNG":
+            return {"zlevel": self.png_zlevel}
+        if driver == "JPEG":
+            return {"quality": self.jpeg_quality}
+        if driver == "WEBP":
+            if transparent and self.webp_lossless_masked:
+                return {"lossless": True}
+            return {"quality": self.webp_quality, "lossless": False}
+        return {}
+
+
+# "default" matches rio-tiler's img_profiles, so existing tiles are unchanged
+BUILTIN_PROFILES: Dict[str, EncoderProfile] = {
+    profile.name: profile
+    for profile in (
+        EncoderProfile(),
+        EncoderProfile(name="fast", png_zlevel=1, jpeg_quality=75, webp_quality=60),
+        EncoderProfile(name="small", png_zlevel=9, png_palette=True, jpeg_quality=70, webp_quality=60),
+        EncoderProfile(name="quality", jpeg_quality=95, webp_quality=90, webp_lossless_masked=True),
+    )
+}
+
+
+def load_profiles(overrides: Mapping[str, Mapping[str, Any]]) -> Dict[str, EncoderProfile]:
+    """Built-in profiles updated/extended with ``{name: {field: value}}`` from the settings"""
+    profiles = dict(BUILTIN_PROFILES)
+    known = {f.name for f in fields(EncoderProfile)} - {"name"}
+    for name, values in overrides.items():
+        unknown = set(values) - known
+        if unknown:
+            raise ValueError(f"Unknown encoder profile fields for {name}: {sorted(unknown)}")
+        profiles[name] = replace(profiles.get(name, EncoderProfile()), name=name, **values)
+    return profiles
+
+
+class EncoderStats:
+    """Thread-safe encode counters per (profile, media type)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (profile, media_type) -> [tiles, seconds, bytes]
+        self._counters: Dict[tuple, list] = {}
+
+    def record(self, profile: str, media_type: str, seconds: float, size: int) -> None:
+        with self._lock:
+            counter = self._counters.setdefault((profile, media_type), [0, 0.0, 0])
+            counter[0] += 1
+            counter[1] += seconds
+            counter[2] += size
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            counters = {key: list(value) for key, value in self._counters.items()}
+        result: Dict[str, Dict[str, Any]] = {}
+        for (profile, media_type), (tiles, seconds, size) in sorted(counters.items()):
+            result.setdefault(profile, {})[media_type] = {
+                "tiles": tiles,
+                "bytes": size,
+                "avg_bytes": round(size / tiles),
+                "avg_encode_ms": round(seconds / tiles * 1000, 3),
+            }
+        return result
+
+
+encoder_stats = EncoderStats()
+
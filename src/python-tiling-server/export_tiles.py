@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Bake a task's tile pyramid into a PMTiles or MBTiles archive
+
+    python -m export_tiles <task_id> [--archive pmtiles] [--minzoom 14] [--maxzoom 21] ...
+
+Without --output the archive is written to TILE_ARCHIVE_DIR as
+<task_id>.pmtiles (or .mbtiles), where the tile endpoints pick it up and serve
+matching requests from it instead of rendering. The render parameters
+(format, size, rescale, color map, nodata, WebP) are baked in; requests with
+other parameters keep being rendered live.
+"""
+
+import argparse
+import asyncio
+import sys
+
+from fastapi import HTTPException
+
+from main import (
+    SeedRequest,
+    export_archive,
+    metadata_resolver,
+    reader_pool,
+    render_executor,
+    settings,
+)
+from tile_archive import ARCHIVE_FORMATS
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m export_tiles", description="Export a task's tiles to an archive")
+    parser.add_argument("task_id")
+    parser.add_argument("--archive", choices=ARCHIVE_FORMATS, default="pmtiles")
+    parser.add_argument("--output", default=None, help="archive path (default: TILE_ARCHIVE_DIR/<task_id>.<archive>)")
+    parser.add_argument("--minzoom", type=int, default=None)
+    parser.add_argument("--maxzoom", type=int, default=None)
+    parser.add_argument("--bounds", default=None, help="west,south,east,north (default: the COG's bounds)")
+    parser.add_argument("--format", default="png")
+    parser.add_argument("--size", type=int, default=settings.default_tile_size)
+    parser.add_argument("--rescale", default=None, help="min,max")
+    parser.add_argument("--color-map", default=None)
+    parser.add_argument("--nodata", default=None)
+    parser.add_argument("--no-webp", action="store_true", help="bake the PNG variant for clients without WebP")
+    parser.add_argument("--profile", default=None, help="encoder profile (default: ENCODER_PROFILE)")
+    parser.add_argument("--expression", default=None, help='band math, e.g. "where(b1 > 45, b1, nan)"')
+    parser.add_argument("--concurrency", type=int, default=None)
+    parser.add_argument("--backend-base-url", default=None)
+    return parser.parse_args(argv)
+
+
+async def export(args: argparse.Namespace) -> int:
+    body = SeedRequest(
+        minzoom=args.minzoom,
+        maxzoom=args.maxzoom,
+        bounds=[float(v) for v in args.bounds.split(",")] if args.bounds else None,
+        format=args.format,
+        size=args.size,
+        rescale=args.rescale,
+        color_map=args.color_map,
+        nodata=args.nodata,
+        webp=not args.no_webp,
+        profile=args.profile,
+        expression=args.expression,
+    )
+    await metadata_resolver.start()
+    try:
+        path, count = await export_archive(
+            args.task_id, body, args.archive,
+            output=args.output, backend_base_url=args.backend_base_url, concurrency=args.concurrency,
+        )
+    except HTTPException as e:
+        print(f"Cannot export task {args.task_id}: {e.detail}", file=sys.stderr)
+        return 1
+    finally:
+        await metadata_resolver.close()
+        render_executor.shutdown()
+        reader_pool.close()
+    print(f"Wrote {count} tiles to {path}")
+    return 0
+
+
+def main(argv=None) -> int:
+    return asyncio.run(export(parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
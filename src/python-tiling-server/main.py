@@ -4,31 +4,32 @@ FastAPI Tiling Server for COG Orthomosaic Images
 Based on WebODM's tiling implementation
 """
 
+import asyncio
+import hashlib
+import hmac
 import logging
 import os
 import json
-from typing import Optional, Dict, Any, List
+import re
+import struct
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Tuple
 from pathlib import Path
 
-import httpx
 import numpy as np
-from fastapi import FastAPI, HTTPException, Query, Path as PathParam, Response, Request
+from fastapi import FastAPI, Depends, HTTPException, Query, Path as PathParam, Response, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from cachetools import LRUCache
 from pydantic import BaseModel
 import uvicorn
 from dotenv import load_dotenv
 
-from rio_tiler.io import COGReader
 from rio_tiler.errors import TileOutsideBounds, InvalidColorMapName
-from rio_tiler.models import ImageData
-from rio_tiler.profiles import img_profiles
 from rio_tiler.colormap import cmap as colormap
 import mercantile
-from cachetools import TTLCache
 import rasterio
-from rasterio.crs import CRS
-from rasterio.warp import transform_bounds
 
 # Load environment variables
 load_dotenv()
@@ -40,41 +41,238 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize FastAPI app
-app = FastAPI(
-    title="Solar Panel Tiling Server",
-    description="High-performance tile server for COG orthomosaic images",
-    version="1.0.0"
-)
-
 # Import configuration
 from config import get_settings
+from cog_downloader import CogDownloadManager, CogDownloadError
+from cog_cache import CogDiskCache
+from cog_stream import CogStreamSource, CogStreamError
+from reader_pool import ReaderPool
+from render_executor import (
+    PRIORITY_BACKGROUND, PRIORITY_DETAIL, PRIORITY_OVERVIEW,
+    RenderExecutor, RenderQueueFull, SchedulingMiddleware, job_context,
+)
+from reader_pool import file_version, format_version
+from cog_sidecar import CogSidecar, CogSidecarStore
+from cog_transcoder import CogTranscoder
+from tile_coverage import EMPTY, FULL
+from encoder_profiles import encoder_stats, load_profiles
+import metrics
+from metrics import MetricsMiddleware, timed
+from profiler import CaptureInfo, CaptureStore, SlowRequestMiddleware, StackSampler, to_collapsed, to_speedscope
+from tile_render import TileParams, render_tile, render_preview, read_tile, read_metatile, encode_tiles, metatile_origin
+from tile_cache import TileCache, CachedTile, make_etag, etag_matches, make_key
+from metadata_resolver import MetadataResolver, SharedMetadataStore, TaskNotFound, MetadataFetchError
+from tile_seeder import TileSeeder, SeedState, seed_tiles
+from tile_archive import TileArchiveStore, TileArchiveWriter, render_key
+from project_mosaic import MosaicLayer, ProjectIndex, ProjectIndexStore, render_mosaic
+from cache_invalidation import InvalidationBus
+from warm_start import HotSet, preload
+from band_expression import InvalidExpression, compile_expression
+from pixel_query import AreaStats, InvalidQuery, PointValue, parse_geometry, parse_point, query_areas, query_points
+from pmtiles.tile import zxy_to_tileid
 
 # Get settings
 settings = get_settings()
 
+# GDAL drivers and Pillow plugins, initialized once in the gunicorn master with --preload
+preload()
+
+# Worker state directories (inside the COG cache directory unless configured)
+metrics_dir = settings.metrics_dir or os.path.join(settings.cog_cache_dir, "metrics")
+profile_dir = settings.profile_dir or os.path.join(settings.cog_cache_dir, "profiles")
+seed_state_dir = settings.seed_state_dir or os.path.join(settings.cog_cache_dir, "seed")
+hot_set_dir = settings.hot_set_dir or os.path.join(settings.cog_cache_dir, "hotset")
+invalidation_dir = settings.invalidation_dir or os.path.join(settings.cog_cache_dir, "invalidations")
+cog_stream_dir = settings.cog_stream_dir or os.path.join(settings.cog_cache_dir, "stream")
+
+# Per-stage histograms and component counters, merged across workers by /metrics
+metrics_registry = metrics.configure(
+    metrics_dir,
+    flush_interval=settings.metrics_flush_interval,
+)
+
+# Stack sampler for on-demand profiles and slow tile captures (ring buffer shared by workers)
+stack_sampler = StackSampler(
+    CaptureStore(
+        profile_dir,
+        max_captures=settings.profile_max_captures,
+    ),
+    interval=settings.profile_interval_ms / 1000,
+    window=settings.slow_tile_window,
+)
+capture_slow_tiles = bool(settings.admin_api_key) and settings.slow_tile_threshold_ms > 0
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop background workers"""
+    await metadata_resolver.start()
+    metrics_registry.start_flusher()
+    if capture_slow_tiles:
+        stack_sampler.start_continuous()
+    cog_cache.start_sweeper()
+    if cog_stream is not None:
+        cog_stream.start()
+    invalidations.start()
+    warm_up = None
+    if settings.warm_start:
+        hot_set.start_flusher(hot_set_metadata)
+        warm_up = asyncio.create_task(rehydrate_hot_set())
+    yield
+    if warm_up is not None:
+        warm_up.cancel()
+        await asyncio.gather(warm_up, return_exceptions=True)
+        await hot_set.stop_flusher(hot_set_metadata)
+    await invalidations.stop()
+    await tile_seeder.close()
+    if cog_transcoder is not None:
+        await cog_transcoder.close()
+    await metadata_resolver.close()
+    render_executor.shutdown()
+    reader_pool.close()
+    if tile_archives is not None:
+        tile_archives.close()
+    await cog_cache.stop_sweeper()
+    if cog_stream is not None:
+        cog_stream.close()
+    await metrics_registry.stop_flusher()
+    stack_sampler.stop()
+
+# Initialize FastAPI app
+app = FastAPI(
+    title="Solar Panel Tiling Server",
+    description="High-performance tile server for COG orthomosaic images",
+    version="1.0.0",
+    lifespan=lifespan,
+)
+
 # CORS configuration (allow only the two origins)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["https://drospect.ai", "https://dev.drospect.ai"],
     allow_credentials=True,
-    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
     allow_headers=["*"],
 )
 
-# Cache for task metadata (keep to avoid many /info calls)
-task_cache = TTLCache(maxsize=settings.cache_max_size, ttl=settings.cache_ttl)
+# Render job client, deadline and priority; GET requests are cancelled when
+# their client disconnects (inside the middlewares below, which record it as 499)
+app.add_middleware(
+    SchedulingMiddleware,
+    deadline=settings.render_deadline,
+    cancel_on_disconnect=settings.cancel_on_disconnect,
+    trusted_proxies=settings.trusted_proxies,
+)
+
+# Profile and stage breakdown of slow tile requests (inside the metrics
+# middleware, which collects the stages)
+app.add_middleware(
+    SlowRequestMiddleware,
+    sampler=stack_sampler,
+    handlers={"get_tile", "get_tile_png", "get_tile_default", "get_mosaic_tile", "get_mosaic_tile_default"},
+    threshold=settings.slow_tile_threshold_ms / 1000 if capture_slow_tiles else 0,
+)
+
+# Request latency histograms and Server-Timing headers
+app.add_middleware(MetricsMiddleware, server_timing_header=settings.server_timing)
 
-# Simple mapping for backend selection also add the localhost:8000 for local development
+# Shared COG downloader (single-flight per task across coroutines and workers)
+cog_downloads = CogDownloadManager(
+    settings.cog_cache_dir,
+    timeout=settings.cog_download_timeout,
+    lock_timeout=settings.cog_download_lock_timeout,
+)
+
+# Byte-budgeted LRU cache of downloaded COGs; open readers pin their file.
+# Worker state kept inside the cache directory counts against its budget
+cog_cache = CogDiskCache(
+    cog_downloads,
+    max_bytes=settings.cog_cache_max_bytes,
+    sweep_interval=settings.cog_cache_sweep_interval,
+    state_dirs=[metrics_dir, profile_dir, seed_state_dir, hot_set_dir, invalidation_dir],
+)
+
+# Opt-in streaming mode: read only the byte ranges GDAL needs through a
+# persistent block cache instead of downloading whole COGs first
+cog_stream = CogStreamSource(
+    cog_stream_dir,
+    block_size=settings.cog_stream_block_size,
+    max_bytes=settings.cog_stream_max_bytes,
+    readahead=settings.cog_stream_readahead,
+    timeout=settings.cog_download_timeout,
+) if settings.cog_stream else None
+
+# Open dataset handles reused across requests (closed LRU beyond the limit)
+reader_pool = ReaderPool(cog_stream or cog_cache, max_open=settings.reader_pool_max_open)
+
+# Bounds, native zooms and statistics computed once per COG version
+cog_sidecars = CogSidecarStore(
+    cog_stream or cog_downloads, reader_pool,
+    stats_max_size=settings.sidecar_stats_max_size,
+    coverage_max_size=settings.coverage_max_size,
+)
+
+def on_cog_transcoded(task_id: str) -> None:
+    """Retire handles, sidecars and tiles of the file a transcoded COG replaced, in every worker"""
+    forget_task(task_id)
+    invalidations.publish(task_id)
+
+# Downloaded COGs without tiling, overviews or compression are rewritten in a
+# background process and swapped in; streamed COGs are read where they are
+cog_transcoder = CogTranscoder(
+    cog_downloads,
+    compress=settings.cog_transcode_compress,
+    blocksize=settings.cog_transcode_blocksize,
+    resampling=settings.cog_transcode_resampling,
+    max_concurrent=settings.cog_transcode_concurrency,
+    timeout=settings.cog_transcode_timeout,
+    on_swap=on_cog_transcoded,
+) if settings.cog_transcode and not settings.cog_stream else None
+
+# Bounded thread pool for tile read/render/encode so the event loop stays responsive;
+# max_concurrent_requests is split across gunicorn workers
+render_executor = RenderExecutor(
+    max_workers=settings.render_threads or max(2, (os.cpu_count() or 2) // max(1, settings.workers)),
+    max_pending=max(1, settings.max_concurrent_requests // max(1, settings.workers)),
+)
+
+# Rendered tiles (memory LRU + optional shared disk tier)
+tile_cache = TileCache(
+    max_bytes=settings.tile_cache_max_bytes,
+    disk_dir=settings.tile_cache_dir,
+    disk_max_bytes=settings.tile_cache_disk_max_bytes,
+)
+
+# Pre-rendered PMTiles/MBTiles archives, answered from memory maps
+tile_archives = TileArchiveStore(settings.tile_archive_dir) if settings.tile_archive_dir else None
+
+# Metatile renders in flight, shared by requests for tiles of the same block
+metatile_inflight: Dict[tuple, asyncio.Task] = {}
+metatile_waiters: Dict[asyncio.Task, int] = {}
+
+# One rendered copy of the fully transparent tile per task version and render
+# parameters, served for every tile the coverage index says is empty
+empty_tiles: LRUCache = LRUCache(maxsize=1024)
+NO_CONTENT_TILE = CachedTile(content=b"", media_type="image/png", etag=make_etag(b""))
+
+# Tile pyramid pre-seeding jobs (checkpointed so they can be resumed)
+tile_seeder = TileSeeder(
+    seed_state_dir,
+    checkpoint_interval=settings.seed_checkpoint_interval,
+    retry_delay=settings.render_retry_after,
+)
+
+# Named encoder profiles (built-ins plus ENCODER_PROFILES overrides)
+encoder_profiles = load_profiles(settings.encoder_profiles)
+if settings.encoder_profile not in encoder_profiles:
+    raise ValueError(f"Unknown ENCODER_PROFILE {settings.encoder_profile}")
+
+# Backends a request may select with backend_base_url (plus BACKEND_BASE_URL),
+# including localhost:8000 for local development
 DOMAIN_TO_BACKEND = {
     "drospect.ai": "https://drospect.ai",
     "dev.drospect.ai": "https://dev.drospect.ai",
     "localhost:8000": "http://localhost:8000",
 }
-DEFAULT_BACKEND = "https://drospect.ai"
-
-# Cache for task metadata (keep to avoid many /info calls)
-task_cache = TTLCache(maxsize=settings.cache_max_size, ttl=settings.cache_ttl)
 
 # Pydantic models
 class TaskMetadata(BaseModel):
@@ -86,6 +284,7 @@ class TaskMetadata(BaseModel):
     maxZoom: Optional[int] = None
     minZoom: Optional[int] = None
     status: str
+    createdAt: Optional[str] = None  # ISO 8601; newer tasks win in project mosaics
 
 class TileJsonResponse(BaseModel):
     tilejson: str = "2.1.0"
@@ -101,6 +300,52 @@ class BoundsResponse(BaseModel):
     url: str
     bounds: List[float]
 
+class BatchTileRequest(BaseModel):
+    tiles: List[List[int]]  # [[z, x, y], ...]
+    format: str = "png"
+    size: int = settings.default_tile_size
+    rescale: Optional[str] = None
+    color_map: Optional[str] = None
+    nodata: Optional[str] = None
+    profile: Optional[str] = None  # encoder profile (default: ENCODER_PROFILE)
+    expression: Optional[str] = None  # band math, e.g. "where(b1 > 45, b1, nan)"
+
+class SeedRequest(BaseModel):
+    minzoom: Optional[int] = None  # default: lowest served zoom
+    maxzoom: Optional[int] = None  # default: the COG's native max zoom
+    bounds: Optional[List[float]] = None  # default: the COG's bounds
+    format: str = "png"
+    size: int = settings.default_tile_size
+    rescale: Optional[str] = None
+    color_map: Optional[str] = None
+    nodata: Optional[str] = None
+    webp: bool = True  # seed the variant served to browsers that accept WebP
+    profile: Optional[str] = None  # encoder profile (default: ENCODER_PROFILE)
+    expression: Optional[str] = None  # band math, e.g. "where(b1 > 45, b1, nan)"
+
+class PointQueryRequest(BaseModel):
+    points: List[Any]  # [lon, lat] pairs or GeoJSON Points / Features
+
+class AreaQueryRequest(BaseModel):
+    geometries: Optional[List[Dict[str, Any]]] = None  # GeoJSON Polygons / MultiPolygons or Features
+    features: Optional[List[Dict[str, Any]]] = None  # or a FeatureCollection as the body
+    max_size: Optional[int] = None  # measure larger areas on an overview (default and cap: QUERY_MAX_SIZE)
+    all_touched: bool = False  # count every pixel the geometry touches, not only those whose center is inside
+
+class InvalidateRequest(BaseModel):
+    version: Optional[str] = None  # new content version; a no-op when it is already current
+
+class InvalidateResponse(BaseModel):
+    task_id: str
+    previous_version: Optional[str] = None
+    purged: bool
+
+class PointQueryResponse(BaseModel):
+    points: List[PointValue]
+
+class AreaQueryResponse(BaseModel):
+    areas: List[AreaStats]
+
 class MetadataResponse(BaseModel):
     bounds: List[float]
     minzoom: int
@@ -111,65 +356,220 @@ class MetadataResponse(BaseModel):
     nodata: Optional[float] = None
     statistics: Dict[str, Any]
     
-def resolve_backend_base_url(request: Optional[Request]) -> str:
-    """
-    Minimal selection:
-      - Take Origin host, else Referer host.
-      - Map host to backend.
-      - Default to prod.
-    """
-    print(f"Request headers: {request.headers}")
-    print(f"Request referer: {request.headers.get('referer')}")
-    try:
-        if request is None:
-            return DEFAULT_BACKEND
-        # get origin from request.headers.host
-        h = request.headers.get("origin") or request.headers.get("referer") or request.headers.get("host") or ""
-        return DOMAIN_TO_BACKEND.get(h, DEFAULT_BACKEND)
-    except Exception:
-        return DEFAULT_BACKEND
+# Task metadata resolver (keep to avoid many /info calls): pooled client,
+# coalesced lookups, negative caching of 404s and stale-while-revalidate
+metadata_resolver = MetadataResolver(
+    settings.backend_base_url,
+    parse=TaskMetadata.model_validate,
+    ttl=settings.cache_ttl,
+    stale_ttl=settings.cache_stale_ttl,
+    negative_ttl=settings.cache_negative_ttl,
+    maxsize=settings.cache_max_size,
+    timeout=settings.metadata_timeout,
+    max_connections=settings.metadata_max_connections,
+    shared_store=SharedMetadataStore(settings.metadata_shared_db) if settings.metadata_shared_db else None,
+    project_tasks_path=settings.project_tasks_path,
+    allowed_backend_urls=DOMAIN_TO_BACKEND.values(),
+    api_key=settings.backend_api_key,
+)
+
+async def load_project_layers(project_id: int, backend_base_url: Optional[str]) -> List[MosaicLayer]:
+    """The project's tasks with a COG, newest first, with their WGS84 footprints"""
+    tasks = [task for task in await metadata_resolver.list_project(project_id, backend_base_url) if task.cogUrl]
+    # Stable sort: undated tasks follow dated ones in the backend's order
+    tasks.sort(key=lambda task: task.createdAt or "", reverse=True)
+    
+    async def footprint(task: TaskMetadata) -> Optional[List[float]]:
+        sidecar = cog_sidecars.lookup(task.id)
+        if sidecar is not None:
+            return sidecar.bounds
+        if task.bounds is not None and len(task.bounds) == 4:
+            return task.bounds
+        try:
+            return (await get_cog_sidecar(task.cogUrl, task.id)).bounds
+        except Exception as e:
+            logger.warning(f"Leaving task {task.id} out of project {project_id} mosaic: {e}")
+            return None
+    
+    footprints = await asyncio.gather(*(footprint(task) for task in tasks))
+    return [
+        MosaicLayer(task.id, task.cogUrl, tuple(bounds), task.minZoom, task.maxZoom)
+        for task, bounds in zip(tasks, footprints)
+        if bounds is not None
+    ]
+
+# Project mosaics: R-tree of each project's task footprints, rebuilt with the metadata TTL
+project_indexes = ProjectIndexStore(load_project_layers, ttl=settings.cache_ttl)
+
+def forget_task(task_id: str) -> None:
+    """Drop this worker's in-memory state of a task whose content changed"""
+    metadata_resolver.invalidate(task_id)
+    reader_pool.invalidate(task_id)
+    cog_sidecars.invalidate(task_id)
+    tile_cache.invalidate(task_id)
+    for key in [key for key in list(empty_tiles.keys()) if key[0] == task_id]:
+        empty_tiles.pop(key, None)
+    for project_id in project_indexes.invalidate_task(task_id):
+        tile_cache.invalidate(f"project:{project_id}")
+    if tile_archives is not None:
+        tile_archives.invalidate(task_id)
+    if cog_stream is not None:
+        cog_stream.forget(task_id)
+
+# Recently active tasks and hottest tiles, replayed by new workers
+hot_set = HotSet(
+    hot_set_dir,
+    interval=settings.hot_set_interval,
+    half_life=settings.hot_set_half_life,
+)
+
+def hot_set_metadata(task_id: str) -> Optional[Tuple[dict, float]]:
+    """Cached metadata of a task and when it was fetched, for the hot set file"""
+    task_metadata = metadata_resolver.peek(task_id)
+    if task_metadata is None:
+        return None
+    return task_metadata.model_dump(), metadata_resolver.fetched_at(task_id)
+
+# Invalidations published by one worker are applied by every other worker on the pod
+invalidations = InvalidationBus(
+    invalidation_dir,
+    on_purge=forget_task,
+    poll_interval=settings.invalidation_poll_interval,
+)
+
+# Component counters mirrored into metrics when the worker's metrics file is written
+metadata_lookups = metrics_registry.counter(
+    "tiler_metadata_lookups_total", "Task metadata lookups by result", ("result",))
+tile_cache_lookups = metrics_registry.counter(
+    "tiler_tile_cache_lookups_total", "Rendered tile cache lookups by result", ("result",))
+cog_cache_lookups = metrics_registry.counter(
+    "tiler_cog_cache_lookups_total", "Downloaded COG cache lookups by result", ("result",))
+cog_cache_evictions = metrics_registry.counter("tiler_cog_cache_evictions_total", "COGs evicted from the disk cache")
+cog_downloads_total = metrics_registry.counter("tiler_cog_downloads_total", "COGs downloaded")
+cog_download_bytes = metrics_registry.counter("tiler_cog_download_bytes_total", "Bytes of COGs downloaded")
+cog_stream_blocks = metrics_registry.counter(
+    "tiler_cog_stream_blocks_total", "Streaming block cache lookups by result", ("result",))
+cog_stream_bytes = metrics_registry.counter(
+    "tiler_cog_stream_upstream_bytes_total", "Bytes fetched with range requests in streaming mode")
+reader_borrows = metrics_registry.counter(
+    "tiler_reader_borrows_total", "Dataset handles borrowed from the reader pool by result", ("result",))
+readers_open = metrics_registry.gauge("tiler_readers_open", "Open COG dataset handles")
+renders_running = metrics_registry.gauge("tiler_render_jobs_running", "Render executor jobs running")
+renders_queued = metrics_registry.gauge("tiler_render_jobs_queued", "Render executor jobs waiting for a thread")
+renders_rejected = metrics_registry.counter(
+    "tiler_render_jobs_rejected_total", "Render jobs rejected with 503 because the queue was full")
+renders_dropped = metrics_registry.counter(
+    "tiler_render_jobs_dropped_total", "Render jobs shed for priority or deadline, or cancelled by their client",
+    ("reason",))
+cog_validations = metrics_registry.counter(
+    "tiler_cog_validations_total", "Downloaded COG versions validated by result", ("result",))
+cog_transcodes = metrics_registry.counter(
+    "tiler_cog_transcodes_total", "Background COG transcodes by result", ("result",))
+mosaic_layers = metrics_registry.counter(
+    "tiler_mosaic_layers_total", "Project mosaic layers by result (read, or skipped by the coverage index)", ("result",))
+cog_transcode_seconds = metrics_registry.counter(
+    "tiler_cog_transcode_seconds_total", "Time spent transcoding non-conforming COGs")
+tiles_classified = metrics_registry.counter(
+    "tiler_tile_coverage_total", "Tiles classified by the coverage index", ("coverage",))
+tiles_encoded = metrics_registry.counter(
+    "tiler_tiles_encoded_total", "Tiles encoded by profile and media type", ("profile", "media_type"))
+tile_bytes_encoded = metrics_registry.counter(
+    "tiler_tile_bytes_encoded_total", "Bytes of encoded tiles by profile and media type", ("profile", "media_type"))
+
+def collect_component_metrics() -> None:
+    metadata = metadata_resolver.snapshot()
+    for result in ("hits", "stale_hits", "negative_hits", "shared_hits", "fetches"):
+        metadata_lookups.set(metadata[result], result)
+    tiles = tile_cache.snapshot()
+    for result in ("memory_hits", "disk_hits", "misses"):
+        tile_cache_lookups.set(tiles[result], result)
+    cogs = cog_cache.snapshot()
+    cog_cache_lookups.set(cogs["hits"], "hits")
+    cog_cache_lookups.set(cogs["misses"], "misses")
+    cog_cache_evictions.set(cogs["evictions"])
+    cog_downloads_total.set(cogs["downloads"])
+    cog_download_bytes.set(cogs["downloaded_bytes"])
+    if cog_stream is not None:
+        stream = cog_stream.snapshot()
+        cog_stream_blocks.set(stream["block_hits"], "hits")
+        cog_stream_blocks.set(stream["block_misses"], "misses")
+        cog_stream_bytes.set(stream["upstream_bytes"])
+    if cog_transcoder is not None:
+        transcoder = cog_transcoder.snapshot()
+        cog_validations.set(transcoder["conforming"], "conforming")
+        cog_validations.set(transcoder["non_conforming"], "non_conforming")
+        cog_transcodes.set(transcoder["transcoded"], "transcoded")
+        cog_transcodes.set(transcoder["failed"], "failed")
+        cog_transcode_seconds.set(transcoder["transcode_seconds_total"])
+    mosaics = project_indexes.snapshot()
+    mosaic_layers.set(mosaics["layers_read"], "read")
+    mosaic_layers.set(mosaics["layers_skipped"], "skipped")
+    readers = reader_pool.snapshot()
+    reader_borrows.set(readers["reused"], "reused")
+    reader_borrows.set(readers["opened"], "opened")
+    readers_open.set(readers["open"])
+    renders = render_executor.snapshot()
+    renders_running.set(renders["running"])
+    renders_queued.set(renders["queue_depth"])
+    renders_rejected.set(renders["rejected"])
+    renders_dropped.set(renders["shed"], "shed")
+    renders_dropped.set(renders["cancelled"], "cancelled")
+    for coverage, count in cog_sidecars.snapshot()["coverage"].items():
+        tiles_classified.set(count, coverage)
+    for profile, media_types in encoder_stats.snapshot().items():
+        for media_type, stats in media_types.items():
+            tiles_encoded.set(stats["tiles"], profile, media_type)
+            tile_bytes_encoded.set(stats["bytes"], profile, media_type)
+
+metrics_registry.add_collector(collect_component_metrics)
+
+# Task ids end up in cache file names and backend URLs
+TASK_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
 
 # Utility functions
+def check_task_id(task_id: str) -> None:
+    """Reject task ids that are not a plain token with a 400"""
+    if not TASK_ID_PATTERN.fullmatch(task_id):
+        raise HTTPException(status_code=400, detail="Invalid task ID")
+
 async def get_task_metadata(task_id: str, backend_base_url: Optional[str] = None) -> TaskMetadata:
     """Fetch task metadata from backend API with caching"""
-    if task_id in task_cache:
-        return task_cache[task_id]
-    backend_base_url_api = backend_base_url or settings.backend_base_url
-    print(f"Backend base URL API: {backend_base_url_api}")
+    check_task_id(task_id)
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(    
-                f"{backend_base_url_api}/api/tiles/{task_id}/info",
-                timeout=settings.metadata_timeout,
-            )
-            response.raise_for_status()
-            data = response.json()
-            
-            task_metadata = TaskMetadata(**data)
-            task_cache[task_id] = task_metadata
-            return task_metadata
-            
-    except httpx.HTTPError as e:
-        logger.error(f"Failed to fetch task metadata for {task_id}: {e.response.text}")
+        with timed("metadata"):
+            task_metadata = await metadata_resolver.resolve(task_id, backend_base_url)
+        hot_set.touch_task(task_id)
+        return task_metadata
+    except TaskNotFound as e:
+        logger.error(f"Failed to fetch task metadata for {task_id}: {e}")
+        raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+    except MetadataFetchError as e:
+        # Backend failures keep mapping to 404 as before; they are just not cached
+        logger.error(f"Failed to fetch task metadata for {task_id}: {e}")
         raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
     except Exception as e:
-        logger.error(f"Unexpected error fetching task {task_id}: {e.response.text}")
+        logger.error(f"Unexpected error fetching task {task_id}: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-def get_zoom_safe(src_dst) -> tuple[int, int]:
-    """Get safe zoom levels - fixed range from 8 to 50"""
-    # Always return fixed zoom range regardless of COG spatial info
-    return 8, 50
+def get_zoom_safe(sidecar: CogSidecar) -> tuple[int, int]:
+    """Get safe zoom levels from the COG's native overview pyramid"""
+    # Keep low zooms down to 8 available for overview maps; allow a few
+    # levels of over-zoom past native resolution for close inspection
+    return min(8, sidecar.minzoom), sidecar.maxzoom + settings.max_overzoom
 
-def get_tile_url(task_id: str, query_params: dict) -> str:
+def get_tile_url(task_id: str, query_params: dict, prefix: str = "/api/tiles",
+                 version: Optional[str] = None) -> str:
     """Generate tile URL template"""
-    base_url = f"/api/tiles/{task_id}/{{z}}/{{x}}/{{y}}"
+    base_url = f"{prefix}/{task_id}/{{z}}/{{x}}/{{y}}"
     
     # Add query parameters if present
     params = {}
-    for k in ['format', 'rescale', 'color_map', 'size']:
+    for k in ['format', 'rescale', 'color_map', 'size', 'profile', 'expression']:
         if query_params.get(k):
             params[k] = query_params.get(k)
+    # Content version: the URL changes whenever the COG does, so tiles can be cached forever
+    if version and settings.versioned_tile_urls:
+        params['v'] = version
     
     if params:
         from urllib.parse import urlencode
@@ -177,28 +577,682 @@ def get_tile_url(task_id: str, query_params: dict) -> str:
     
     return base_url
 
-async def get_cog_reader(cog_url: str, task_id: str) -> COGReader:
-    """Open a Cloud-Optimised GeoTIFF by always downloading locally to avoid VSICURL issues."""
-    import tempfile
-    # Download the COG locally if not already present
-    tmp_dir = tempfile.gettempdir()
-    local_path = os.path.join(tmp_dir, f"{task_id}.tif")
-    if not os.path.exists(local_path):
-        try:
-            with httpx.stream("GET", cog_url, timeout=httpx.Timeout(300.0, connect=60.0, read=300.0)) as response:
-                response.raise_for_status()
-                with open(local_path, "wb") as f:
-                    for chunk in response.iter_bytes():
-                        f.write(chunk)
-            logger.info(f"Downloaded COG to {local_path}")
-        except Exception as download_err:
-            logger.error(f"Failed downloading COG {task_id}: {download_err}")
-            raise HTTPException(status_code=500, detail="Failed to download COG file")
+@asynccontextmanager
+async def get_cog_reader(cog_url: str, task_id: str):
+    """Borrow a pooled reader for the task's locally cached COG, downloading it on first use."""
     try:
-        return COGReader(local_path)
+        reader = await reader_pool.borrow(task_id, cog_url)
+    except (CogDownloadError, CogStreamError, OSError) as download_err:
+        logger.error(f"Failed downloading COG {task_id}: {download_err}")
+        raise HTTPException(status_code=500, detail="Failed to download COG file")
     except Exception as open_err:
         logger.error(f"Failed to open local COG {task_id}: {open_err}")
         raise HTTPException(status_code=500, detail="Failed to read COG file")
+    if cog_transcoder is not None:
+        # First use of a file version: validate it (transcode in the background)
+        cog_transcoder.check(task_id, format_version(reader_pool.version_of(reader)))
+    try:
+        yield reader
+    finally:
+        reader_pool.give_back(reader)
+
+async def get_cog_sidecar(cog_url: str, task_id: str) -> CogSidecar:
+    """Derived metadata for the task's COG, built once per COG version"""
+    sidecar = cog_sidecars.lookup(task_id)
+    if sidecar is not None:
+        return sidecar
+    try:
+        with timed("sidecar"):
+            return await cog_sidecars.build(
+                task_id, lambda: get_cog_reader(cog_url, task_id), render_executor.run
+            )
+    except RenderQueueFull:
+        raise render_queue_full()
+
+def cog_version(task_id: str) -> Optional[str]:
+    """Version string of the task's locally cached COG, or None if not downloaded yet"""
+    try:
+        return format_version(file_version((cog_stream or cog_downloads).local_path(task_id)))
+    except OSError:
+        return None
+
+def content_version(task_id: str) -> Optional[str]:
+    """Version of the task's COG content (checksum or remote ETag), None until it is local"""
+    return (cog_stream or cog_downloads).content_version(task_id)
+
+async def ensure_content_version(task_id: str) -> Optional[str]:
+    """Content version of an acquired COG, hashing files downloaded before versions were recorded"""
+    version = content_version(task_id)
+    if version is None and cog_stream is None:
+        version = await asyncio.to_thread(cog_downloads.record_source, task_id)
+    return version
+
+def mosaic_version(index: ProjectIndex) -> Optional[str]:
+    """Digest of every layer's content version (None while any COG is not local)"""
+    versions = [content_version(layer.task_id) for layer in index.layers]
+    if not all(versions):
+        return None
+    raw = ",".join(f"{layer.task_id}@{version}" for layer, version in zip(index.layers, versions))
+    return hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
+def tile_cache_control(requested: Optional[str], before: Optional[str], after: Optional[str]) -> str:
+    """
+    Cache-Control of a tile requested with content version ``requested``
+    (``v``), given the version current before and after producing it
+    """
+    if requested is None:
+        return "public, max-age=3600"  # Cache for 1 hour
+    if after == requested and before in (None, requested):
+        return "public, max-age=31536000, immutable"
+    # Outdated URL (or the COG changed while rendering): the tile is the current content
+    return "public, max-age=60"
+
+def tile_priority(z: int) -> int:
+    """Render priority of a tile: overviews first, so a map fills in before its details"""
+    return PRIORITY_OVERVIEW if z <= settings.render_overview_max_zoom else PRIORITY_DETAIL
+
+def tile_cache_key(task_id: str, version: str, z: int, x: int, y: int, params: TileParams):
+    """Cache key over the tile address and normalized render parameters"""
+    return make_key(task_id, version, z, x, y, *params.cache_parts())
+
+def parse_accept(accept: str) -> Dict[str, float]:
+    """Media ranges of an Accept header mapped to their q-values"""
+    ranges: Dict[str, float] = {}
+    for item in accept.split(","):
+        media_range, _, params = item.partition(";")
+        media_range = media_range.strip().lower()
+        if not media_range:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        ranges[media_range] = max(q, ranges.get(media_range, 0.0))
+    return ranges
+
+def accept_quality(ranges: Dict[str, float], media_type: str, wildcards: bool = True) -> float:
+    """q-value of a media type; WebP/JPEG support is not inferred from */* or image/*"""
+    if media_type in ranges:
+        return ranges[media_type]
+    if not wildcards:
+        return 0.0
+    return ranges.get(media_type.split("/")[0] + "/*", ranges.get("*/*", 0.0))
+
+def negotiate_format(ranges: Dict[str, float]) -> str:
+    """Best tile format for an Accept header (server preference WebP > PNG > JPEG on ties)"""
+    candidates = [
+        ("webp", accept_quality(ranges, "image/webp", wildcards=False)),
+        ("png", accept_quality(ranges, "image/png")),
+        ("jpg", accept_quality(ranges, "image/jpeg", wildcards=False)),
+    ]
+    fmt, q = max(candidates, key=lambda candidate: candidate[1])
+    # PNG is the fallback for clients that send no (or no usable) Accept
+    return fmt if q > 0 else "png"
+
+def parse_tile_params(
+    size: int,
+    format: Optional[str],
+    rescale: Optional[str],
+    color_map: Optional[str],
+    nodata: Optional[str],
+    accept: str,
+    profile: Optional[str] = None,
+    expression: Optional[str] = None,
+) -> TileParams:
+    """Validate tile query parameters; without a format it is negotiated from ``accept``"""
+    # Validate tile size
+    if size not in [256, 512]:
+        raise HTTPException(status_code=400, detail="Tile size must be 256 or 512")
+    
+    # Validate format
+    ranges = parse_accept(accept)
+    negotiated = format is None
+    if negotiated:
+        format = negotiate_format(ranges)
+    if format not in ["png", "jpg", "jpeg", "webp", "tif", "tiff"]:
+        raise HTTPException(status_code=400, detail="Invalid format")
+    
+    # Validate encoder profile
+    encoder = encoder_profiles.get(profile or settings.encoder_profile)
+    if encoder is None:
+        raise HTTPException(status_code=400, detail="Unknown encoder profile")
+    
+    # Process rescale parameter
+    rescale_arr = None
+    if rescale:
+        try:
+            rescale_arr = tuple(map(float, rescale.split(",")))
+            if len(rescale_arr) != 2:
+                raise ValueError("Rescale must have exactly 2 values")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid rescale format (should be 'min,max')")
+    
+    # Process nodata parameter
+    nodata_value = None
+    if nodata:
+        try:
+            nodata_value = np.nan if nodata.lower() == "nan" else float(nodata)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid nodata value")
+    
+    # Validate color map
+    if color_map:
+        try:
+            colormap.get(color_map)
+        except InvalidColorMapName:
+            raise HTTPException(status_code=400, detail="Invalid color map")
+    
+    # Compile band math (once per distinct expression)
+    compiled = None
+    if expression:
+        try:
+            compiled = compile_expression(expression)
+        except InvalidExpression as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    return TileParams(
+        size=size,
+        format=format,
+        rescale=rescale_arr,
+        color_map=color_map,
+        nodata=nodata_value,
+        webp_ok=accept_quality(ranges, "image/webp", wildcards=False) > 0,
+        profile=encoder,
+        negotiated=negotiated,
+        expression=compiled,
+    )
+
+def check_expression_bands(params: TileParams, sidecar: CogSidecar, task_id: str) -> None:
+    """Reject expressions over bands the task's COG does not have"""
+    if params.expression is not None and params.expression.bands[-1] > sidecar.count:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Expression references b{params.expression.bands[-1]} but task {task_id} has {sidecar.count} bands",
+        )
+
+async def produce_tile(task_metadata: TaskMetadata, task_id: str, z: int, x: int, y: int,
+                       params: TileParams, archive: bool = True) -> CachedTile:
+    """Return a tile from the task's archive, the cache, a (shared) metatile render or a single render"""
+    # Pre-rendered archive of a finished orthomosaic: no GDAL in the path
+    if archive and tile_archives is not None:
+        tile = tile_archives.get(task_id, z, x, y, render_key(params.cache_parts()))
+        if tile is not None:
+            return tile
+    
+    # Serve from the rendered-tile cache when the COG is already local
+    version = cog_version(task_id)
+    if version is not None:
+        with timed("cache"):
+            cached = await tile_cache.get(tile_cache_key(task_id, version, z, x, y, params))
+        if cached is not None:
+            return cached
+    
+    sidecar = await get_cog_sidecar(task_metadata.cogUrl, task_id)
+    check_expression_bands(params, sidecar, task_id)
+    # Check if tile exists (x, y, z)
+    if not sidecar.tile_exists(x, y, z):
+        raise HTTPException(status_code=404, detail="Tile outside bounds")
+    
+    # Get zoom limits
+    minzoom, maxzoom = get_zoom_safe(sidecar)
+    if z < minzoom - settings.zoom_extra_levels or z > maxzoom + settings.zoom_extra_levels:
+        raise HTTPException(status_code=404, detail="Zoom level outside bounds")
+    
+    # Tiles with no valid pixels (the nodata collar around the footprint)
+    # never reach GDAL once their transparent image has been rendered
+    coverage = cog_sidecars.classify(task_id, sidecar.version, x, y, z)
+    # GeoTIFF tiles embed their georeferencing, so each one is distinct
+    empty_key = (task_id, sidecar.version, params.cache_parts()) if params.cache_parts()[1] != "tif" else None
+    if coverage == EMPTY:
+        if settings.empty_tile_no_content:
+            return NO_CONTENT_TILE
+        tile = empty_tiles.get(empty_key) if empty_key is not None else None
+        if tile is not None:
+            return tile
+    
+    try:
+        # Below the coarsest overview the block would be warped from an overview
+        # far larger than the output, so only metatile where overviews cover it
+        if (
+            coverage != EMPTY
+            and settings.metatile_size > 1
+            and z >= max(settings.metatile_min_zoom, sidecar.minzoom)
+        ):
+            tiles = await render_metatile(task_metadata.cogUrl, task_id, z, x, y, params, sidecar)
+            tile = tiles.get((x, y))
+            if tile is None:
+                raise HTTPException(status_code=404, detail="Tile outside bounds")
+            return tile
+        
+        # Read tile from COG
+        async with get_cog_reader(task_metadata.cogUrl, task_id) as src:
+            version = format_version(reader_pool.version_of(src))
+            tile_bytes, media_type = await render_executor.run(
+                render_tile, src, x, y, z, params, coverage == FULL
+            )
+    except RenderQueueFull:
+        raise render_queue_full()
+    except TileOutsideBounds:
+        raise HTTPException(status_code=404, detail="Tile outside bounds")
+    except ValueError as ve:
+        # rio-tiler may raise ValueError("cannot convert float infinity to integer")
+        logger.warning(f"ValueError while generating tile for task {task_id}: {ve}")
+        raise HTTPException(status_code=404, detail="Tile outside bounds")
+    
+    tile = CachedTile(content=tile_bytes, media_type=media_type, etag=make_etag(tile_bytes))
+    if coverage == EMPTY and empty_key is not None:
+        empty_tiles[empty_key] = tile
+        return tile
+    await tile_cache.put(tile_cache_key(task_id, version, z, x, y, params), tile)
+    return tile
+
+def preview_frame(bbox: Optional[str], default_bounds: Optional[List[float]], width: Optional[int],
+                  height: Optional[int]) -> Tuple[Tuple[float, float, float, float], int, int]:
+    """
+    Web Mercator bounds and pixel size of a preview of ``bbox`` (WGS84, by
+    default ``default_bounds``). With one side given the other follows the
+    bbox's aspect ratio; with both, the bbox is widened or heightened around
+    its center to their aspect ratio, so the image is never stretched.
+    """
+    if bbox:
+        try:
+            west, south, east, north = map(float, bbox.split(","))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid bbox format (should be 'west,south,east,north')")
+    else:
+        west, south, east, north = default_bounds
+    if not (-180 <= west < east <= 180 and -85.0511 <= south < north <= 85.0511):
+        raise HTTPException(status_code=400, detail="Invalid bbox")
+    for side in (width, height):
+        if side is not None and not 1 <= side <= settings.preview_max_size:
+            raise HTTPException(status_code=400, detail=f"Preview width and height must be 1 to {settings.preview_max_size}")
+    
+    left, bottom = mercantile.xy(west, south)
+    right, top = mercantile.xy(east, north)
+    aspect = (right - left) / (top - bottom)
+    if width is None and height is None:
+        if aspect >= 1:
+            width = settings.preview_default_size
+        else:
+            height = settings.preview_default_size
+    if width is not None and height is not None:
+        cx, cy = (left + right) / 2, (bottom + top) / 2
+        if width / height > aspect:
+            half = (top - bottom) * width / height / 2
+            left, right = cx - half, cx + half
+        else:
+            half = (right - left) * height / width / 2
+            bottom, top = cy - half, cy + half
+        return (left, bottom, right, top), width, height
+    if height is None:
+        height = round(width / aspect)
+    else:
+        width = round(height * aspect)
+    # Very wide or tall boxes: shrink both sides rather than stretch
+    scale = min(1.0, settings.preview_max_size / max(width, height))
+    return (left, bottom, right, top), max(1, round(width * scale)), max(1, round(height * scale))
+
+async def produce_preview(task_metadata: TaskMetadata, task_id: str, bounds: Tuple[float, float, float, float],
+                          width: int, height: int, params: TileParams) -> CachedTile:
+    """Return a preview from the cache or render it with one (overview) read"""
+    def cache_key(version: str):
+        # Centimetres are plenty to tell bboxes apart
+        return make_key(
+            task_id, version, "preview", tuple(round(c, 2) for c in bounds), width, height, *params.cache_parts()
+        )
+    
+    version = cog_version(task_id)
+    if version is not None:
+        with timed("cache"):
+            cached = await tile_cache.get(cache_key(version))
+        if cached is not None:
+            return cached
+    
+    try:
+        async with get_cog_reader(task_metadata.cogUrl, task_id) as src:
+            version = format_version(reader_pool.version_of(src))
+            tile_bytes, media_type = await render_executor.run(render_preview, src, bounds, width, height, params)
+    except RenderQueueFull:
+        raise render_queue_full()
+    
+    tile = CachedTile(content=tile_bytes, media_type=media_type, etag=make_etag(tile_bytes))
+    await tile_cache.put(cache_key(version), tile)
+    return tile
+
+async def get_project_index(project_id: int, backend_base_url: Optional[str] = None) -> ProjectIndex:
+    """R-tree of the project's task footprints"""
+    try:
+        index = await project_indexes.get(project_id, backend_base_url)
+    except (TaskNotFound, MetadataFetchError) as e:
+        logger.error(f"Failed to fetch tasks of project {project_id}: {e}")
+        raise HTTPException(status_code=404, detail=f"Project {project_id} not found")
+    if not index.layers:
+        raise HTTPException(status_code=404, detail="No COGs available for this project")
+    return index
+
+async def produce_mosaic_tile(project_id: int, index: ProjectIndex, z: int, x: int, y: int,
+                              params: TileParams) -> CachedTile:
+    """Composite a tile from the project's COGs under it: newest first, first valid pixel wins"""
+    bounds = mercantile.bounds(x, y, z)
+    candidates = index.search((bounds.west, bounds.south, bounds.east, bounds.north))
+    if not candidates:
+        raise HTTPException(status_code=404, detail="Tile outside bounds")
+    
+    # Leave out COGs outside their zoom range or without valid pixels under
+    # the tile, and everything older than a COG that covers it completely
+    sidecars = await asyncio.gather(*(get_cog_sidecar(layer.cog_url, layer.task_id) for layer in candidates))
+    layers = []
+    for layer, sidecar in zip(candidates, sidecars):
+        check_expression_bands(params, sidecar, layer.task_id)
+        minzoom, maxzoom = get_zoom_safe(sidecar)
+        if z < minzoom - settings.zoom_extra_levels or z > maxzoom + settings.zoom_extra_levels:
+            continue
+        if not sidecar.tile_exists(x, y, z):
+            continue
+        coverage = cog_sidecars.classify(layer.task_id, sidecar.version, x, y, z)
+        if coverage == EMPTY:
+            continue
+        layers.append(layer)
+        if coverage == FULL or len(layers) == settings.mosaic_max_layers:
+            break
+    project_indexes.layers_skipped += len(candidates) - len(layers)
+    if not layers:
+        if settings.empty_tile_no_content:
+            return NO_CONTENT_TILE
+        # Render the transparent tile from the newest COG
+        layers = candidates[:1]
+    
+    def cache_key(versions: List[str]):
+        layer_versions = ",".join(f"{layer.task_id}@{version}" for layer, version in zip(layers, versions))
+        return tile_cache_key(f"project:{project_id}", layer_versions, z, x, y, params)
+    
+    versions = [cog_version(layer.task_id) for layer in layers]
+    if all(versions):
+        with timed("cache"):
+            cached = await tile_cache.get(cache_key(versions))
+        if cached is not None:
+            return cached
+    
+    async def read_layer(layer: MosaicLayer):
+        async with get_cog_reader(layer.cog_url, layer.task_id) as src:
+            version = format_version(reader_pool.version_of(src))
+            try:
+                return version, await render_executor.run(read_tile, src, x, y, z, params)
+            except (TileOutsideBounds, ValueError):
+                return version, None
+    
+    try:
+        reads = await asyncio.gather(*(read_layer(layer) for layer in layers))
+        project_indexes.layers_read += len(layers)
+        images = [image for _, image in reads if image is not None]
+        if not images:
+            raise HTTPException(status_code=404, detail="Tile outside bounds")
+        tile_bytes, media_type = await render_executor.run(render_mosaic, images, params)
+    except RenderQueueFull:
+        raise render_queue_full()
+    
+    tile = CachedTile(content=tile_bytes, media_type=media_type, etag=make_etag(tile_bytes))
+    await tile_cache.put(cache_key([version for version, _ in reads]), tile)
+    return tile
+
+async def render_metatile(cog_url: str, task_id: str, z: int, x: int, y: int, params: TileParams,
+                          sidecar: CogSidecar) -> Dict[tuple, CachedTile]:
+    """Render (once, shared by concurrent requests) the metatile containing x/y and cache its tiles"""
+    n = settings.metatile_size
+    mx, my = metatile_origin(x, y, n)
+    key = (task_id, sidecar.version, z, mx, my, params.cache_parts())
+    task = metatile_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_render_metatile(cog_url, task_id, z, mx, my, n, params, sidecar))
+        metatile_inflight[key] = task
+        task.add_done_callback(lambda t: metatile_inflight.pop(key) if metatile_inflight.get(key) is t else None)
+    metatile_waiters[task] = metatile_waiters.get(task, 0) + 1
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # The last request waiting for a metatile (its client went away) takes the render with it
+        if metatile_waiters[task] == 1:
+            metatile_inflight.pop(key, None)
+            task.cancel()
+        raise
+    finally:
+        metatile_waiters[task] -= 1
+        if not metatile_waiters[task]:
+            del metatile_waiters[task]
+
+async def _render_metatile(cog_url: str, task_id: str, z: int, mx: int, my: int, n: int,
+                           params: TileParams, sidecar: CogSidecar) -> Dict[tuple, CachedTile]:
+    async with get_cog_reader(cog_url, task_id) as src:
+        version = format_version(reader_pool.version_of(src))
+        images = await render_executor.run(read_metatile, src, mx, my, z, n, params)
+    
+    # Skip tiles of the block that fall outside the raster or hold no valid
+    # pixels (served by the empty-tile path), then encode one metatile row per
+    # executor job so rows are encoded in parallel
+    rows: Dict[int, dict] = {}
+    opaque = set()
+    for (tx, ty), image in images.items():
+        if not sidecar.tile_exists(tx, ty, z):
+            continue
+        coverage = cog_sidecars.classify(task_id, sidecar.version, tx, ty, z)
+        if coverage == EMPTY:
+            continue
+        if coverage == FULL:
+            opaque.add((tx, ty))
+        rows.setdefault(ty, {})[(tx, ty)] = image
+    encoded_rows = await asyncio.gather(
+        *(render_executor.run(encode_tiles, row, params, opaque) for row in rows.values())
+    )
+    
+    tiles = {}
+    for encoded in encoded_rows:
+        for (tx, ty), (tile_bytes, media_type) in encoded.items():
+            tile = CachedTile(content=tile_bytes, media_type=media_type, etag=make_etag(tile_bytes))
+            await tile_cache.put(tile_cache_key(task_id, version, z, tx, ty, params), tile)
+            tiles[(tx, ty)] = tile
+    return tiles
+
+async def plan_pyramid(task_id: str, body: SeedRequest, backend_base_url: Optional[str] = None):
+    """Resolve a pyramid request into (task metadata, tile params, sidecar, normalized spec, tile list)"""
+    task_metadata = await get_task_metadata(task_id, backend_base_url)
+    if not task_metadata.cogUrl:
+        raise HTTPException(status_code=404, detail="COG not available for this task")
+    
+    params = parse_tile_params(
+        body.size, body.format, body.rescale, body.color_map, body.nodata,
+        "image/webp" if body.webp else "", body.profile, body.expression,
+    )
+    sidecar = await get_cog_sidecar(task_metadata.cogUrl, task_id)
+    check_expression_bands(params, sidecar, task_id)
+    minzoom, maxzoom = get_zoom_safe(sidecar)
+    lowest, highest = minzoom - settings.zoom_extra_levels, maxzoom + settings.zoom_extra_levels
+    spec = body.model_dump()
+    spec["minzoom"] = lowest if body.minzoom is None else body.minzoom
+    spec["maxzoom"] = min(sidecar.maxzoom, highest) if body.maxzoom is None else body.maxzoom
+    spec["bounds"] = body.bounds or sidecar.bounds
+    if not lowest <= spec["minzoom"] <= spec["maxzoom"] <= highest:
+        raise HTTPException(status_code=400, detail=f"Seed zoom range must be within {lowest}-{highest}")
+    if len(spec["bounds"]) != 4:
+        raise HTTPException(status_code=400, detail="Bounds must be [west, south, east, north]")
+    
+    # Tile URLs for 512px tiles are one zoom level above the rendered tile
+    zoom_offset = 1 if body.size == 512 else 0
+    tiles = seed_tiles(
+        spec["bounds"], spec["minzoom"] - zoom_offset, spec["maxzoom"] - zoom_offset, settings.metatile_size
+    )
+    if len(tiles) > settings.seed_max_tiles:
+        raise HTTPException(
+            status_code=400, detail=f"Seed job of {len(tiles)} tiles exceeds {settings.seed_max_tiles}"
+        )
+    return task_metadata, params, sidecar, spec, tiles
+
+async def prepare_seed(task_id: str, body: SeedRequest, backend_base_url: Optional[str] = None):
+    """Resolve a seed request into (spec, COG version, tile list, produce callback)"""
+    task_metadata, params, sidecar, spec, tiles = await plan_pyramid(task_id, body, backend_base_url)
+    
+    async def produce(z: int, x: int, y: int) -> str:
+        try:
+            with job_context(priority=PRIORITY_BACKGROUND, task=task_id, deadline=None):
+                await produce_tile(task_metadata, task_id, z, x, y, params)
+        except HTTPException as e:
+            if e.status_code == 503:
+                raise RenderQueueFull()
+            if e.status_code == 404:
+                return "skipped"
+            raise
+        return "done"
+    
+    return spec, sidecar.version, tiles, produce
+
+async def export_archive(task_id: str, body: SeedRequest, archive_format: str,
+                         output: Optional[str] = None, backend_base_url: Optional[str] = None,
+                         concurrency: Optional[int] = None) -> Tuple[str, int]:
+    """
+    Bake the task's pyramid into a PMTiles or MBTiles archive; returns (path, tile count).
+    
+    Written to the archive directory (unless ``output`` is given) the archive
+    replaces the task's previous one and is served by the tile endpoints for
+    requests with the same render parameters.
+    """
+    if output is None and tile_archives is None:
+        raise HTTPException(status_code=400, detail="TILE_ARCHIVE_DIR is not configured")
+    path = output or tile_archives.archive_path(task_id, archive_format)
+    task_metadata, params, sidecar, spec, tiles = await plan_pyramid(task_id, body, backend_base_url)
+    # Hilbert tile-id order keeps the PMTiles archive clustered and is still
+    # spatially local, so metatile siblings come from the tile cache
+    tiles.sort(key=lambda t: zxy_to_tileid(*t))
+    concurrency = concurrency or seed_concurrency()
+    limit = asyncio.Semaphore(concurrency)
+    
+    async def render(z: int, x: int, y: int) -> Optional[CachedTile]:
+        async with limit:
+            while True:
+                try:
+                    with job_context(priority=PRIORITY_BACKGROUND, task=task_id, deadline=None):
+                        return await produce_tile(task_metadata, task_id, z, x, y, params, archive=False)
+                except HTTPException as e:
+                    if e.status_code == 404:
+                        return None
+                    if e.status_code != 503:
+                        raise
+                await asyncio.sleep(settings.render_retry_after)
+    
+    writer = TileArchiveWriter(path, archive_format)
+    try:
+        window = concurrency * 4
+        for start in range(0, len(tiles), window):
+            batch = tiles[start:start + window]
+            for (z, x, y), tile in zip(batch, await asyncio.gather(*(render(*t) for t in batch))):
+                if tile is not None and tile.content:
+                    writer.add(z, x, y, tile.content)
+        metadata = {
+            "name": f"Task {task_id} Orthomosaic",
+            "render_key": render_key(params.cache_parts()),
+            "cog_version": sidecar.version,
+            "spec": spec,
+        }
+        count = await asyncio.to_thread(writer.finish, metadata, tuple(spec["bounds"]))
+    except BaseException:
+        writer.abort()
+        raise
+    if output is None:
+        tile_archives.remove(task_id, keep=path)
+    logger.info(f"Exported {count} tiles of task {task_id} to {path}")
+    return path, count
+
+def seed_concurrency() -> int:
+    """Concurrent tiles per seed job, leaving render threads for live traffic"""
+    return settings.seed_concurrency or max(1, render_executor.max_workers // 2)
+
+def tile_response(tile: CachedTile, request: Optional[Request], params: Optional[TileParams] = None,
+                  cache_control: str = "public, max-age=3600") -> Response:
+    """Serve a rendered tile, answering If-None-Match revalidation with 304"""
+    headers = {
+        "Cache-Control": cache_control,
+        "Access-Control-Allow-Origin": "*",
+        "ETag": tile.etag,
+    }
+    if params is not None and params.varies_on_accept:
+        headers["Vary"] = "Accept"
+    if not tile.content:
+        # No valid pixels and EMPTY_TILE_NO_CONTENT is set
+        return Response(status_code=204, headers=headers)
+    if request is not None and etag_matches(request.headers.get("if-none-match"), tile.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=tile.content, media_type=tile.media_type, headers=headers)
+
+def hot_tile_params(params: TileParams) -> Dict[str, Any]:
+    """Render parameters of a hot tile, as ``parse_tile_params`` arguments"""
+    return {
+        "size": params.size,
+        "format": params.format,
+        "rescale": ",".join(map(str, params.rescale)) if params.rescale else None,
+        "color_map": params.color_map,
+        "nodata": str(params.nodata) if params.nodata is not None else None,
+        "accept": "image/webp" if params.webp_ok else "",
+        "profile": params.profile.name,
+        "expression": params.expression.source if params.expression is not None else None,
+    }
+
+async def rehydrate_hot_set() -> None:
+    """
+    Warm a new worker with the pod's hot set in the background, at seeding
+    priority: prime and resolve the hottest tasks' metadata, load their
+    sidecars and open a pooled reader, then render (or load from the disk
+    tier) the hottest tiles. COGs no longer on the pod are not downloaded.
+    """
+    started = time.perf_counter()
+    tasks, tiles = await asyncio.to_thread(hot_set.load)
+    limit = asyncio.Semaphore(seed_concurrency())
+    warmed: Dict[str, TaskMetadata] = {}
+    
+    async def warm_task(entry: Dict[str, Any]) -> None:
+        task_id = entry["id"]
+        if entry.get("metadata"):
+            metadata_resolver.prime(task_id, entry["metadata"], entry["fetched_at"])
+        async with limit:
+            # Not through get_task_metadata, which would count this as a request
+            task_metadata = await metadata_resolver.resolve(task_id)
+            if not task_metadata.cogUrl or cog_version(task_id) is None:
+                return
+            await get_cog_sidecar(task_metadata.cogUrl, task_id)
+            async with get_cog_reader(task_metadata.cogUrl, task_id):
+                pass
+        warmed[task_id] = task_metadata
+    
+    async def warm_tile(entry: Dict[str, Any]) -> None:
+        task_metadata = warmed.get(entry["task"])
+        if task_metadata is None:
+            return
+        params = parse_tile_params(**entry["params"])
+        async with limit:
+            await produce_tile(task_metadata, entry["task"], entry["z"], entry["x"], entry["y"], params)
+    
+    with job_context(priority=PRIORITY_BACKGROUND, deadline=None):
+        for entry, result in zip(tasks, await asyncio.gather(
+            *(warm_task(entry) for entry in tasks[:settings.warm_start_tasks]), return_exceptions=True
+        )):
+            if isinstance(result, Exception):
+                logger.warning(f"Warm start skipped task {entry['id']}: {getattr(result, 'detail', result)}")
+        results = await asyncio.gather(
+            *(warm_tile(entry) for entry in tiles[:settings.warm_start_tiles]), return_exceptions=True
+        )
+    rendered = sum(1 for entry, result in zip(tiles, results) if entry["task"] in warmed and result is None)
+    logger.info(
+        f"Warm start: {len(warmed)} tasks and {rendered} tiles in {time.perf_counter() - started:.2f}s"
+    )
+
+def render_queue_full() -> HTTPException:
+    """503 telling the client to back off while the render queue drains"""
+    return HTTPException(
+        status_code=503,
+        detail="Tile renderer busy",
+        headers={"Retry-After": str(settings.render_retry_after)},
+    )
 
 # API Endpoints
 
@@ -207,10 +1261,116 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "tiling-server"}
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Cache, reader pool and render queue counters for this worker"""
+    return {
+        "cog_cache": cog_cache.snapshot(),
+        "cog_stream": cog_stream.snapshot() if cog_stream is not None else None,
+        "cog_transcoder": cog_transcoder.snapshot() if cog_transcoder is not None else None,
+        "reader_pool": reader_pool.snapshot(),
+        "render_executor": render_executor.snapshot(),
+        "tile_cache": tile_cache.snapshot(),
+        "project_mosaics": project_indexes.snapshot(),
+        "encoders": encoder_stats.snapshot(),
+        "sidecars": cog_sidecars.snapshot(),
+        "tile_archives": tile_archives.snapshot() if tile_archives is not None else None,
+        "metadata": metadata_resolver.snapshot(),
+        "invalidations": invalidations.snapshot(),
+        "hot_set": hot_set.snapshot(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics summed over every worker of the pod"""
+    body = await asyncio.to_thread(metrics_registry.exposition)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def require_admin(request: Request) -> None:
+    """Admin endpoints exist only with ADMIN_API_KEY set and require it in the API key header"""
+    if not settings.admin_api_key:
+        raise HTTPException(status_code=404, detail="Not Found")
+    key = request.headers.get(settings.api_key_header, "")
+    if not hmac.compare_digest(key.encode(), settings.admin_api_key.encode()):
+        raise HTTPException(status_code=403, detail="Invalid API key")
+
+@app.post("/admin/profile", response_model=CaptureInfo, status_code=202, dependencies=[Depends(require_admin)])
+async def start_profile(
+    seconds: float = Query(default=30, gt=0, description="Sampling duration"),
+):
+    """Sample the stacks of the worker that receives this request for ``seconds``"""
+    if seconds > settings.profile_max_seconds:
+        raise HTTPException(status_code=400, detail=f"Profiles are limited to {settings.profile_max_seconds} seconds")
+    return stack_sampler.start_profile(seconds)
+
+@app.delete("/admin/profile/{capture_id}", response_model=CaptureInfo, dependencies=[Depends(require_admin)])
+async def stop_profile(capture_id: str = PathParam(..., description="Capture ID")):
+    """Stop a running profile early (from any worker)"""
+    capture = stack_sampler.captures.request_stop(capture_id)
+    if capture is None or capture.kind != "profile":
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return CaptureInfo(**capture.model_dump(exclude={"threads"}))
+
+@app.get("/admin/captures", response_model=List[CaptureInfo], dependencies=[Depends(require_admin)])
+async def list_captures():
+    """Profiles and slow tile captures in the ring buffer, newest first"""
+    return await asyncio.to_thread(stack_sampler.captures.list)
+
+@app.get("/admin/captures/{capture_id}", dependencies=[Depends(require_admin)])
+async def get_capture(
+    capture_id: str = PathParam(..., description="Capture ID"),
+    format: str = Query(default="speedscope", description="speedscope, collapsed or json"),
+):
+    """Download a capture as speedscope JSON, collapsed stacks or the raw capture"""
+    capture = await asyncio.to_thread(stack_sampler.captures.get, capture_id)
+    if capture is None:
+        raise HTTPException(status_code=404, detail="Capture not found")
+    if format == "collapsed":
+        return PlainTextResponse(
+            to_collapsed(capture),
+            headers={"Content-Disposition": f'attachment; filename="{capture.id}.folded"'},
+        )
+    if format == "speedscope":
+        return JSONResponse(
+            to_speedscope(capture),
+            headers={"Content-Disposition": f'attachment; filename="{capture.id}.speedscope.json"'},
+        )
+    if format == "json":
+        return capture
+    raise HTTPException(status_code=400, detail="Format must be speedscope, collapsed or json")
+
+@app.post("/admin/tasks/{task_id}/invalidate", response_model=InvalidateResponse, dependencies=[Depends(require_admin)])
+async def invalidate_task(
+    task_id: str = PathParam(..., description="Task ID"),
+    body: Optional[InvalidateRequest] = None,
+):
+    """
+    Purge everything cached for a task whose COG was reprocessed: metadata,
+    the local COG (or streamed blocks), open readers, sidecars, archives and
+    rendered tiles, on every worker of the pod
+    """
+    check_task_id(task_id)
+    previous = content_version(task_id)
+    if body is not None and body.version is not None and body.version == previous:
+        return InvalidateResponse(task_id=task_id, previous_version=previous, purged=False)
+    forget_task(task_id)
+    if cog_stream is not None:
+        await asyncio.to_thread(cog_stream.purge, task_id)
+    else:
+        await cog_cache.purge(task_id)
+    if tile_archives is not None:
+        await asyncio.to_thread(tile_archives.remove, task_id)
+    # Another request may have reloaded state while the file was purged
+    forget_task(task_id)
+    await asyncio.to_thread(invalidations.publish, task_id)
+    logger.info(f"Invalidated task {task_id} (was version {previous})")
+    return InvalidateResponse(task_id=task_id, previous_version=previous, purged=True)
+
 @app.get("/api/tiles/{task_id}/tilejson", response_model=TileJsonResponse)
 async def get_tile_json(
     task_id: str = PathParam(..., description="Task ID"),
     request: Request = None,
+    response: Response = None,
     backend_base_url: Optional[str] = None
 ):
     """Get TileJSON for the specified task"""
@@ -220,26 +1380,24 @@ async def get_tile_json(
         # Always read from COG to compute accurate geographic bounds (EPSG:4326)
         if not task_metadata.cogUrl:
             raise HTTPException(status_code=404, detail="COG not available for this task")
-        src = await get_cog_reader(task_metadata.cogUrl, task_id)
+        sidecar = await get_cog_sidecar(task_metadata.cogUrl, task_id)
         # Compute zoom levels from metadata or database
         if task_metadata.minZoom is not None and task_metadata.maxZoom is not None:
             minzoom, maxzoom = task_metadata.minZoom, task_metadata.maxZoom
         else:
-            minzoom, maxzoom = get_zoom_safe(src)
-        # Transform bounds from source CRS to WGS84
-        minx, miny, maxx, maxy = src.dataset.bounds
-        west, south, east, north = transform_bounds(
-            src.dataset.crs, "EPSG:4326", minx, miny, maxx, maxy
-        )
-        bounds_ll = [west, south, east, north]
+            minzoom, maxzoom = get_zoom_safe(sidecar)
         # Build query parameters from request
         query_params = dict(request.query_params) if request else {}
+        version = await ensure_content_version(task_id)
+        if response is not None:
+            # Must be refetched to pick up a new content version
+            response.headers["Cache-Control"] = "no-cache"
         return TileJsonResponse(
             name=f"Task {task_id} Orthomosaic",
-            tiles=[get_tile_url(task_id, query_params)],
+            tiles=[get_tile_url(task_id, query_params, version=version)],
             minzoom=minzoom - settings.zoom_extra_levels,
             maxzoom=maxzoom + settings.zoom_extra_levels,
-            bounds=bounds_ll
+            bounds=sidecar.bounds
         )
         
     except HTTPException:
@@ -252,6 +1410,7 @@ async def get_tile_json(
 async def get_bounds(
     task_id: str = PathParam(..., description="Task ID"),
     request: Request = None,
+    response: Response = None,
     backend_base_url: Optional[str] = None
 ):
     """Get bounds for the specified task"""
@@ -259,17 +1418,15 @@ async def get_bounds(
         task_metadata = await get_task_metadata(task_id, backend_base_url)
         if not task_metadata.cogUrl:
             raise HTTPException(status_code=404, detail="COG not available for this task")
-        # Compute geographic bounds from COG
-        src = await get_cog_reader(task_metadata.cogUrl, task_id)
-        minx, miny, maxx, maxy = src.dataset.bounds
-        west, south, east, north = transform_bounds(
-            src.dataset.crs, "EPSG:4326", minx, miny, maxx, maxy
-        )
-        bounds_ll = [west, south, east, north]
+        # Geographic bounds from the COG's sidecar
+        sidecar = await get_cog_sidecar(task_metadata.cogUrl, task_id)
         query_params = dict(request.query_params) if request else {}
+        version = await ensure_content_version(task_id)
+        if response is not None:
+            response.headers["Cache-Control"] = "no-cache"
         return BoundsResponse(
-            url=get_tile_url(task_id, query_params),
-            bounds=bounds_ll
+            url=get_tile_url(task_id, query_params, version=version),
+            bounds=sidecar.bounds
         )
         
     except HTTPException:
@@ -290,51 +1447,18 @@ async def get_metadata(
         if not task_metadata.cogUrl:
             raise HTTPException(status_code=404, detail="COG not available for this task")
         
-        src = await get_cog_reader(task_metadata.cogUrl, task_id)
-        meta = src.info()
-        minzoom, maxzoom = get_zoom_safe(src)
-        
-        # Get color interpretation
-        colorinterp = [ci.name for ci in src.dataset.colorinterp]
-        
-        # Get statistics if available
-        try:
-            stats = src.statistics()
-            statistics = {
-                str(i+1): {
-                    'min': float(band_stats.min),
-                    'max': float(band_stats.max),
-                    'mean': float(band_stats.mean),
-                    'count': int(band_stats.count),
-                    'sum': float(band_stats.sum),
-                    'std': float(band_stats.std),
-                    'median': float(band_stats.median),
-                    'majority': float(band_stats.majority),
-                    'minority': float(band_stats.minority),
-                    'unique': int(band_stats.unique),
-                    'histogram': band_stats.histogram,
-                    'valid_percent': float(band_stats.valid_percent),
-                    'masked_percent': float(band_stats.masked_percent),
-                    'percentile_2': float(band_stats.percentile_2),
-                    'percentile_98': float(band_stats.percentile_98)
-                } for i, band_stats in enumerate(stats)
-            }
-        except Exception as e:
-            logger.warning(f"Could not get statistics for task {task_id}: {e}")
-            statistics = {}
-        
-        # Determine nodata value with fallback to dataset if missing
-        nodata_value = getattr(meta, "nodata", src.dataset.nodata)
+        sidecar = await get_cog_sidecar(task_metadata.cogUrl, task_id)
+        minzoom, maxzoom = get_zoom_safe(sidecar)
         
         return MetadataResponse(
-            bounds=task_metadata.bounds or meta.bounds,
+            bounds=task_metadata.bounds or sidecar.bounds,
             minzoom=minzoom - settings.zoom_extra_levels,
             maxzoom=maxzoom + settings.zoom_extra_levels,
             name=f"Task {task_id} Orthomosaic",
-            dtype=str(meta.dtype),
-            colorinterp=colorinterp,
-            nodata=nodata_value,
-            statistics=statistics
+            dtype=sidecar.dtype,
+            colorinterp=sidecar.colorinterp,
+            nodata=sidecar.nodata,
+            statistics=sidecar.statistics
         )
         
     except HTTPException:
@@ -343,6 +1467,173 @@ async def get_metadata(
         logger.error(f"Error getting metadata for task {task_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to get metadata")
 
+async def run_query(task_id: str, backend_base_url: Optional[str], count: int, fn, *args):
+    """Run a point/area query on a pooled reader of the task's COG"""
+    if count > settings.query_max_geometries:
+        raise HTTPException(status_code=400, detail=f"At most {settings.query_max_geometries} geometries per query")
+    task_metadata = await get_task_metadata(task_id, backend_base_url)
+    if not task_metadata.cogUrl:
+        raise HTTPException(status_code=404, detail="COG not available for this task")
+    try:
+        async with get_cog_reader(task_metadata.cogUrl, task_id) as src:
+            return await render_executor.run(fn, src, *args)
+    except RenderQueueFull:
+        raise render_queue_full()
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error querying values for task {task_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to query values")
+
+@app.get("/api/tiles/{task_id}/point/{lon},{lat}", response_model=PointValue)
+async def get_point(
+    task_id: str = PathParam(..., description="Task ID"),
+    lon: float = PathParam(..., description="Longitude"),
+    lat: float = PathParam(..., description="Latitude"),
+    backend_base_url: Optional[str] = None,
+):
+    """Full-resolution pixel values at a point"""
+    try:
+        point = parse_point([lon, lat])
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    values = await run_query(task_id, backend_base_url, 1, query_points, [point], settings.query_window_size)
+    return values[0]
+
+@app.post("/api/tiles/{task_id}/point", response_model=PointQueryResponse)
+async def get_points(
+    body: PointQueryRequest,
+    task_id: str = PathParam(..., description="Task ID"),
+    backend_base_url: Optional[str] = None,
+):
+    """
+    Full-resolution pixel values at many points, in request order.
+
+    ``values`` holds one entry per band (null where the pixel is masked) and
+    is null for points outside the raster.
+    """
+    try:
+        points = [parse_point(item) for item in body.points]
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    values = await run_query(
+        task_id, backend_base_url, len(points), query_points, points, settings.query_window_size
+    )
+    return PointQueryResponse(points=values)
+
+@app.post("/api/tiles/{task_id}/area", response_model=AreaQueryResponse)
+async def get_areas(
+    body: AreaQueryRequest,
+    task_id: str = PathParam(..., description="Task ID"),
+    backend_base_url: Optional[str] = None,
+):
+    """
+    Per-band count/min/max/mean/std/sum of the pixels inside each polygon, in request order.
+
+    Takes ``{"geometries": [...]}`` or a GeoJSON FeatureCollection (Feature
+    ids are echoed back). Areas wider than ``max_size`` pixels are measured
+    on a coarser overview; ``scale`` reports the decimation used.
+    """
+    items = body.geometries if body.geometries is not None else body.features
+    if items is None:
+        raise HTTPException(status_code=400, detail="Expected geometries or a FeatureCollection")
+    if body.max_size is not None and body.max_size < 1:
+        raise HTTPException(status_code=400, detail="max_size must be positive")
+    max_size = min(body.max_size or settings.query_max_size, settings.query_max_size)
+    try:
+        geometries = [parse_geometry(item) for item in items]
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    areas = await run_query(
+        task_id, backend_base_url, len(geometries), query_areas,
+        geometries, max_size, settings.query_window_size, body.all_touched,
+    )
+    return AreaQueryResponse(areas=areas)
+
+@app.get("/api/tiles/{task_id}/preview.{format}")
+async def get_preview(
+    task_id: str = PathParam(..., description="Task ID"),
+    format: Optional[str] = PathParam(..., description="Output format"),
+    bbox: Optional[str] = Query(default=None, description="west,south,east,north in WGS84 (default: the COG's bounds)"),
+    width: Optional[int] = Query(default=None, description="Image width in pixels"),
+    height: Optional[int] = Query(default=None, description="Image height in pixels"),
+    rescale: Optional[str] = Query(default=None, description="Rescale values (min,max)"),
+    color_map: Optional[str] = Query(default=None, description="Color map name"),
+    expression: Optional[str] = Query(default=None, description="Band math, e.g. where(b1 > 45, b1, nan)"),
+    nodata: Optional[str] = Query(default=None, description="Nodata value"),
+    profile: Optional[str] = Query(default=None, description="Encoder profile"),
+    v: Optional[str] = Query(default=None, description="Content version (from TileJSON)"),
+    request: Request = None,
+    backend_base_url: Optional[str] = None
+):
+    """
+    Web Mercator image of a bbox (default: the whole COG) at a given pixel size.
+
+    Rendered with one read from the best overview instead of stitching tiles,
+    and cached per COG version, bbox, size and render parameters.
+    """
+    try:
+        task_metadata = await get_task_metadata(task_id, backend_base_url)
+        
+        if not task_metadata.cogUrl:
+            raise HTTPException(status_code=404, detail="COG not available for this task")
+        
+        accept = request.headers.get('Accept', '') if request else ''
+        # The tile size plays no part in a preview
+        params = parse_tile_params(
+            settings.default_tile_size, format, rescale, color_map, nodata, accept, profile, expression
+        )
+        
+        sidecar = await get_cog_sidecar(task_metadata.cogUrl, task_id)
+        check_expression_bands(params, sidecar, task_id)
+        bounds, width, height = preview_frame(bbox, sidecar.bounds, width, height)
+        
+        before = content_version(task_id)
+        with job_context(priority=PRIORITY_OVERVIEW, task=task_id):
+            tile = await produce_preview(task_metadata, task_id, bounds, width, height, params)
+        return tile_response(tile, request, params, tile_cache_control(v, before, content_version(task_id)))
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error generating preview for task {task_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to render preview")
+
+@app.get("/api/tiles/{task_id}/preview")
+async def get_preview_default(
+    task_id: str = PathParam(..., description="Task ID"),
+    format: Optional[str] = Query(default=None, description="Output format (default: negotiated from Accept)"),
+    bbox: Optional[str] = Query(default=None, description="west,south,east,north in WGS84 (default: the COG's bounds)"),
+    width: Optional[int] = Query(default=None, description="Image width in pixels"),
+    height: Optional[int] = Query(default=None, description="Image height in pixels"),
+    rescale: Optional[str] = Query(default=None, description="Rescale values (min,max)"),
+    color_map: Optional[str] = Query(default=None, description="Color map name"),
+    expression: Optional[str] = Query(default=None, description="Band math, e.g. where(b1 > 45, b1, nan)"),
+    nodata: Optional[str] = Query(default=None, description="Nodata value"),
+    profile: Optional[str] = Query(default=None, description="Encoder profile"),
+    v: Optional[str] = Query(default=None, description="Content version (from TileJSON)"),
+    request: Request = None,
+    backend_base_url: Optional[str] = None,
+):
+    """Preview endpoint without format suffix: ``format`` query parameter or Accept negotiation"""
+    return await get_preview(
+        task_id=task_id,
+        format=format,
+        bbox=bbox,
+        width=width,
+        height=height,
+        rescale=rescale,
+        color_map=color_map,
+        expression=expression,
+        nodata=nodata,
+        profile=profile,
+        v=v,
+        request=request,
+        backend_base_url=backend_base_url,
+    )
+
 @app.get("/api/tiles/{task_id}/{z}/{x}/{y}.png")
 async def get_tile_png(
     task_id: str = PathParam(..., description="Task ID"),
@@ -352,8 +1643,11 @@ async def get_tile_png(
     size: int = Query(default=settings.default_tile_size, description="Tile size"),
     rescale: Optional[str] = Query(default=None, description="Rescale values (min,max)"),
     color_map: Optional[str] = Query(default=None, description="Color map name"),
+    expression: Optional[str] = Query(default=None, description="Band math, e.g. where(b1 > 45, b1, nan)"),
     nodata: Optional[str] = Query(default=None, description="Nodata value"),
     return_mask: bool = Query(default=False, description="Return mask"),
+    profile: Optional[str] = Query(default=None, description="Encoder profile"),
+    v: Optional[str] = Query(default=None, description="Content version (from TileJSON)"),
     request: Request = None,
     backend_base_url: Optional[str] = None,
 ):
@@ -368,185 +1662,309 @@ async def get_tile_png(
         size=size,
         rescale=rescale,
         color_map=color_map,
+        expression=expression,
         nodata=nodata,
         return_mask=return_mask,
+        profile=profile,
+        v=v,
         request=request,
         backend_base_url=backend_base_url,
     )
 
+# Declared before the suffix-less route: "{y}" would otherwise also capture
+# "3.webp" and fail integer validation instead of falling through
+@app.get("/api/tiles/{task_id}/{z}/{x}/{y}.{format}")
+async def get_tile(
+    task_id: str = PathParam(..., description="Task ID"),
+    z: int = PathParam(..., description="Zoom level"),
+    x: int = PathParam(..., description="Tile X coordinate"),
+    y: int = PathParam(..., description="Tile Y coordinate"),
+    format: Optional[str] = PathParam(..., description="Output format"),
+    size: int = Query(default=settings.default_tile_size, description="Tile size"),
+    rescale: Optional[str] = Query(default=None, description="Rescale values (min,max)"),
+    color_map: Optional[str] = Query(default=None, description="Color map name"),
+    expression: Optional[str] = Query(default=None, description="Band math, e.g. where(b1 > 45, b1, nan)"),
+    nodata: Optional[str] = Query(default=None, description="Nodata value"),
+    return_mask: bool = Query(default=False, description="Return mask"),
+    profile: Optional[str] = Query(default=None, description="Encoder profile"),
+    v: Optional[str] = Query(default=None, description="Content version (from TileJSON)"),
+    request: Request = None,
+    backend_base_url: Optional[str] = None
+):
+    """Get a tile image for the specified task"""
+    try:
+        task_metadata = await get_task_metadata(task_id, backend_base_url)
+        
+        if not task_metadata.cogUrl:
+            raise HTTPException(status_code=404, detail="COG not available for this task")
+        
+        accept = request.headers.get('Accept', '') if request else ''
+        params = parse_tile_params(size, format, rescale, color_map, nodata, accept, profile, expression)
+        
+        # Adjust zoom level for 512px tiles
+        if size == 512:
+            z -= 1
+        
+        before = content_version(task_id)
+        with job_context(priority=tile_priority(z), task=task_id):
+            tile = await produce_tile(task_metadata, task_id, z, x, y, params)
+        hot_set.touch_tile(task_id, z, x, y, hot_tile_params(params))
+        return tile_response(tile, request, params, tile_cache_control(v, before, content_version(task_id)))
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error generating tile for task {task_id} at {z}/{x}/{y}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to render tile")
+
 @app.get("/api/tiles/{task_id}/{z}/{x}/{y}")
 async def get_tile_default(
     task_id: str = PathParam(..., description="Task ID"),
     z: int = PathParam(..., description="Zoom level"),
     x: int = PathParam(..., description="Tile X coordinate"),
     y: int = PathParam(..., description="Tile Y coordinate"),
+    format: Optional[str] = Query(default=None, description="Output format (default: negotiated from Accept)"),
     size: int = Query(default=settings.default_tile_size, description="Tile size"),
     rescale: Optional[str] = Query(default=None, description="Rescale values (min,max)"),
     color_map: Optional[str] = Query(default=None, description="Color map name"),
+    expression: Optional[str] = Query(default=None, description="Band math, e.g. where(b1 > 45, b1, nan)"),
     nodata: Optional[str] = Query(default=None, description="Nodata value"),
     return_mask: bool = Query(default=False, description="Return mask"),
+    profile: Optional[str] = Query(default=None, description="Encoder profile"),
+    v: Optional[str] = Query(default=None, description="Content version (from TileJSON)"),
     request: Request = None,
     backend_base_url: Optional[str] = None,
 ):
-    """Fallback PNG tile endpoint without format suffix"""
+    """Tile endpoint without format suffix: ``format`` query parameter or Accept negotiation"""
     return await get_tile(
         task_id=task_id,
         z=z,
         x=x,
         y=y,
-        format="png",
+        format=format,
         size=size,
         rescale=rescale,
         color_map=color_map,
+        expression=expression,
         nodata=nodata,
         return_mask=return_mask,
+        profile=profile,
+        v=v,
         request=request,
         backend_base_url=backend_base_url,
     )
 
-@app.get("/api/tiles/{task_id}/{z}/{x}/{y}.{format}")
-async def get_tile(
-    task_id: str = PathParam(..., description="Task ID"),
+@app.get("/api/projects/{project_id}/tilejson", response_model=TileJsonResponse)
+async def get_mosaic_tile_json(
+    project_id: int = PathParam(..., description="Project ID"),
+    request: Request = None,
+    response: Response = None,
+    backend_base_url: Optional[str] = None,
+):
+    """TileJSON for the mosaic of every task of a project"""
+    index = await get_project_index(project_id, backend_base_url)
+    minzooms, maxzooms = [], []
+    for layer in index.layers:
+        sidecar = cog_sidecars.lookup(layer.task_id)
+        if layer.minzoom is not None and layer.maxzoom is not None:
+            minzooms.append(layer.minzoom)
+            maxzooms.append(layer.maxzoom)
+        elif sidecar is not None:
+            minzoom, maxzoom = get_zoom_safe(sidecar)
+            minzooms.append(minzoom)
+            maxzooms.append(maxzoom)
+    query_params = dict(request.query_params) if request else {}
+    if response is not None:
+        response.headers["Cache-Control"] = "no-cache"
+    return TileJsonResponse(
+        name=f"Project {project_id} Mosaic",
+        # Versioned once every layer's COG is local (i.e. after its tiles were first read)
+        tiles=[get_tile_url(str(project_id), query_params, prefix="/api/projects", version=mosaic_version(index))],
+        minzoom=min(minzooms, default=0) - settings.zoom_extra_levels,
+        maxzoom=max(maxzooms, default=22) + settings.zoom_extra_levels,
+        bounds=list(index.bounds),
+    )
+
+@app.get("/api/projects/{project_id}/{z}/{x}/{y}.{format}")
+async def get_mosaic_tile(
+    project_id: int = PathParam(..., description="Project ID"),
     z: int = PathParam(..., description="Zoom level"),
     x: int = PathParam(..., description="Tile X coordinate"),
     y: int = PathParam(..., description="Tile Y coordinate"),
-    format: str = PathParam(..., description="Output format"),
+    format: Optional[str] = PathParam(..., description="Output format"),
     size: int = Query(default=settings.default_tile_size, description="Tile size"),
     rescale: Optional[str] = Query(default=None, description="Rescale values (min,max)"),
     color_map: Optional[str] = Query(default=None, description="Color map name"),
+    expression: Optional[str] = Query(default=None, description="Band math, e.g. where(b1 > 45, b1, nan)"),
     nodata: Optional[str] = Query(default=None, description="Nodata value"),
-    return_mask: bool = Query(default=False, description="Return mask"),
+    profile: Optional[str] = Query(default=None, description="Encoder profile"),
+    v: Optional[str] = Query(default=None, description="Content version (from TileJSON)"),
     request: Request = None,
-    backend_base_url: Optional[str] = None
+    backend_base_url: Optional[str] = None,
 ):
-    """Get a tile image for the specified task"""
+    """One tile composited from every COG of the project that covers it"""
     try:
-        task_metadata = await get_task_metadata(task_id, backend_base_url)
-        
-        if not task_metadata.cogUrl:
-            raise HTTPException(status_code=404, detail="COG not available for this task")
-        
-        # Validate tile size
-        if size not in [256, 512]:
-            raise HTTPException(status_code=400, detail="Tile size must be 256 or 512")
+        index = await get_project_index(project_id, backend_base_url)
+        accept = request.headers.get('Accept', '') if request else ''
+        params = parse_tile_params(size, format, rescale, color_map, nodata, accept, profile, expression)
         
         # Adjust zoom level for 512px tiles
         if size == 512:
             z -= 1
         
-        # Validate format
-        if format not in ["png", "jpg", "jpeg", "webp", "tif", "tiff"]:
-            raise HTTPException(status_code=400, detail="Invalid format")
-        
-        # Process rescale parameter
-        rescale_arr = None
-        if rescale:
-            try:
-                rescale_arr = list(map(float, rescale.split(",")))
-                if len(rescale_arr) != 2:
-                    raise ValueError("Rescale must have exactly 2 values")
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid rescale format (should be 'min,max')")
-        
-        # Process nodata parameter
-        nodata_value = None
-        if nodata:
-            try:
-                nodata_value = np.nan if nodata.lower() == "nan" else float(nodata)
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid nodata value")
-        
-        # Validate color map
-        if color_map:
-            try:
-                colormap.get(color_map)
-            except InvalidColorMapName:
-                raise HTTPException(status_code=400, detail="Invalid color map")
-        
-        # Read tile from COG
-        src = await get_cog_reader(task_metadata.cogUrl, task_id)
-        # Check if tile exists (x, y, z)
-        if not src.tile_exists(x, y, z):
-            raise HTTPException(status_code=404, detail="Tile outside bounds")
-        
-        # Get zoom limits
-        minzoom, maxzoom = get_zoom_safe(src)
-        if z < minzoom - settings.zoom_extra_levels or z > maxzoom + settings.zoom_extra_levels:
-            raise HTTPException(status_code=404, detail="Zoom level outside bounds")
-        
-        try:
-            # Generate tile
-            tile = src.tile(
-                x, y, z,
-                tilesize=size,
-                nodata=nodata_value,
-                resampling_method="nearest"
-            )
-            
-            # Apply rescaling if specified
-            if rescale_arr:
-                tile = tile.post_process(
-                    rescale=rescale_arr
-                )
-            
-            # Apply color map if specified
-            if color_map:
-                tile = tile.post_process(
-                    color_map=colormap.get(color_map)
-                )
-            
-            # Determine output format
-            if format in ["jpg", "jpeg"]:
-                driver = "JPEG"
-                media_type = "image/jpeg"
-            elif format == "webp":
-                driver = "WEBP"
-                media_type = "image/webp"
-            elif format in ["tif", "tiff"]:
-                driver = "GTiff"
-                media_type = "image/tiff"
-            else:  # png
-                driver = "PNG"
-                media_type = "image/png"
-            
-            # Auto-detect format based on transparency if not specified
-            if format == "png" and request and 'image/webp' in request.headers.get('Accept', ''):
-                # Check if tile has transparency
-                if not np.equal(tile.mask, 255).all():
-                    driver = "WEBP"
-                    media_type = "image/webp"
-            
-            # Get profile options
-            options = img_profiles.get(driver.lower(), {})
-            
-            # Render tile to bytes
-            tile_bytes = tile.render(
-                img_format=driver,
-                **options
-            )
-            
-            return Response(
-                content=tile_bytes,
-                media_type=media_type,
-                headers={
-                    "Cache-Control": "public, max-age=3600",  # Cache for 1 hour
-                    "Access-Control-Allow-Origin": "*",
-                }
-            )
-            
-        except TileOutsideBounds:
-            raise HTTPException(status_code=404, detail="Tile outside bounds")
-        except ValueError as ve:
-            # rio-tiler may raise ValueError("cannot convert float infinity to integer")
-            logger.warning(f"ValueError while generating tile for task {task_id}: {ve}")
-            raise HTTPException(status_code=404, detail="Tile outside bounds")
-        
+        before = mosaic_version(index)
+        with job_context(priority=tile_priority(z), task=f"project:{project_id}"):
+            tile = await produce_mosaic_tile(project_id, index, z, x, y, params)
+        return tile_response(tile, request, params, tile_cache_control(v, before, mosaic_version(index)))
+    
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error generating tile for task {task_id} at {z}/{x}/{y}: {e}")
+        logger.error(f"Error generating mosaic tile for project {project_id} at {z}/{x}/{y}: {e}")
         raise HTTPException(status_code=500, detail="Failed to render tile")
 
+@app.get("/api/projects/{project_id}/{z}/{x}/{y}")
+async def get_mosaic_tile_default(
+    project_id: int = PathParam(..., description="Project ID"),
+    z: int = PathParam(..., description="Zoom level"),
+    x: int = PathParam(..., description="Tile X coordinate"),
+    y: int = PathParam(..., description="Tile Y coordinate"),
+    format: Optional[str] = Query(default=None, description="Output format (default: negotiated from Accept)"),
+    size: int = Query(default=settings.default_tile_size, description="Tile size"),
+    rescale: Optional[str] = Query(default=None, description="Rescale values (min,max)"),
+    color_map: Optional[str] = Query(default=None, description="Color map name"),
+    expression: Optional[str] = Query(default=None, description="Band math, e.g. where(b1 > 45, b1, nan)"),
+    nodata: Optional[str] = Query(default=None, description="Nodata value"),
+    profile: Optional[str] = Query(default=None, description="Encoder profile"),
+    v: Optional[str] = Query(default=None, description="Content version (from TileJSON)"),
+    request: Request = None,
+    backend_base_url: Optional[str] = None,
+):
+    """Mosaic tile without format suffix: ``format`` query parameter or Accept negotiation"""
+    return await get_mosaic_tile(
+        project_id=project_id,
+        z=z,
+        x=x,
+        y=y,
+        format=format,
+        size=size,
+        rescale=rescale,
+        color_map=color_map,
+        expression=expression,
+        nodata=nodata,
+        profile=profile,
+        v=v,
+        request=request,
+        backend_base_url=backend_base_url,
+    )
+
+@app.post("/api/tiles/{task_id}/batch")
+async def get_tile_batch(
+    body: BatchTileRequest,
+    task_id: str = PathParam(..., description="Task ID"),
+    request: Request = None,
+    backend_base_url: Optional[str] = None,
+):
+    """
+    Render many tiles in one request.
+
+    The response is a stream of length-prefixed frames in completion order:
+    a 4-byte big-endian header length, a 4-byte big-endian body length, a
+    JSON header ({"z", "x", "y", "status", "media_type", "etag"}) and the
+    encoded tile (empty unless status is 200; 204 marks a tile with no
+    valid pixels when EMPTY_TILE_NO_CONTENT is set).
+    """
+    task_metadata = await get_task_metadata(task_id, backend_base_url)
+    if not task_metadata.cogUrl:
+        raise HTTPException(status_code=404, detail="COG not available for this task")
+    if len(body.tiles) > settings.batch_max_tiles:
+        raise HTTPException(status_code=400, detail=f"At most {settings.batch_max_tiles} tiles per batch")
+    if any(len(t) != 3 for t in body.tiles):
+        raise HTTPException(status_code=400, detail="Tiles must be [z, x, y] triples")
+    
+    accept = request.headers.get('Accept', '') if request else ''
+    params = parse_tile_params(
+        body.size, body.format, body.rescale, body.color_map, body.nodata, accept, body.profile,
+        body.expression,
+    )
+    # Adjust zoom level for 512px tiles
+    zoom_offset = 1 if body.size == 512 else 0
+    # Neighbouring tiles next to each other so they share metatile renders
+    n = max(1, settings.metatile_size)
+    coords = sorted({tuple(t) for t in body.tiles}, key=lambda t: (t[0], t[2] // n, t[1] // n, t[2], t[1]))
+    limit = asyncio.Semaphore(render_executor.max_workers)
+    
+    async def render_one(z: int, x: int, y: int):
+        header = {"z": z, "x": x, "y": y}
+        async with limit:
+            try:
+                # Prefetch: prioritized like tile requests but without the request deadline
+                with job_context(priority=tile_priority(z - zoom_offset), task=task_id, deadline=None):
+                    tile = await produce_tile(task_metadata, task_id, z - zoom_offset, x, y, params)
+            except HTTPException as e:
+                return {**header, "status": e.status_code}, b""
+            except Exception as e:
+                logger.error(f"Error generating batch tile for task {task_id} at {z}/{x}/{y}: {e}")
+                return {**header, "status": 500}, b""
+        if not tile.content:
+            return {**header, "status": 204}, b""
+        return {**header, "status": 200, "media_type": tile.media_type, "etag": tile.etag}, tile.content
+    
+    async def frames():
+        jobs = [asyncio.ensure_future(render_one(*t)) for t in coords]
+        try:
+            for next_done in asyncio.as_completed(jobs):
+                header, content = await next_done
+                header_bytes = json.dumps(header).encode()
+                yield struct.pack(">II", len(header_bytes), len(content)) + header_bytes + content
+        finally:
+            for job in jobs:
+                job.cancel()
+    
+    return StreamingResponse(
+        frames(),
+        media_type="application/x-tile-batch",
+        headers={"Access-Control-Allow-Origin": "*"},
+    )
+
+@app.post("/api/tiles/{task_id}/seed", response_model=SeedState, status_code=202,
+          dependencies=[Depends(require_admin)])
+async def start_seed(
+    body: SeedRequest,
+    task_id: str = PathParam(..., description="Task ID"),
+    backend_base_url: Optional[str] = None,
+):
+    """
+    Pre-render the task's tile pyramid into the tile cache in the background.
+
+    Submitting the same spec again returns the running job, or resumes it
+    from its last checkpoint if it was interrupted or cancelled.
+    """
+    spec, version, tiles, produce = await prepare_seed(task_id, body, backend_base_url)
+    return tile_seeder.start(task_id, spec, version, tiles, produce, seed_concurrency())
+
+@app.get("/api/tiles/{task_id}/seed/{job_id}", response_model=SeedState, dependencies=[Depends(require_admin)])
+async def get_seed_status(
+    task_id: str = PathParam(..., description="Task ID"),
+    job_id: str = PathParam(..., description="Seed job ID"),
+):
+    """Progress of a seed job"""
+    state = tile_seeder.status(job_id)
+    if state is None or state.task_id != task_id:
+        raise HTTPException(status_code=404, detail="Seed job not found")
+    return state
+
+@app.delete("/api/tiles/{task_id}/seed/{job_id}", response_model=SeedState, dependencies=[Depends(require_admin)])
+async def cancel_seed(
+    task_id: str = PathParam(..., description="Task ID"),
+    job_id: str = PathParam(..., description="Seed job ID"),
+):
+    """Cancel a seed job (it can be resumed by submitting it again)"""
+    state = tile_seeder.status(job_id)
+    if state is None or state.task_id != task_id:
+        raise HTTPException(status_code=404, detail="Seed job not found")
+    return tile_seeder.cancel(job_id)
+
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
@@ -555,10 +1973,21 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
+            "cache_stats": "/cache/stats",
+            "metrics": "/metrics",
             "tilejson": "/api/tiles/{task_id}/tilejson",
             "bounds": "/api/tiles/{task_id}/bounds",
             "metadata": "/api/tiles/{task_id}/metadata",
-            "tiles": "/api/tiles/{task_id}/{z}/{x}/{y}[.format]"
+            "point": "/api/tiles/{task_id}/point/{lon},{lat}",
+            "points": "POST /api/tiles/{task_id}/point",
+            "area": "POST /api/tiles/{task_id}/area",
+            "preview": "/api/tiles/{task_id}/preview[.format]",
+            "tiles": "/api/tiles/{task_id}/{z}/{x}/{y}[.format]",
+            "batch": "POST /api/tiles/{task_id}/batch",
+            "seed": "POST /api/tiles/{task_id}/seed",
+            "mosaic_tilejson": "/api/projects/{project_id}/tilejson",
+            "mosaic_tiles": "/api/projects/{project_id}/{z}/{x}/{y}[.format]",
+            "invalidate": "POST /admin/tasks/{task_id}/invalidate"
         }
     }
 
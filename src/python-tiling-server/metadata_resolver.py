@@ -0,0 +1,375 @@
+"""
+Task metadata resolver backed by a pooled client, with coalescing and negative caching
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+from cachetools import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class TaskNotFound(Exception):
+    """The backend does not know the task (or refused access to it)"""
+
+
+class MetadataFetchError(Exception):
+    """The backend could not be reached or returned an unexpected response"""
+
+
+@dataclass
+class _Entry:
+    value: Any  # parsed metadata, or None for a cached 404
+    fetched_at: float
+
+    @property
+    def negative(self) -> bool:
+        return self.value is None
+
+
+class SharedMetadataStore:
+    """
+    Cross-worker metadata tier in a local SQLite database.
+
+    Every gunicorn worker on the pod opens the same file (WAL mode), so a task
+    resolved by one worker is immediately available to the others.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn_pid: Optional[int] = None
+        self._connection = None
+        conn = sqlite3.connect(path, timeout=5.0, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS task_metadata ("
+                " task_id TEXT PRIMARY KEY, data TEXT, fetched_at REAL NOT NULL)"
+            )
+        finally:
+            conn.close()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # SQLite connections must not cross fork(): the store is created in the
+        # gunicorn master with --preload, so each worker opens its own
+        if self._conn_pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._conn_pid = os.getpid()
+        return self._connection
+
+    def get(self, task_id: str) -> Optional[Tuple[Optional[dict], float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, fetched_at FROM task_metadata WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        data, fetched_at = row
+        return (json.loads(data) if data is not None else None), fetched_at
+
+    def put(self, task_id: str, data: Optional[dict], fetched_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO task_metadata (task_id, data, fetched_at) VALUES (?, ?, ?)",
+                (task_id, json.dumps(data) if data is not None else None, fetched_at),
+            )
+
+    def delete(self, task_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM task_metadata WHERE task_id = ?", (task_id,))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn_pid == os.getpid():
+                self._connection.close()
+                self._conn_pid = None
+
+
+class MetadataResolver:
+    """
+    Resolve ``/api/tiles/{id}/info`` with one long-lived connection pool.
+
+    - fresh entries (younger than ``ttl``) are served from memory
+    - entries up to ``ttl + stale_ttl`` old are served immediately while a
+      single background refresh runs (stale-while-revalidate); they are also
+      served if that refresh fails
+    - 404s are remembered for ``negative_ttl`` seconds
+    - concurrent misses for the same task share one backend request
+    - an optional :class:`SharedMetadataStore` is consulted before the backend
+
+    Entries are keyed by task id alone, so a request's ``backend_base_url`` is
+    only used when it is one of ``allowed_backend_urls``; anything else falls
+    back to the default backend rather than letting a client plant metadata
+    (and COG URLs) for every other request.
+    """
+
+    def __init__(
+        self,
+        default_backend_url: str,
+        parse: Callable[[dict], Any],
+        ttl: float = 300.0,
+        stale_ttl: float = 600.0,
+        negative_ttl: float = 30.0,
+        maxsize: int = 1000,
+        timeout: float = 300.0,
+        max_connections: int = 20,
+        shared_store: Optional[SharedMetadataStore] = None,
+        project_tasks_path: str = "/api/tiles/projects/{project_id}/tasks",
+        allowed_backend_urls: Iterable[str] = (),
+        api_key: Optional[str] = None,
+    ):
+        self.default_backend_url = default_backend_url
+        self.allowed_backend_urls = {url.rstrip("/") for url in allowed_backend_urls} | {
+            default_backend_url.rstrip("/")
+        }
+        self.parse = parse
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.shared_store = shared_store
+        self.project_tasks_path = project_tasks_path
+        self.api_key = api_key
+        self._entries: LRUCache = LRUCache(maxsize=maxsize)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.negative_hits = 0
+        self.shared_hits = 0
+        self.fetches = 0
+        self.project_fetches = 0
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+
+    async def close(self) -> None:
+        for task in list(self._inflight.values()):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self.shared_store is not None:
+            self.shared_store.close()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            # Used outside the app lifespan (scripts, tests); still pooled
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        return self._client
+
+    def backend_url(self, backend_base_url: Optional[str]) -> str:
+        """The requested backend if it is an allowed one, otherwise the default"""
+        if backend_base_url and backend_base_url.rstrip("/") in self.allowed_backend_urls:
+            return backend_base_url.rstrip("/")
+        if backend_base_url:
+            logger.debug(f"Ignoring backend_base_url {backend_base_url!r}: not an allowed backend")
+        return self.default_backend_url
+
+    def invalidate(self, task_id: str) -> None:
+        self._entries.pop(task_id, None)
+        if self.shared_store is not None:
+            self.shared_store.delete(task_id)
+
+    def peek(self, task_id: str) -> Any:
+        """Cached metadata for a task without touching the backend (None if unknown)"""
+        entry = self._entries.get(task_id)
+        return entry.value if entry is not None else None
+
+    def fetched_at(self, task_id: str) -> Optional[float]:
+        """Wall-clock time the task's cached metadata was fetched (None if not cached)"""
+        entry = self._entries.get(task_id)
+        return time.time() - (time.monotonic() - entry.fetched_at) if entry is not None else None
+
+    def prime(self, task_id: str, data: dict, fetched_at: float) -> bool:
+        """
+        Seed the cache with metadata fetched at wall-clock time ``fetched_at``
+        (e.g. by a previous worker); ignored when too old to be served stale
+        """
+        if task_id in self._entries:
+            return False
+        entry = self._entry_from(data, fetched_at)
+        if entry is None:
+            return False
+        self._entries[task_id] = entry
+        return True
+
+    async def resolve(self, task_id: str, backend_base_url: Optional[str] = None) -> Any:
+        now = time.monotonic()
+        entry = self._entries.get(task_id)
+        if entry is None and self.shared_store is not None:
+            entry = await self._load_shared(task_id)
+
+        if entry is not None:
+            age = now - entry.fetched_at
+            if entry.negative:
+                if age < self.negative_ttl:
+                    self.negative_hits += 1
+                    raise TaskNotFound(task_id)
+            elif age < self.ttl:
+                self.hits += 1
+                return entry.value
+            elif age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._refresh(task_id, backend_base_url, background=True)
+                return entry.value
+
+        task = self._refresh(task_id, backend_base_url)
+        return await asyncio.shield(task)
+
+    async def list_project(self, project_id: int, backend_base_url: Optional[str] = None) -> List[Any]:
+        """
+        Metadata of every task of a project, in the backend's order.
+
+        Each task is also stored as a regular entry, so tile requests for the
+        project's tasks resolve without another backend call. The backend's
+        listing requires its API key, sent as ``X-API-Key``.
+        """
+        base_url = self.backend_url(backend_base_url)
+        path = self.project_tasks_path.format(project_id=project_id)
+        self.project_fetches += 1
+        try:
+            headers = {"X-API-Key": self.api_key} if self.api_key else None
+            response = await self.client.get(f"{base_url}{path}", headers=headers)
+        except httpx.HTTPError as e:
+            raise MetadataFetchError(f"{type(e).__name__}: {e}")
+        if response.status_code == 404:
+            raise TaskNotFound(f"project {project_id}")
+        if response.status_code in (401, 403):
+            # A missing or wrong BACKEND_API_KEY is a configuration error, not a missing project
+            raise MetadataFetchError(f"HTTP {response.status_code} listing project {project_id}; check BACKEND_API_KEY")
+        if response.is_error:
+            error_cls = TaskNotFound if response.status_code < 500 else MetadataFetchError
+            raise error_cls(f"HTTP {response.status_code}: {response.text}")
+
+        try:
+            items = response.json()
+            if isinstance(items, dict):
+                items = items.get("tasks", [])
+        except ValueError as e:
+            raise MetadataFetchError(f"Invalid project response: {e}")
+        tasks = []
+        for data in items:
+            try:
+                value = self.parse(data)
+            except Exception as e:
+                logger.warning(f"Skipping invalid task in project {project_id}: {e}")
+                continue
+            await self._store(str(data["id"]), value, data)
+            tasks.append(value)
+        return tasks
+
+    def _refresh(self, task_id: str, backend_base_url: Optional[str], background: bool = False) -> asyncio.Task:
+        task = self._inflight.get(task_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(task_id, backend_base_url))
+            self._inflight[task_id] = task
+            task.add_done_callback(lambda t: self._fetch_done(task_id, t, background))
+        return task
+
+    def _fetch_done(self, task_id: str, task: asyncio.Task, background: bool) -> None:
+        self._inflight.pop(task_id, None)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if background and error is not None and not isinstance(error, TaskNotFound):
+            logger.warning(f"Background metadata refresh for task {task_id} failed: {error}")
+
+    async def _fetch(self, task_id: str, backend_base_url: Optional[str]) -> Any:
+        base_url = self.backend_url(backend_base_url)
+        self.fetches += 1
+        try:
+            response = await self.client.get(f"{base_url}/api/tiles/{task_id}/info")
+        except httpx.HTTPError as e:
+            return self._on_error(task_id, MetadataFetchError(f"{type(e).__name__}: {e}"))
+
+        if response.status_code == 404:
+            await self._store(task_id, None)
+            raise TaskNotFound(task_id)
+        if response.is_error:
+            error_cls = TaskNotFound if response.status_code < 500 else MetadataFetchError
+            return self._on_error(task_id, error_cls(f"HTTP {response.status_code}: {response.text}"))
+
+        try:
+            data = response.json()
+            value = self.parse(data)
+        except Exception as e:
+            return self._on_error(task_id, MetadataFetchError(f"Invalid metadata response: {e}"))
+        await self._store(task_id, value, data)
+        return value
+
+    def _on_error(self, task_id: str, error: Exception) -> Any:
+        """Fall back to a stale positive entry, otherwise propagate"""
+        entry = self._entries.get(task_id)
+        if entry is not None and not entry.negative:
+            logger.warning(f"Serving stale metadata for task {task_id}: {error}")
+            return entry.value
+        raise error
+
+    async def _store(self, task_id: str, value: Any, data: Optional[dict] = None) -> None:
+        self._entries[task_id] = _Entry(value=value, fetched_at=time.monotonic())
+        if self.shared_store is not None:
+            try:
+                # Wall-clock time in the shared tier; monotonic clocks differ per process
+                await asyncio.to_thread(self.shared_store.put, task_id, data, time.time())
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to write shared metadata for task {task_id}: {e}")
+
+    async def _load_shared(self, task_id: str) -> Optional[_Entry]:
+        try:
+            row = await asyncio.to_thread(self.shared_store.get, task_id)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read shared metadata for task {task_id}: {e}")
+            return None
+        if row is None:
+            return None
+        entry = self._entry_from(*row)
+        if entry is None:
+            return None
+        self.shared_hits += 1
+        self._entries[task_id] = entry
+        return entry
+
+    def _entry_from(self, data: Optional[dict], fetched_at_wall: float) -> Optional[_Entry]:
+        age = max(0.0, time.time() - fetched_at_wall)
+        if age >= (self.negative_ttl if data is None else self.ttl + self.stale_ttl):
+            return None
+        try:
+            value = self.parse(data) if data is not None else None
+        except Exception:
+            return None
+        return _Entry(value=value, fetched_at=time.monotonic() - age)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "negative_hits": self.negative_hits,
+            "shared_hits": self.shared_hits,
+            "fetches": self.fetches,
+            "project_fetches": self.project_fetches,
+            "inflight": len(self._inflight),
+        }
@@ -0,0 +1,438 @@
+"""
+Prometheus metrics for the tile hot path, aggregated across gunicorn workers, and Server-Timing headers
+"""
+
+import asyncio
+import bisect
+import contextvars
+import fcntl
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds; tiles range from sub-millisecond cache hits to multi-second cold downloads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Per-request stage timings for the Server-Timing header; None outside a request
+_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "stage_timings", default=None
+)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = registry._lock
+        self._values: Dict[tuple, Any] = {}
+
+    def samples(self) -> List[list]:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, value: float = 1.0, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def set(self, value: float, *labels: str) -> None:
+        """Mirror a total kept elsewhere (a component's own counters)"""
+        with self._lock:
+            self._values[labels] = value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, value: float = 1.0, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def dec(self, value: float = 1.0, *labels: str) -> None:
+        self.inc(-value, *labels)
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help, labels, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # Per-bucket counts (last one is +Inf), then the sum
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self) -> List[list]:
+        with self._lock:
+            return [[list(key), list(value)] for key, value in self._values.items()]
+
+
+class MetricsRegistry:
+    """
+    Metrics of one worker, written to a shared directory and merged on scrape.
+
+    Every worker keeps its own counters in memory (a lock and a dict update
+    per observation) and periodically writes them to ``<dir>/worker-<pid>.json``.
+    ``/metrics`` is answered by whichever worker receives the scrape: it writes
+    its own file, folds the files of workers that have exited into
+    ``retired.json`` (their counters and histograms stay in the totals, their
+    gauges are dropped) and sums everything per label set. Values of other live
+    workers are at most one flush interval old.
+
+    Collectors registered with ``add_collector`` run before each write and
+    copy counters that components already keep (``snapshot()``) into metrics,
+    so the hot path is not instrumented twice.
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._flusher = None
+        os.makedirs(directory, exist_ok=True)
+
+    # Declaration
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(self, name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(self, name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, help, labels, buckets))
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        self._collectors.append(collector)
+
+    # Worker files
+
+    @property
+    def worker_path(self) -> str:
+        return os.path.join(self.directory, f"worker-{os.getpid()}.json")
+
+    def snapshot(self) -> Dict[str, Any]:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        return {
+            name: {
+                "type": metric.kind,
+                "help": metric.help,
+                "labels": list(metric.labels),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "samples": metric.samples(),
+            }
+            for name, metric in self._metrics.items()
+        }
+
+    def flush(self) -> None:
+        """Write this worker's metrics file"""
+        _write_json(self.worker_path, {"pid": os.getpid(), "metrics": self.snapshot()})
+
+    def collect(self) -> Dict[str, Any]:
+        """Flush, then merge the files of every worker (live and retired)"""
+        self.flush()
+        lock_fd = os.open(os.path.join(self.directory, ".merge.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            retired_path = os.path.join(self.directory, "retired.json")
+            retired = _read_json(retired_path) or {}
+            live = []
+            exited = []
+            for name in os.listdir(self.directory):
+                if not (name.startswith("worker-") and name.endswith(".json")):
+                    continue
+                path = os.path.join(self.directory, name)
+                data = _read_json(path)
+                if data is None:
+                    continue
+                if _pid_alive(data.get("pid")):
+                    live.append(data["metrics"])
+                else:
+                    exited.append((path, data["metrics"]))
+            if exited:
+                for _, data in exited:
+                    _merge(retired, data, gauges=False)
+                _write_json(retired_path, retired)
+                for path, _ in exited:
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+        finally:
+            os.close(lock_fd)
+
+        merged: Dict[str, Any] = {}
+        _merge(merged, retired, gauges=False)
+        for data in live:
+            _merge(merged, data, gauges=True)
+        return merged
+
+    def exposition(self) -> str:
+        """Prometheus text format (version 0.0.4) of the merged metrics"""
+        return render_text(self.collect())
+
+    # Background flusher
+
+    def start_flusher(self) -> None:
+        async def loop():
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                try:
+                    await asyncio.to_thread(self.flush)
+                except Exception as e:
+                    logger.warning(f"Failed to write worker metrics: {e}")
+
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(loop())
+
+    async def stop_flusher(self) -> None:
+        if self._flusher is None:
+            return
+        self._flusher.cancel()
+        try:
+            await self._flusher
+        except asyncio.CancelledError:
+            pass
+        self._flusher = None
+        # Final totals of this worker survive it in retired.json on the next scrape
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning(f"Failed to write worker metrics: {e}")
+
+
+def _merge(into: Dict[str, Any], data: Dict[str, Any], gauges: bool) -> None:
+    """Add one worker's metrics into ``into`` (summing per label set)"""
+    for name, metric in data.items():
+        if metric["type"] == "gauge" and not gauges:
+            continue
+        target = into.get(name)
+        if target is None or target.get("buckets") != metric.get("buckets"):
+            target = into[name] = {**metric, "samples": []}
+        index = {tuple(sample[0]): sample for sample in target["samples"]}
+        for labels, value in metric["samples"]:
+            existing = index.get(tuple(labels))
+            if existing is None:
+                sample = [list(labels), list(value) if isinstance(value, list) else value]
+                target["samples"].append(sample)
+                index[tuple(labels)] = sample
+            elif isinstance(value, list):
+                existing[1] = [a + b for a, b in zip(existing[1], value)]
+            else:
+                existing[1] += value
+
+
+def render_text(metrics: Dict[str, Any]) -> str:
+    lines = []
+    for name in sorted(metrics):
+        metric = metrics[name]
+        kind = metric["type"]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {kind}")
+        labelnames = metric["labels"]
+        for labels, value in sorted(metric["samples"], key=lambda sample: sample[0]):
+            pairs = list(zip(labelnames, labels))
+            if kind == "histogram":
+                cumulative = 0
+                for bound, count in zip(list(metric["buckets"]) + [math.inf], value[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(pairs + [('le', _number(bound))])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(pairs)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(pairs)} {cumulative}")
+            else:
+                lines.append(f"{name}{_labels(pairs)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _labels(pairs: List[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not isinstance(pid, int):
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+# Request stage timing
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Record a stage measured elsewhere (e.g. render queue wait)"""
+    if stage_seconds is not None:
+        stage_seconds.observe(seconds, stage)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Time a stage into the stage histogram and the current request's Server-Timing"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def current_timings() -> Optional[List[Tuple[str, float]]]:
+    """Stages recorded so far for the current request"""
+    return _timings.get()
+
+
+def stage_totals(timings: List[Tuple[str, float]]) -> Dict[str, float]:
+    """Seconds per stage; repeated stages (metatile rows, retries) are summed"""
+    durations: Dict[str, float] = {}
+    for stage, seconds in timings:
+        durations[stage] = durations.get(stage, 0.0) + seconds
+    return durations
+
+
+def server_timing(timings: List[Tuple[str, float]], total: float) -> str:
+    """Server-Timing header value"""
+    durations = stage_totals(timings)
+    durations["total"] = total
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in durations.items())
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request by route handler and status,
+    counting requests in flight and adding a ``Server-Timing`` header with the
+    stages recorded while the response was produced.
+    """
+
+    def __init__(self, app, server_timing_header: bool = True):
+        self.app = app
+        self.server_timing_header = server_timing_header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or registry is None:
+            await self.app(scope, receive, send)
+            return
+
+        timings: List[Tuple[str, float]] = []
+        token = _timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+        requests_in_flight.inc()
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing_header:
+                    header = server_timing(timings, time.perf_counter() - started)
+                    # Timing-Allow-Origin lets the map page read it for cross-origin tiles
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", header.encode("latin-1")),
+                        (b"timing-allow-origin", b"*"),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
+            requests_in_flight.dec()
+            handler = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            request_seconds.observe(time.perf_counter() - started, handler, str(status))
+
+
+# Worker-wide registry and hot-path metrics (set up by ``configure``)
+registry: Optional[MetricsRegistry] = None
+stage_seconds: Optional[Histogram] = None
+request_seconds: Optional[Histogram] = None
+requests_in_flight: Optional[Gauge] = None
+
+
+def configure(directory: str, flush_interval: float = 5.0) -> MetricsRegistry:
+    """Create the worker's registry and the metrics recorded on the request path"""
+    global registry, stage_seconds, request_seconds, requests_in_flight
+    registry = MetricsRegistry(directory, flush_interval)
+    stage_seconds = registry.histogram(
+        "tiler_stage_duration_seconds",
+        "Time spent per request stage (metadata, download, open, cache, queue, read, process, encode, ...)",
+        ("stage",),
+    )
+    request_seconds = registry.histogram(
+        "tiler_http_request_duration_seconds", "HTTP request latency by route handler and status",
+        ("handler", "status"),
+    )
+    requests_in_flight = registry.gauge("tiler_http_requests_in_flight", "HTTP requests being served")
+    return registry
@@ -0,0 +1,296 @@
+"""
+Point values and per-geometry statistics from grouped windowed reads of a COG
+"""
+
+import math
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from affine import Affine
+from pydantic import BaseModel
+from rasterio.crs import CRS
+from rasterio.enums import MergeAlg
+from rasterio.features import bounds as geometry_bounds, geometry_mask, rasterize
+from rasterio.warp import transform, transform_geom
+from rasterio.windows import Window
+from rio_tiler.io import COGReader
+
+from metrics import timed
+
+WGS84 = CRS.from_epsg(4326)
+
+# (row_start, col_start, row_stop, col_stop) in pixels of the full-resolution raster
+PixelBox = Tuple[int, int, int, int]
+
+
+class InvalidQuery(ValueError):
+    """Raised for points or geometries that cannot be queried"""
+
+
+class PointValue(BaseModel):
+    coordinates: List[float]  # [lon, lat]
+    values: Optional[List[Optional[float]]] = None  # per band (None where masked); None outside the raster
+
+
+class BandStats(BaseModel):
+    count: int
+    min: float
+    max: float
+    mean: float
+    std: float
+    sum: float
+
+
+class AreaStats(BaseModel):
+    id: Optional[Union[str, int]] = None  # Feature id, if given
+    pixels: int = 0  # pixels inside the geometry at the read resolution
+    valid_percent: float = 0.0
+    scale: int = 1  # read pixel size relative to full resolution (overview decimation)
+    statistics: Dict[str, BandStats] = {}  # per band ("1", "2", ...), bands without valid pixels left out
+
+
+def parse_point(item: Any) -> Tuple[float, float]:
+    """(lon, lat) from a [lon, lat] pair, a GeoJSON Point or a Feature with one"""
+    if isinstance(item, dict):
+        geometry = item.get("geometry") if item.get("type") == "Feature" else item
+        if not isinstance(geometry, dict) or geometry.get("type") != "Point":
+            raise InvalidQuery("Points must be [lon, lat] pairs or GeoJSON Points")
+        item = geometry.get("coordinates")
+    if not isinstance(item, (list, tuple)) or len(item) < 2:
+        raise InvalidQuery("Points must be [lon, lat] pairs or GeoJSON Points")
+    try:
+        lon, lat = float(item[0]), float(item[1])
+    except (TypeError, ValueError):
+        raise InvalidQuery(f"Invalid point {item}")
+    if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+        raise InvalidQuery(f"Point {item} is not a WGS84 longitude/latitude")
+    return lon, lat
+
+
+def parse_geometry(item: Any) -> Tuple[Optional[Union[str, int]], Dict[str, Any]]:
+    """(id, geometry) from a GeoJSON Polygon/MultiPolygon or a Feature with one"""
+    if not isinstance(item, dict):
+        raise InvalidQuery("Areas must be GeoJSON geometries or Features")
+    feature_id = None
+    if item.get("type") == "Feature":
+        feature_id = item.get("id")
+        if feature_id is None:
+            feature_id = (item.get("properties") or {}).get("id")
+        item = item.get("geometry")
+    if not isinstance(item, dict) or item.get("type") not in ("Polygon", "MultiPolygon"):
+        raise InvalidQuery("Areas must be Polygons or MultiPolygons")
+    if not item.get("coordinates"):
+        raise InvalidQuery("Areas must have coordinates")
+    return feature_id, item
+
+
+def _pixel_box(bounds: Sequence[float], inverse: Affine, height: int, width: int) -> Optional[PixelBox]:
+    """Pixels covering a native-CRS bounding box, clipped to the raster (None if outside)"""
+    minx, miny, maxx, maxy = bounds
+    cols, rows = inverse * (np.array([minx, maxx]), np.array([maxy, miny]))
+    row_start, row_stop = math.floor(min(rows)), math.ceil(max(rows))
+    col_start, col_stop = math.floor(min(cols)), math.ceil(max(cols))
+    if row_stop < 0 or col_stop < 0 or row_start >= height or col_start >= width:
+        return None
+    # Boxes thinner than a pixel still cover the pixel they fall in
+    row_stop = max(row_stop, row_start + 1)
+    col_stop = max(col_stop, col_start + 1)
+    row_start, col_start = max(0, row_start), max(0, col_start)
+    row_stop, col_stop = min(height, row_stop), min(width, col_stop)
+    if row_start >= row_stop or col_start >= col_stop:
+        return None
+    return row_start, col_start, row_stop, col_stop
+
+
+def _union(boxes: Sequence[PixelBox]) -> PixelBox:
+    return (
+        min(b[0] for b in boxes),
+        min(b[1] for b in boxes),
+        max(b[2] for b in boxes),
+        max(b[3] for b in boxes),
+    )
+
+
+def _overview_scale(extent: int, max_size: int, factors: Sequence[int]) -> int:
+    """Smallest overview decimation that reads ``extent`` pixels in at most ``max_size``"""
+    needed = extent / max_size
+    if needed <= 1:
+        return 1
+    for factor in factors:
+        if factor >= needed:
+            return factor
+    # Coarser than the coarsest overview: GDAL decimates from that one
+    return math.ceil(needed)
+
+
+def query_points(src: COGReader, points: Sequence[Tuple[float, float]], window_size: int = 512) -> List[PointValue]:
+    """
+    Full-resolution pixel values under WGS84 points (blocking; runs on the render executor).
+
+    Points falling in the same ``window_size`` cell of the raster share one
+    windowed read, and their values are picked out with one fancy index.
+    """
+    dataset = src.dataset
+    results = [PointValue(coordinates=[lon, lat]) for lon, lat in points]
+    if not points:
+        return results
+    lons, lats = zip(*points)
+    xs, ys = transform(WGS84, dataset.crs, lons, lats)
+    cols, rows = ~dataset.transform * (np.asarray(xs), np.asarray(ys))
+    rows = np.floor(rows).astype(np.int64)
+    cols = np.floor(cols).astype(np.int64)
+    inside = (rows >= 0) & (rows < dataset.height) & (cols >= 0) & (cols < dataset.width)
+
+    groups: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+    for i in np.flatnonzero(inside):
+        groups[(rows[i] // window_size, cols[i] // window_size)].append(int(i))
+
+    for members in groups.values():
+        r, c = rows[members], cols[members]
+        row_start, col_start = int(r.min()), int(c.min())
+        window = Window(col_start, row_start, int(c.max()) - col_start + 1, int(r.max()) - row_start + 1)
+        with timed("read"):
+            data = dataset.read(window=window, masked=True)
+        picked = data[:, r - row_start, c - col_start]
+        values = picked.data.astype(np.float64)
+        masked = np.ma.getmaskarray(picked)
+        for j, i in enumerate(members):
+            results[i].values = [None if masked[b, j] else float(values[b, j]) for b in range(dataset.count)]
+    return results
+
+
+def query_areas(
+    src: COGReader,
+    geometries: Sequence[Tuple[Optional[Union[str, int]], Dict[str, Any]]],
+    max_size: int = 4096,
+    window_size: int = 512,
+    all_touched: bool = False,
+) -> List[AreaStats]:
+    """
+    Per-band statistics of the pixels inside WGS84 polygons (blocking; runs on the render executor).
+
+    Each geometry is read at full resolution unless its bounding box spans
+    more than ``max_size`` pixels, in which case it is measured on the
+    overview that brings it under that. Geometries with the same scale whose
+    top-left corner falls in the same ``window_size`` cell (in read pixels)
+    share one windowed read, rasterized once into a zone raster (per
+    geometry only where geometries overlap) and reduced per zone for all
+    geometries of the window at once.
+    """
+    dataset = src.dataset
+    inverse = ~dataset.transform
+    factors = sorted(dataset.overviews(1))
+    results = [AreaStats(id=feature_id) for feature_id, _ in geometries]
+
+    shapes: Dict[int, Dict[str, Any]] = {}
+    boxes: Dict[int, PixelBox] = {}
+    groups: Dict[Tuple[int, int, int], List[int]] = defaultdict(list)
+    try:
+        projected = transform_geom(WGS84, dataset.crs, [geometry for _, geometry in geometries]) if geometries else []
+    except Exception as e:
+        raise InvalidQuery(f"Invalid geometry: {e}")
+    for i, shape in enumerate(projected):
+        box = _pixel_box(geometry_bounds(shape), inverse, dataset.height, dataset.width)
+        if box is None:
+            continue
+        scale = _overview_scale(max(box[2] - box[0], box[3] - box[1]), max_size, factors)
+        shapes[i] = shape
+        boxes[i] = box
+        results[i].scale = scale
+        cell = window_size * scale
+        groups[(scale, box[0] // cell, box[1] // cell)].append(i)
+
+    for (scale, _, _), members in groups.items():
+        row_start, col_start, row_stop, col_stop = _union([boxes[i] for i in members])
+        window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+        height = max(1, math.ceil(window.height / scale))
+        width = max(1, math.ceil(window.width / scale))
+        with timed("read"):
+            data = dataset.read(window=window, out_shape=(dataset.count, height, width), masked=True)
+        # Pixel grid of the (possibly decimated) read
+        read_transform = dataset.window_transform(window) * Affine.scale(window.width / width, window.height / height)
+        zones = [(shapes[i], k + 1) for k, i in enumerate(members)]
+        labels = rasterize(zones, out_shape=(height, width), transform=read_transform,
+                           all_touched=all_touched, dtype="int32")
+        overlapping = len(members) > 1 and rasterize(
+            [(shape, 1) for shape, _ in zones], out_shape=(height, width), transform=read_transform,
+            all_touched=all_touched, merge_alg=MergeAlg.add, dtype="uint16",
+        ).max() > 1
+        if not overlapping:
+            _fill(results, members, _zonal_stats(data, labels, len(members)))
+            continue
+        # Overlapping geometries share pixels, so each is masked on its own slice
+        read_inverse = ~read_transform
+        for i in members:
+            box = _pixel_box(geometry_bounds(shapes[i]), read_inverse, height, width)
+            if box is None:
+                continue
+            r0, c0, r1, c1 = box
+            inside = geometry_mask(
+                [shapes[i]],
+                out_shape=(r1 - r0, c1 - c0),
+                transform=read_transform * Affine.translation(c0, r0),
+                invert=True,
+                all_touched=all_touched,
+            )
+            _fill(results, [i], _zonal_stats(data[:, r0:r1, c0:c1], inside.astype(np.int32), 1))
+    return results
+
+
+def _zonal_stats(data: np.ma.MaskedArray, labels: np.ndarray, zones: int):
+    """
+    Per-zone statistics of every band, where zone k is ``labels == k + 1``.
+
+    Returns (pixels, valid pixels, per band (count, min, max, mean, std, sum)),
+    each an array over zones, computed with grouped reductions instead of a
+    pass per geometry.
+    """
+    bands = data.shape[0]
+    selected = labels.ravel() > 0
+    zone = labels.ravel()[selected] - 1
+    values = data.data.reshape(bands, -1)[:, selected].astype(np.float64)
+    valid = ~np.ma.getmaskarray(data).reshape(bands, -1)[:, selected]
+    pixels = np.bincount(zone, minlength=zones)
+    valid_pixels = np.bincount(zone, weights=valid.any(axis=0), minlength=zones)
+
+    per_band = []
+    for band in range(bands):
+        z, v = zone[valid[band]], values[band, valid[band]]
+        count = np.bincount(z, minlength=zones)
+        total = np.bincount(z, weights=v, minlength=zones)
+        mean = total / np.maximum(count, 1)
+        std = np.sqrt(np.bincount(z, weights=(v - mean[z]) ** 2, minlength=zones) / np.maximum(count, 1))
+        minimum = np.full(zones, np.inf)
+        maximum = np.full(zones, -np.inf)
+        if len(z):
+            # Min/max over each zone's run of the values sorted by zone
+            order = np.argsort(z, kind="stable")
+            z, v = z[order], v[order]
+            starts = np.flatnonzero(np.r_[True, z[1:] != z[:-1]])
+            minimum[z[starts]] = np.minimum.reduceat(v, starts)
+            maximum[z[starts]] = np.maximum.reduceat(v, starts)
+        per_band.append((count, minimum, maximum, mean, std, total))
+    return pixels, valid_pixels, per_band
+
+
+def _fill(results: List[AreaStats], members: Sequence[int], zonal) -> None:
+    pixels, valid_pixels, per_band = zonal
+    for k, i in enumerate(members):
+        result = results[i]
+        result.pixels = int(pixels[k])
+        if not pixels[k]:
+            continue
+        result.valid_percent = round(100.0 * float(valid_pixels[k]) / int(pixels[k]), 4)
+        result.statistics = {
+            str(b + 1): BandStats(
+                count=int(count[k]),
+                min=float(minimum[k]),
+                max=float(maximum[k]),
+                mean=float(mean[k]),
+                std=float(std[k]),
+                sum=float(total[k]),
+            )
+            for b, (count, minimum, maximum, mean, std, total) in enumerate(per_band)
+            if count[k]
+        }
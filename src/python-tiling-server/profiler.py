@@ -0,0 +1,469 @@
+"""
+Statistical stack sampler: on-demand worker profiles and automatic captures of slow tile requests
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+Stack = Tuple[str, ...]
+
+# Leaf frames of threads that are parked rather than working (event loop in
+# select or inside uvloop, idle render threads, locks and queues); their
+# samples are dropped
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("runners.py", "run"),
+    ("threading.py", "wait"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+    ("socketserver.py", "serve_forever"),
+}
+
+# (thread ident, start, end) of render jobs run for the current request
+_spans: contextvars.ContextVar[Optional[List[Tuple[int, float, float]]]] = contextvars.ContextVar(
+    "profile_spans", default=None
+)
+
+
+class CaptureInfo(BaseModel):
+    id: str
+    kind: str  # profile (on demand) or slow (tile request over the threshold)
+    state: str  # running or finished
+    worker: int
+    started_at: float
+    duration_ms: float = 0.0
+    interval_ms: float
+    samples: int = 0
+    request: Optional[Dict[str, Any]] = None  # method, path, query, status of a slow request
+    stages: Dict[str, float] = {}  # Server-Timing stage totals (ms) of a slow request
+
+
+class Capture(CaptureInfo):
+    threads: Dict[str, Dict[str, int]] = {}  # thread name -> collapsed stack -> samples
+
+
+@contextmanager
+def thread_span() -> Iterator[None]:
+    """Mark the current thread as working for the current request (render jobs)"""
+    spans = _spans.get()
+    if spans is None:
+        yield
+        return
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        spans.append((threading.get_ident(), started, time.monotonic()))
+
+
+class _Recording:
+    """Samples of an on-demand profile, aggregated while it runs"""
+
+    def __init__(self, capture: Capture, deadline: float, stop_path: str):
+        self.capture = capture
+        self.started = time.monotonic()
+        self.deadline = deadline
+        self.stop_path = stop_path
+        self.counts: Dict[Tuple[str, Stack], int] = {}
+
+
+class StackSampler:
+    """
+    Sample the Python stack of every busy thread of this worker.
+
+    One daemon thread reads ``sys._current_frames()`` every ``interval``
+    seconds; the cost is a dict of frames and a walk of the busy stacks, so
+    sampling at 100 Hz stays around a percent of one core. Threads whose leaf
+    frame is parked (``IDLE_FRAMES``) are skipped. GDAL reads and encoders
+    release the GIL but keep their calling Python frame on the stack, so time
+    spent in C shows up under the rasterio/Pillow function that called it.
+
+    Busy samples of the last ``window`` seconds are kept for slow-request
+    captures; on-demand profiles aggregate their samples while they run.
+    The thread runs while either is needed.
+    """
+
+    def __init__(self, captures: "CaptureStore", interval: float = 0.01, window: float = 30.0):
+        self.captures = captures
+        self.interval = interval
+        self.window = window
+        self.keep_recent = False
+        self._lock = threading.Lock()
+        self._recent: Deque[Tuple[float, int, Stack]] = deque()
+        self._recordings: List[_Recording] = []
+        self._labels: Dict[Any, str] = {}
+        self._names: Dict[int, str] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+
+    # Thread lifecycle
+
+    def _ensure_running(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._wake.clear()
+            self._thread = threading.Thread(target=self._loop, name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    def start_continuous(self) -> None:
+        """Keep a rolling window of samples for slow-request captures"""
+        self.keep_recent = True
+        self._ensure_running()
+
+    def stop(self) -> None:
+        self.keep_recent = False
+        with self._lock:
+            recordings, self._recordings = self._recordings, []
+        for recording in recordings:
+            self._finish(recording)
+        with self._lock:
+            self._thread = None
+            self._wake.set()
+
+    def _loop(self) -> None:
+        own = threading.get_ident()
+        next_check = 0.0
+        while not self._wake.wait(self.interval):
+            with self._lock:
+                # Decided under the lock so a profile started now restarts the thread
+                if not (self.keep_recent or self._recordings):
+                    self._thread = None
+                    return
+            now = time.monotonic()
+            self._sample(own, now)
+            if now >= next_check:
+                next_check = now + 0.5
+                self._check_recordings(now)
+
+    def _sample(self, own: int, now: float) -> None:
+        busy = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                continue
+            busy.append((ident, self._stack(frame)))
+        if not busy:
+            return
+        with self._lock:
+            if self.keep_recent:
+                for ident, stack in busy:
+                    self._recent.append((now, ident, stack))
+                cutoff = now - self.window
+                while self._recent and self._recent[0][0] < cutoff:
+                    self._recent.popleft()
+            for recording in self._recordings:
+                for ident, stack in busy:
+                    key = (self._thread_name(ident), stack)
+                    recording.counts[key] = recording.counts.get(key, 0) + 1
+
+    def _stack(self, frame) -> Stack:
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+            labels.append(label)
+            frame = frame.f_back
+        labels.reverse()
+        return tuple(labels)
+
+    def _thread_name(self, ident: int) -> str:
+        name = self._names.get(ident)
+        if name is None:
+            self._names = {thread.ident: thread.name for thread in threading.enumerate()}
+            name = self._names.get(ident, f"thread-{ident}")
+        return name
+
+    # On-demand profiles
+
+    def start_profile(self, seconds: float) -> CaptureInfo:
+        capture = Capture(
+            id=f"{time.strftime('%Y%m%dT%H%M%S')}-profile-{uuid.uuid4().hex[:8]}",
+            kind="profile",
+            state="running",
+            worker=os.getpid(),
+            started_at=time.time(),
+            interval_ms=self.interval * 1000,
+        )
+        recording = _Recording(capture, time.monotonic() + seconds, self.captures.stop_path(capture.id))
+        with self._lock:
+            self._recordings.append(recording)
+        self.captures.save(capture)
+        self._ensure_running()
+        return CaptureInfo(**capture.model_dump(exclude={"threads"}))
+
+    def _check_recordings(self, now: float) -> None:
+        with self._lock:
+            done = [
+                recording for recording in self._recordings
+                if now >= recording.deadline or os.path.exists(recording.stop_path)
+            ]
+            self._recordings = [recording for recording in self._recordings if recording not in done]
+        for recording in done:
+            self._finish(recording)
+
+    def _finish(self, recording: _Recording) -> None:
+        capture = recording.capture
+        capture.state = "finished"
+        capture.duration_ms = round((time.monotonic() - recording.started) * 1000, 1)
+        capture.samples = sum(recording.counts.values())
+        capture.threads = _collapse(recording.counts)
+        try:
+            self.captures.save(capture)
+        except OSError as e:
+            logger.error(f"Failed to save profile {capture.id}: {e}")
+        try:
+            os.unlink(recording.stop_path)
+        except FileNotFoundError:
+            pass
+
+    # Slow requests
+
+    def request_samples(self, loop_ident: int, started: float, finished: float,
+                        spans: List[Tuple[int, float, float]]) -> Dict[Tuple[str, Stack], int]:
+        """
+        Samples taken while a request ran: the event loop thread for its whole
+        duration (shared with concurrent requests) and render threads while
+        they ran jobs for it
+        """
+        with self._lock:
+            recent = [sample for sample in self._recent if started <= sample[0] <= finished]
+        counts: Dict[Tuple[str, Stack], int] = {}
+        for at, ident, stack in recent:
+            if ident == loop_ident:
+                name = "event-loop (shared)"
+            elif any(ident == span_ident and start <= at <= end for span_ident, start, end in spans):
+                name = self._thread_name(ident)
+            else:
+                continue
+            counts[(name, stack)] = counts.get((name, stack), 0) + 1
+        return counts
+
+
+class CaptureStore:
+    """
+    Bounded ring buffer of captures in a directory shared by the workers.
+
+    Captures are JSON files (written atomically) so any worker can list and
+    serve them; beyond ``max_captures`` the oldest are deleted. A running
+    profile is stopped early through a ``<id>.stop`` marker that the sampling
+    worker checks twice a second.
+    """
+
+    def __init__(self, directory: str, max_captures: int = 50):
+        self.directory = directory
+        self.max_captures = max_captures
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, capture_id: str) -> str:
+        return os.path.join(self.directory, f"{os.path.basename(capture_id)}.json")
+
+    def stop_path(self, capture_id: str) -> str:
+        return os.path.join(self.directory, f"{os.path.basename(capture_id)}.stop")
+
+    def save(self, capture: Capture) -> None:
+        path = self._path(capture.id)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(capture.model_dump_json())
+        os.replace(tmp, path)
+        self._prune()
+
+    def _prune(self) -> None:
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".json"))
+        for name in names[:max(0, len(names) - self.max_captures)]:
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def get(self, capture_id: str) -> Optional[Capture]:
+        try:
+            with open(self._path(capture_id)) as f:
+                return Capture.model_validate_json(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def list(self) -> List[CaptureInfo]:
+        """Captures newest first, without their samples"""
+        infos = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith(".json"):
+                continue
+            capture = self.get(name[:-len(".json")])
+            if capture is not None:
+                infos.append(CaptureInfo(**capture.model_dump(exclude={"threads"})))
+        return infos
+
+    def request_stop(self, capture_id: str) -> Optional[Capture]:
+        capture = self.get(capture_id)
+        if capture is not None and capture.state == "running":
+            with open(self.stop_path(capture_id), "w"):
+                pass
+        return capture
+
+
+class SlowRequestMiddleware:
+    """
+    ASGI middleware capturing the profile and stage breakdown of requests to
+    ``handlers`` that take longer than ``threshold`` seconds.
+
+    It must sit inside ``metrics.MetricsMiddleware`` (added before it) to see
+    the request's stage timings.
+    """
+
+    def __init__(self, app, sampler: StackSampler, handlers: Set[str], threshold: float):
+        self.app = app
+        self.sampler = sampler
+        self.handlers = handlers
+        self.threshold = threshold
+        self._pending: Set[asyncio.Task] = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.threshold <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        spans: List[Tuple[int, float, float]] = []
+        token = _spans.set(spans)
+        started = time.monotonic()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _spans.reset(token)
+            finished = time.monotonic()
+            handler = getattr(scope.get("endpoint"), "__name__", None)
+            if handler in self.handlers and finished - started >= self.threshold:
+                request = {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query": scope.get("query_string", b"").decode("latin-1"),
+                    "status": status,
+                }
+                stages = {
+                    stage: round(seconds * 1000, 3)
+                    for stage, seconds in metrics.stage_totals(metrics.current_timings() or []).items()
+                }
+                task = asyncio.ensure_future(asyncio.to_thread(
+                    self._capture, threading.get_ident(), started, finished, spans, request, stages
+                ))
+                self._pending.add(task)
+                task.add_done_callback(self._pending.discard)
+
+    def _capture(self, loop_ident: int, started: float, finished: float,
+                 spans: List[Tuple[int, float, float]], request: Dict[str, Any], stages: Dict[str, float]) -> None:
+        counts = self.sampler.request_samples(loop_ident, started, finished, spans)
+        capture = Capture(
+            id=f"{time.strftime('%Y%m%dT%H%M%S')}-slow-{uuid.uuid4().hex[:8]}",
+            kind="slow",
+            state="finished",
+            worker=os.getpid(),
+            started_at=time.time() - (time.monotonic() - started),
+            duration_ms=round((finished - started) * 1000, 1),
+            interval_ms=self.sampler.interval * 1000,
+            samples=sum(counts.values()),
+            request=request,
+            stages=stages,
+            threads=_collapse(counts),
+        )
+        try:
+            self.sampler.captures.save(capture)
+            logger.warning(
+                f"Slow request {request['method']} {request['path']} took {capture.duration_ms} ms "
+                f"(capture {capture.id})"
+            )
+        except OSError as e:
+            logger.error(f"Failed to save slow request capture: {e}")
+
+
+def _short_path(filename: str) -> str:
+    """Path inside site-packages for libraries, the file name otherwise"""
+    for marker in ("site-packages/", "dist-packages/"):
+        index = filename.rfind(marker)
+        if index >= 0:
+            return filename[index + len(marker):]
+    return os.path.basename(filename)
+
+
+def _collapse(counts: Dict[Tuple[str, Stack], int]) -> Dict[str, Dict[str, int]]:
+    threads: Dict[str, Dict[str, int]] = {}
+    for (name, stack), count in counts.items():
+        collapsed = ";".join(stack)
+        stacks = threads.setdefault(name, {})
+        stacks[collapsed] = stacks.get(collapsed, 0) + count
+    return threads
+
+
+def to_collapsed(capture: Capture) -> str:
+    """Brendan Gregg's collapsed stacks (flamegraph.pl, speedscope, inferno), thread name as root frame"""
+    lines = [
+        f"{thread};{stack} {count}"
+        for thread, stacks in sorted(capture.threads.items())
+        for stack, count in sorted(stacks.items())
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def to_speedscope(capture: Capture) -> Dict[str, Any]:
+    """speedscope's sampled-profile JSON, one profile per thread, weights in milliseconds"""
+    frames: List[Dict[str, Any]] = []
+    frame_index: Dict[str, int] = {}
+    profiles = []
+    for thread, stacks in sorted(capture.threads.items()):
+        samples, weights = [], []
+        for stack, count in stacks.items():
+            indexes = []
+            for label in stack.split(";"):
+                index = frame_index.get(label)
+                if index is None:
+                    index = frame_index[label] = len(frames)
+                    name, _, location = label.rpartition(" (")
+                    file, _, line = location.rstrip(")").rpartition(":")
+                    frames.append({"name": name or label, "file": file, "line": int(line) if line.isdigit() else None})
+                indexes.append(index)
+            samples.append(indexes)
+            weights.append(count * capture.interval_ms)
+        profiles.append({
+            "type": "sampled",
+            "name": thread,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights,
+        })
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": f"{capture.kind} {capture.id}",
+        "exporter": "tiling-server",
+        "activeProfileIndex": 0,
+        "shared": {"frames": frames},
+        "profiles": profiles,
+    }
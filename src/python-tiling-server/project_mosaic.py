@@ -0,0 +1,219 @@
+"""
+Project mosaics: an R-tree of each project's task footprints and first-valid compositing of their tiles
+"""
+
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from rio_tiler.models import ImageData
+from rio_tiler.mosaic.methods.defaults import FirstMethod
+
+from tile_render import TileParams, encode_tile
+
+logger = logging.getLogger(__name__)
+
+# (west, south, east, north)
+Bounds = Tuple[float, float, float, float]
+
+
+def _intersects(a: Bounds, b: Bounds) -> bool:
+    # Boxes that only share an edge do not intersect (as for XYZ tiles)
+    return a[0] < b[2] and a[2] > b[0] and a[1] < b[3] and a[3] > b[1]
+
+
+def _extent(boxes: Sequence[Bounds]) -> Bounds:
+    return (
+        min(b[0] for b in boxes),
+        min(b[1] for b in boxes),
+        max(b[2] for b in boxes),
+        max(b[3] for b in boxes),
+    )
+
+
+class _Node:
+    __slots__ = ("bounds", "children", "index")
+
+    def __init__(self, bounds: Bounds, children: Optional[List["_Node"]] = None, index: int = -1):
+        self.bounds = bounds
+        self.children = children
+        self.index = index
+
+
+class RTree:
+    """
+    Static R-tree over bounding boxes, bulk-loaded with Sort-Tile-Recursive packing.
+
+    Projects change rarely and are rebuilt as a whole, so there is no
+    insertion; ``search`` returns the items whose boxes intersect the query
+    in the order they were given.
+    """
+
+    def __init__(self, entries: Sequence[Tuple[Bounds, Any]], node_size: int = 16):
+        self.items = [item for _, item in entries]
+        self.node_size = max(2, node_size)
+        level = [_Node(tuple(bounds), index=i) for i, (bounds, _) in enumerate(entries)]
+        while len(level) > self.node_size:
+            level = self._pack(level)
+        self._root = _Node(_extent([node.bounds for node in level]), level) if level else None
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @property
+    def bounds(self) -> Optional[Bounds]:
+        return self._root.bounds if self._root is not None else None
+
+    def _pack(self, nodes: List[_Node]) -> List[_Node]:
+        """One STR level: vertical slices by x center, then runs of ``node_size`` by y center"""
+        size = self.node_size
+        slices = math.ceil(math.sqrt(math.ceil(len(nodes) / size)))
+        per_slice = size * math.ceil(len(nodes) / (size * slices))
+        nodes = sorted(nodes, key=lambda n: n.bounds[0] + n.bounds[2])
+        parents = []
+        for start in range(0, len(nodes), per_slice):
+            column = sorted(nodes[start:start + per_slice], key=lambda n: n.bounds[1] + n.bounds[3])
+            for run in range(0, len(column), size):
+                children = column[run:run + size]
+                parents.append(_Node(_extent([child.bounds for child in children]), children))
+        return parents
+
+    def search(self, bounds: Bounds) -> List[Any]:
+        if self._root is None or not _intersects(self._root.bounds, bounds):
+            return []
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            for child in node.children:
+                if not _intersects(child.bounds, bounds):
+                    continue
+                if child.children is None:
+                    found.append(child.index)
+                else:
+                    stack.append(child)
+        return [self.items[i] for i in sorted(found)]
+
+
+@dataclass(frozen=True)
+class MosaicLayer:
+    task_id: str
+    cog_url: str
+    bounds: Bounds  # WGS84
+    minzoom: Optional[int] = None
+    maxzoom: Optional[int] = None
+
+
+class ProjectIndex:
+    """Footprints of a project's tasks, newest first"""
+
+    def __init__(self, project_id: int, layers: List[MosaicLayer]):
+        self.project_id = project_id
+        self.layers = layers
+        self.tree = RTree([(layer.bounds, layer) for layer in layers])
+        self.built_at = time.monotonic()
+
+    @property
+    def bounds(self) -> Optional[Bounds]:
+        return self.tree.bounds
+
+    def search(self, bounds: Bounds) -> List[MosaicLayer]:
+        """Layers whose footprint intersects ``bounds``, in compositing order"""
+        return self.tree.search(bounds)
+
+
+class ProjectIndexStore:
+    """
+    Per-worker cache of project indexes.
+
+    ``load`` returns a project's layers (newest first); an index is rebuilt
+    once older than ``ttl``, with concurrent callers sharing one build, and
+    the previous index keeps being served if a rebuild fails.
+    """
+
+    def __init__(self, load: Callable[[int, Optional[str]], Awaitable[List[MosaicLayer]]],
+                 ttl: float = 300.0, maxsize: int = 256):
+        self.load = load
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._indexes: Dict[int, ProjectIndex] = {}
+        self._building: Dict[int, asyncio.Task] = {}
+        self.builds = 0
+        self.layers_read = 0
+        self.layers_skipped = 0
+
+    async def get(self, project_id: int, backend_base_url: Optional[str] = None) -> ProjectIndex:
+        index = self._indexes.get(project_id)
+        if index is not None and time.monotonic() - index.built_at < self.ttl:
+            return index
+        task = self._building.get(project_id)
+        if task is None:
+            task = asyncio.ensure_future(self._build(project_id, backend_base_url))
+            self._building[project_id] = task
+            task.add_done_callback(lambda _t: self._building.pop(project_id, None))
+        try:
+            return await asyncio.shield(task)
+        except Exception as e:
+            if index is None:
+                raise
+            logger.warning(f"Rebuilding index of project {project_id} failed, serving the previous one: {e}")
+            return index
+
+    async def _build(self, project_id: int, backend_base_url: Optional[str]) -> ProjectIndex:
+        index = ProjectIndex(project_id, await self.load(project_id, backend_base_url))
+        self.builds += 1
+        self._indexes.pop(project_id, None)
+        self._indexes[project_id] = index
+        while len(self._indexes) > self.maxsize:
+            self._indexes.pop(next(iter(self._indexes)))
+        return index
+
+    def invalidate(self, project_id: int) -> None:
+        self._indexes.pop(project_id, None)
+
+    def invalidate_task(self, task_id: str) -> List[int]:
+        """Drop the indexes of projects with a layer of ``task_id``; returns their IDs"""
+        project_ids = [
+            project_id for project_id, index in self._indexes.items()
+            if any(layer.task_id == task_id for layer in index.layers)
+        ]
+        for project_id in project_ids:
+            self._indexes.pop(project_id, None)
+        return project_ids
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "projects": len(self._indexes),
+            "layers": sum(len(index.layers) for index in self._indexes.values()),
+            "builds": self.builds,
+            "layers_read": self.layers_read,
+            "layers_skipped": self.layers_skipped,
+        }
+
+
+def composite(images: Sequence[ImageData]) -> ImageData:
+    """First valid pixel of ``images`` (given newest first) wins"""
+    first = images[0]
+    method = FirstMethod()
+    for image in images:
+        if image.count != first.count:
+            logger.warning(f"Skipping mosaic layer with {image.count} bands (expected {first.count})")
+            continue
+        method.feed(image.array)
+        if method.is_done:
+            break
+    return ImageData(
+        method.data,
+        assets=[asset for image in images for asset in (image.assets or [])],
+        bounds=first.bounds,
+        crs=first.crs,
+        band_names=first.band_names,
+    )
+
+
+def render_mosaic(images: Sequence[ImageData], params: TileParams) -> Tuple[bytes, str]:
+    """Composite and encode one mosaic tile (blocking; runs on the render executor)"""
+    return encode_tile(composite(images), params)
@@ -0,0 +1,174 @@
+"""
+Per-worker pool of open COGReader handles keyed by task id and file version
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+
+from rio_tiler.io import COGReader
+
+from cog_cache import CogDiskCache
+from cog_stream import CogStreamSource
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# (st_ino, st_size, st_mtime_ns) of the cached file a handle was opened on
+FileVersion = Tuple[int, int, int]
+PoolKey = Tuple[str, FileVersion]
+
+
+def file_version(path: str) -> FileVersion:
+    st = os.stat(path)
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def format_version(version: FileVersion) -> str:
+    return "-".join(str(part) for part in version)
+
+
+class ReaderPool:
+    """
+    Reuse open dataset handles across requests.
+
+    GDAL dataset handles are not safe to share between threads, so a handle
+    is borrowed exclusively and returned afterwards; concurrent renders of
+    the same task simply open additional handles. Idle handles beyond
+    ``max_open`` are closed least recently used first. Each open handle
+    holds a pin on its cached COG so the disk cache never evicts it, and
+    handles opened on a file that has since been replaced are closed when
+    they are returned instead of going back to the pool.
+    """
+
+    def __init__(self, cache: Union[CogDiskCache, CogStreamSource], max_open: int = 32):
+        self.cache = cache
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._idle: Dict[PoolKey, List[COGReader]] = {}
+        self._lru: "OrderedDict[int, Tuple[PoolKey, COGReader]]" = OrderedDict()
+        self._keys: Dict[int, PoolKey] = {}
+        self._current: Dict[str, FileVersion] = {}
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+
+    @property
+    def open_count(self) -> int:
+        return len(self._keys)
+
+    async def borrow(self, task_id: str, cog_url: str) -> COGReader:
+        """Take an open reader for the task's current COG, opening one if none is idle"""
+        path = await self.cache.acquire(task_id, cog_url)
+        try:
+            version = file_version(path)
+        except OSError:
+            self.cache.release(task_id)
+            raise
+        key = (task_id, version)
+
+        stale = []
+        with self._lock:
+            if self._current.get(task_id) != version:
+                self._current[task_id] = version
+                stale = self._drop_idle_locked(task_id, keep=version)
+            idle = self._idle.get(key)
+            reader = idle.pop() if idle else None
+            if reader is not None:
+                self._lru.pop(id(reader), None)
+                self.reused += 1
+        self._close_all(stale)
+
+        if reader is not None:
+            # The pooled handle already holds a pin on this file
+            self.cache.release(task_id)
+            return reader
+
+        try:
+            with timed("open"):
+                reader = COGReader(self.cache.dataset_path(task_id, path))
+        except Exception:
+            self.cache.release(task_id)
+            raise
+        with self._lock:
+            self._keys[id(reader)] = key
+            self.opened += 1
+        return reader
+
+    def version_of(self, reader: COGReader) -> Optional[FileVersion]:
+        """File version a borrowed reader was opened on"""
+        key = self._keys.get(id(reader))
+        return key[1] if key is not None else None
+
+    def give_back(self, reader: COGReader) -> None:
+        """Return a borrowed reader to the pool (or close it if it is stale)"""
+        with self._lock:
+            key = self._keys.get(id(reader))
+            if key is None:
+                return
+            task_id, version = key
+            if self._current.get(task_id) != version:
+                to_close = [reader]
+            else:
+                self._idle.setdefault(key, []).append(reader)
+                self._lru[id(reader)] = (key, reader)
+                to_close = self._evict_locked()
+        self._close_all(to_close)
+
+    def invalidate(self, task_id: str) -> None:
+        """Close idle handles for a task and retire busy ones when they are returned"""
+        with self._lock:
+            self._current.pop(task_id, None)
+            stale = self._drop_idle_locked(task_id)
+        self._close_all(stale)
+
+    def close(self) -> None:
+        """Close every idle handle (used on shutdown)"""
+        with self._lock:
+            readers = [reader for _, reader in self._lru.values()]
+            self._lru.clear()
+            self._idle.clear()
+            self._current.clear()
+        self._close_all(readers)
+
+    def _drop_idle_locked(self, task_id: str, keep: FileVersion = None) -> List[COGReader]:
+        dropped = []
+        for key in [k for k in self._idle if k[0] == task_id and k[1] != keep]:
+            for reader in self._idle.pop(key):
+                self._lru.pop(id(reader), None)
+                dropped.append(reader)
+        return dropped
+
+    def _evict_locked(self) -> List[COGReader]:
+        evicted = []
+        while len(self._keys) - len(evicted) > self.max_open and self._lru:
+            _, (key, reader) = self._lru.popitem(last=False)
+            self._idle[key].remove(reader)
+            if not self._idle[key]:
+                del self._idle[key]
+            evicted.append(reader)
+        return evicted
+
+    def _close_all(self, readers: List[COGReader]) -> None:
+        for reader in readers:
+            with self._lock:
+                key = self._keys.pop(id(reader), None)
+                self.closed += 1
+            try:
+                reader.close()
+            except Exception as e:
+                logger.warning(f"Failed to close COG reader: {e}")
+            if key is not None:
+                self.cache.release(key[0])
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "open": self.open_count,
+            "idle": len(self._lru),
+            "max_open": self.max_open,
+            "opened": self.opened,
+            "reused": self.reused,
+            "closed": self.closed,
+        }
@@ -0,0 +1,400 @@
+"""
+Bounded thread pool for CPU-bound tile reads, post-processing and encoding
+"""
+
+import asyncio
+import contextvars
+import dataclasses
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Optional
+
+from metrics import record_stage
+from profiler import thread_span
+
+logger = logging.getLogger(__name__)
+
+# Job priorities, most urgent first
+PRIORITY_INTERACTIVE = 0  # TileJSON, bounds, metadata and value queries
+PRIORITY_OVERVIEW = 1  # low-zoom tiles
+PRIORITY_DETAIL = 2  # deep-zoom tiles
+PRIORITY_BACKGROUND = 3  # seeding and archive exports
+PRIORITY_NAMES = ("interactive", "overview", "detail", "background")
+
+
+class RenderQueueFull(Exception):
+    """Raised when the render queue is at capacity and the job is rejected"""
+
+
+class RenderDeadlineExceeded(RenderQueueFull):
+    """Raised when a job cannot start before its request's deadline"""
+
+
+@dataclasses.dataclass(frozen=True)
+class JobContext:
+    """Who a render job is for: its priority, fairness flows and deadline (``time.monotonic``)"""
+    priority: int = PRIORITY_INTERACTIVE
+    task: str = ""
+    client: str = ""
+    deadline: Optional[float] = None
+
+
+_job_context: contextvars.ContextVar[JobContext] = contextvars.ContextVar("render_job", default=JobContext())
+
+
+@contextmanager
+def job_context(**changes: Any) -> Iterator[JobContext]:
+    """Override fields of the job context for render jobs submitted inside the block"""
+    token = _job_context.set(dataclasses.replace(_job_context.get(), **changes))
+    try:
+        yield _job_context.get()
+    finally:
+        _job_context.reset(token)
+
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "context", "job", "future", "enqueued")
+
+    def __init__(self, fn: Callable[..., Any], args: tuple, kwargs: dict, job: JobContext):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        # The job runs in the caller's context so stage timings reach its request
+        self.context = contextvars.copy_context()
+        self.job = job
+        self.future: Future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class _FairQueue:
+    """Round robin over tasks, then over clients within a task, FIFO per client"""
+
+    def __init__(self):
+        self._tasks: "OrderedDict[str, OrderedDict[str, Deque[_Job]]]" = OrderedDict()
+        self.size = 0
+
+    def push(self, job: _Job) -> None:
+        clients = self._tasks.setdefault(job.job.task, OrderedDict())
+        clients.setdefault(job.job.client, deque()).append(job)
+        self.size += 1
+
+    def pop(self) -> _Job:
+        task, clients = next(iter(self._tasks.items()))
+        client, jobs = next(iter(clients.items()))
+        job = jobs.popleft()
+        self._rotate(task, clients, client, jobs)
+        self.size -= 1
+        return job
+
+    def remove(self, job: _Job) -> bool:
+        clients = self._tasks.get(job.job.task)
+        jobs = clients.get(job.job.client) if clients is not None else None
+        if jobs is None:
+            return False
+        try:
+            jobs.remove(job)
+        except ValueError:
+            return False
+        if not jobs:
+            del clients[job.job.client]
+            if not clients:
+                del self._tasks[job.job.task]
+        self.size -= 1
+        return True
+
+    def pop_hog(self) -> _Job:
+        """Newest job of the client with the most queued jobs"""
+        _, _, jobs = max(
+            ((task, client, jobs) for task, clients in self._tasks.items() for client, jobs in clients.items()),
+            key=lambda entry: len(entry[2]),
+        )
+        job = jobs[-1]
+        self.remove(job)
+        return job
+
+    def _rotate(self, task: str, clients: OrderedDict, client: str, jobs: Deque[_Job]) -> None:
+        if jobs:
+            clients.move_to_end(client)
+        else:
+            del clients[client]
+        if clients:
+            self._tasks.move_to_end(task)
+        else:
+            del self._tasks[task]
+
+
+class RenderExecutor:
+    """
+    Run blocking GDAL/numpy/Pillow work off the event loop.
+
+    Threads are used rather than processes because the jobs operate on pooled
+    dataset handles that cannot be pickled, and GDAL reads, numpy and Pillow
+    encoders release the GIL for the heavy parts. ``max_pending`` bounds the
+    number of jobs queued plus running; beyond it ``run`` fails fast with
+    ``RenderQueueFull`` so the endpoint can shed load instead of letting
+    latency grow without bound.
+
+    Jobs wait in one queue per priority (see ``JobContext``) and a free
+    thread takes the most urgent one; within a priority, tasks and then
+    clients take turns, so one client queueing hundreds of tiles delays
+    everyone else by at most one job per turn. A full queue makes room for
+    a more urgent job by shedding the newest lower-priority job of the
+    client with the most queued. Jobs that cannot start before their
+    request's deadline (by the running average job time, or because it
+    passed while queued) fail with ``RenderDeadlineExceeded``, and queued
+    jobs of a cancelled request are dropped without running.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render")
+        self._lock = threading.Lock()
+        self._queues = [_FairQueue() for _ in PRIORITY_NAMES]
+        self._pending = 0
+        self._running = 0
+        self._dispatched = 0
+        self._job_seconds = 0.0  # moving average of job run time
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.shed = 0
+        self.cancelled = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.run_seconds_total = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._pending - self._running
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run ``fn`` on the pool, rejecting immediately if the queue is full or too slow"""
+        context = _job_context.get()
+        job = _Job(fn, args, kwargs, dataclasses.replace(
+            context, priority=min(max(context.priority, 0), len(self._queues) - 1)
+        ))
+        with self._lock:
+            if job.job.deadline is not None and time.monotonic() + self._expected_wait_locked(job) > job.job.deadline:
+                self.shed += 1
+                raise RenderDeadlineExceeded()
+            if self._pending >= self.max_pending and not self._make_room_locked(job.job.priority):
+                self.rejected += 1
+                raise RenderQueueFull()
+            self._pending += 1
+            self.submitted += 1
+            self._queues[job.job.priority].push(job)
+            self._dispatch_locked()
+
+        wrapped = asyncio.wrap_future(job.future)
+        try:
+            return await asyncio.shield(wrapped)
+        except asyncio.CancelledError:
+            if job.future.cancel():
+                # Still queued: drop it (a job already handed to a thread
+                # sees the cancellation there and frees its slot)
+                with self._lock:
+                    if self._queues[job.job.priority].remove(job):
+                        self._pending -= 1
+                        self.cancelled += 1
+            else:
+                # A job that already started keeps using its arguments (e.g. a
+                # pooled reader); wait for it so the caller cannot release them
+                # while the thread is still reading
+                await asyncio.wait({wrapped})
+            raise
+
+    def _expected_wait_locked(self, job: _Job) -> float:
+        """Queued jobs of the same or higher priority times the average job time per thread"""
+        ahead = sum(queue.size for queue in self._queues[:job.job.priority + 1])
+        if self._dispatched < self.max_workers:
+            ahead = max(0, ahead - (self.max_workers - self._dispatched))
+        return ahead * self._job_seconds / self.max_workers
+
+    def _make_room_locked(self, priority: int) -> bool:
+        for level in range(len(self._queues) - 1, priority, -1):
+            if self._queues[level].size:
+                self._fail(self._queues[level].pop_hog(), RenderQueueFull())
+                self._pending -= 1
+                self.shed += 1
+                return True
+        return False
+
+    def _dispatch_locked(self) -> None:
+        now = time.monotonic()
+        while self._dispatched < self.max_workers:
+            queue = next((queue for queue in self._queues if queue.size), None)
+            if queue is None:
+                return
+            job = queue.pop()
+            if job.job.deadline is not None and now > job.job.deadline:
+                self._fail(job, RenderDeadlineExceeded())
+                self._pending -= 1
+                self.shed += 1
+                continue
+            self._dispatched += 1
+            self._pool.submit(self._execute, job)
+
+    @staticmethod
+    def _fail(job: _Job, error: Exception) -> None:
+        try:
+            job.future.set_exception(error)
+        except InvalidStateError:
+            pass  # cancelled by its request meanwhile
+
+    def _execute(self, job: _Job) -> None:
+        started = time.perf_counter()
+        try:
+            if not job.future.set_running_or_notify_cancel():
+                with self._lock:
+                    self.cancelled += 1
+                return
+            with self._lock:
+                self._running += 1
+                wait = started - job.enqueued
+                self.wait_seconds_total += wait
+                self.wait_seconds_max = max(self.wait_seconds_max, wait)
+            try:
+                result = job.context.run(self._call, job, wait)
+            except BaseException as e:
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(result)
+            with self._lock:
+                self._running -= 1
+                elapsed = time.perf_counter() - started
+                self.run_seconds_total += elapsed
+                self._job_seconds = elapsed if not self._job_seconds else 0.9 * self._job_seconds + 0.1 * elapsed
+                self.completed += 1
+        finally:
+            # Release the slot when the job finishes or was cancelled before
+            # starting, even if the awaiting request has already gone away
+            with self._lock:
+                self._pending -= 1
+                self._dispatched -= 1
+                self._dispatch_locked()
+
+    @staticmethod
+    def _call(job: _Job, wait: float) -> Any:
+        record_stage("queue", wait)
+        with thread_span():
+            return job.fn(*job.args, **job.kwargs)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            for queue in self._queues:
+                while queue.size:
+                    queue.pop().future.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "queue_depth": self._pending - self._running,
+                "queued": {name: queue.size for name, queue in zip(PRIORITY_NAMES, self._queues)},
+                "running": self._running,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "shed": self.shed,
+                "cancelled": self.cancelled,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+                "run_seconds_total": round(self.run_seconds_total, 6),
+            }
+
+
+class SchedulingMiddleware:
+    """
+    ASGI middleware giving every request's render jobs its client and a
+    deadline of ``deadline`` seconds, and cancelling GET requests whose
+    client disconnects before the response is sent, so their queued renders
+    are dropped. Cancelled requests are recorded with status 499.
+
+    The client is the ``X-Forwarded-For`` hop appended by the outermost of
+    ``trusted_proxies`` proxies, else the peer address. Earlier hops are
+    whatever the client sent, so trusting them would let a client claim a
+    fresh fair share with every request.
+    """
+
+    def __init__(self, app, deadline: float = 0.0, cancel_on_disconnect: bool = True, trusted_proxies: int = 1):
+        self.app = app
+        self.deadline = deadline
+        self.cancel_on_disconnect = cancel_on_disconnect
+        self.trusted_proxies = trusted_proxies
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = _job_context.set(JobContext(
+            client=_client_of(scope, self.trusted_proxies),
+            deadline=time.monotonic() + self.deadline if self.deadline > 0 else None,
+        ))
+        try:
+            if not self.cancel_on_disconnect or scope["method"] not in ("GET", "HEAD"):
+                await self.app(scope, receive, send)
+                return
+            await self._call_watched(scope, receive, send)
+        finally:
+            _job_context.reset(token)
+
+    async def _call_watched(self, scope, receive, send):
+        inbox: asyncio.Queue = asyncio.Queue()
+        started = complete = disconnected = False
+
+        async def send_tracked(message):
+            nonlocal started, complete
+            if message["type"] == "http.response.start":
+                started = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                complete = True
+            await send(message)
+
+        handler = asyncio.ensure_future(self.app(scope, inbox.get, send_tracked))
+
+        async def watch():
+            nonlocal disconnected
+            while True:
+                message = await receive()
+                await inbox.put(message)
+                if message["type"] == "http.disconnect":
+                    if not complete:
+                        disconnected = True
+                        handler.cancel()
+                    return
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not disconnected:
+                raise
+            logger.debug(f"Client disconnected, cancelled {scope['method']} {scope['path']}")
+            if not started:
+                # Never reaches the client; lets the outer middlewares record it
+                await send({"type": "http.response.start", "status": 499, "headers": []})
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            watcher.cancel()
+
+
+def _client_of(scope, trusted_proxies: int) -> str:
+    if trusted_proxies > 0:
+        hops = [
+            hop.strip()
+            for name, value in scope.get("headers", [])
+            if name == b"x-forwarded-for"
+            for hop in value.decode("latin-1").split(",")
+        ]
+        if len(hops) >= trusted_proxies:
+            return hops[-trusted_proxies]
+    client = scope.get("client")
+    return client[0] if client else ""
@@ -0,0 +1,205 @@
+"""
+Fused rescale + colormap post-processing through cached lookup tables
+"""
+
+import logging
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+from cachetools import LRUCache
+from rio_tiler.colormap import cmap as colormap
+from rio_tiler.colormap import make_lut
+from rio_tiler.models import ImageData
+
+logger = logging.getLogger(__name__)
+
+# Integer dtypes up to this many bytes are mapped with a table over every value
+LUT_MAX_ITEMSIZE = 2
+
+_luts: LRUCache = LRUCache(maxsize=64)
+_pipelines: LRUCache = LRUCache(maxsize=256)
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _buffer(name: str, shape: tuple, dtype) -> np.ndarray:
+    """Per-thread scratch array, reused by every tile of the same shape"""
+    buffers = _local.__dict__.setdefault("buffers", {})
+    key = (name, shape, np.dtype(dtype).str)
+    buf = buffers.get(key)
+    if buf is None:
+        buf = buffers[key] = np.empty(shape, dtype=dtype)
+    return buf
+
+
+def _rescale_values(values: np.ndarray, rescale: Tuple[float, float]) -> np.ndarray:
+    """rio-tiler's linear rescale to 0-255, truncated to uint8"""
+    lo, hi = rescale
+    span = np.float64(hi - lo) or np.float64(1)
+    return ((np.clip(values, lo, hi) - lo) / span * 255).astype(np.uint8)
+
+
+class RenderPipeline:
+    """
+    Normalized ``rescale``/``color_map`` parameters compiled into lookup tables.
+
+    For 8/16-bit integer tiles the rescale and the colormap collapse into one
+    table indexed by the raw pixel value (viewed as unsigned), so the whole
+    post-process is a single ``take`` into a preallocated output. Float and
+    32-bit tiles are quantized to 0-255 with in-place arithmetic first and then
+    go through the 256-entry colormap table. The colormap reads the first band;
+    its entries are packed RGBA words, so one pixel is one 4-byte gather, and
+    its alpha is combined with the dataset mask in place.
+
+    Output arrays are per-thread scratch buffers: they are valid until the next
+    ``apply`` on the same thread, which is enough to encode the tile.
+    """
+
+    def __init__(self, rescale: Optional[Tuple[float, float]], color_map: Optional[str]):
+        self.rescale = rescale
+        self.color_map = color_map
+        # (256, 4) RGBA rows, and the same entries packed into one uint32 each
+        self.palette = np.ascontiguousarray(make_lut(colormap.get(color_map)), dtype=np.uint8) if color_map else None
+        self._cmap = self.palette.view(np.uint32).ravel() if color_map else None
+
+    def lut(self, dtype: np.dtype) -> Optional[np.ndarray]:
+        """Table over every value of an 8/16-bit integer dtype, or None for arithmetic quantization"""
+        dtype = np.dtype(dtype)
+        if dtype.kind not in "ui" or dtype.itemsize > LUT_MAX_ITEMSIZE:
+            return None
+        key = (dtype.str, self.rescale, self.color_map)
+        with _lock:
+            table = _luts.get(key)
+        if table is not None:
+            return table
+
+        index_dtype = np.dtype(f"u{dtype.itemsize}")
+        values = np.arange(2 ** (8 * dtype.itemsize), dtype=index_dtype).view(dtype)
+        if self.rescale:
+            table = _rescale_values(values, self.rescale)
+        else:
+            table = values
+        if self._cmap is not None:
+            if self.rescale:
+                table = self._cmap[table]
+            else:
+                # Colormaps cover 0-255; other values are transparent
+                in_range = (values >= 0) & (values <= 255)
+                table = np.where(in_range, self._cmap[np.clip(values, 0, 255).astype(np.intp)], 0).astype(np.uint32)
+        table = np.ascontiguousarray(table)
+        with _lock:
+            _luts[key] = table
+        return table
+
+    def pair_lut(self) -> np.ndarray:
+        """uint8 -> uint8 rescale table applied to two pixels at once (indexed by their uint16 view)"""
+        key = ("pairs", self.rescale)
+        with _lock:
+            table = _luts.get(key)
+        if table is None:
+            pairs = np.arange(1 << 16, dtype=np.uint16).view(np.uint8)
+            table = self.lut(np.dtype(np.uint8))[pairs].view(np.uint16)
+            with _lock:
+                _luts[key] = table
+        return table
+
+    def _quantize(self, data: np.ndarray) -> np.ndarray:
+        """Rescale float/32-bit data to uint8 indices in scratch buffers"""
+        lo, hi = self.rescale or (0.0, 255.0)
+        span = (hi - lo) or 1.0
+        scaled = _buffer("scaled", data.shape, np.float32)
+        np.subtract(data, lo, out=scaled, casting="unsafe")
+        np.multiply(scaled, 255.0 / span, out=scaled)
+        # fmax/fmin also turn NaN into 0
+        np.fmax(scaled, 0, out=scaled)
+        np.fmin(scaled, 255, out=scaled)
+        index = _buffer("index", data.shape, np.uint8)
+        np.copyto(index, scaled, casting="unsafe")
+        return index
+
+    def apply(self, tile: ImageData) -> Tuple[np.ndarray, np.ndarray]:
+        """Post-process a tile; returns (uint8 bands, uint8 alpha)"""
+        array = tile.array
+        data = array.data
+        height, width = data.shape[-2:]
+        if self._cmap is not None:
+            data = data[:1]
+        table = self.lut(data.dtype)
+        if table is not None:
+            index = data.view(f"u{data.dtype.itemsize}")
+        else:
+            index = self._quantize(data)
+            table = self._cmap
+
+        if self._cmap is not None:
+            out = _buffer("rgba", (height, width), np.uint32)
+            np.take(table, index[0], out=out, mode="clip")
+            # Band-first views of the pixel-interleaved output
+            rgba = out.view(np.uint8).reshape(height, width, 4).transpose(2, 0, 1)
+            bands, alpha = rgba[:3], rgba[3]
+        else:
+            if table is None:
+                bands = index  # already rescaled
+            else:
+                bands = _buffer("bands", data.shape, np.uint8)
+                if data.dtype == np.uint8 and width % 2 == 0 and data.flags.c_contiguous:
+                    # Byte rasters (RGB orthos): half as many gathers
+                    np.take(self.pair_lut(), data.view(np.uint16), out=bands.view(np.uint16), mode="clip")
+                else:
+                    np.take(table, index, out=bands, mode="clip")
+            alpha = _buffer("alpha", (height, width), np.uint8)
+            alpha.fill(255)
+
+        # Pixels masked in every band are transparent (ImageData.mask semantics)
+        mask = np.ma.getmask(array)
+        if mask is not np.ma.nomask:
+            hidden = _buffer("hidden", (height, width), np.bool_)
+            np.logical_and.reduce(mask, axis=0, out=hidden)
+            np.copyto(alpha, 0, where=hidden)
+        return bands, alpha
+
+
+    def palette_indices(self, tile: ImageData) -> Optional[Tuple[np.ndarray, Optional[np.ndarray]]]:
+        """
+        Colormap indices of the first band and the all-bands-masked pixels, for
+        palette encoding; None if the pipeline has no colormap or the tile is
+        integer data outside 0-255 without a rescale
+        """
+        if self._cmap is None:
+            return None
+        array = tile.array
+        data = array.data[:1]
+        height, width = data.shape[-2:]
+        index = _buffer("palette", (height, width), np.uint8)
+        if data.dtype.kind in "ui" and data.dtype.itemsize <= LUT_MAX_ITEMSIZE:
+            if self.rescale:
+                table = compile_pipeline(self.rescale, None).lut(data.dtype)
+                np.take(table, data[0].view(f"u{data.dtype.itemsize}"), out=index, mode="clip")
+            elif data.dtype == np.uint8:
+                np.copyto(index, data[0])
+            else:
+                return None
+        else:
+            np.copyto(index, self._quantize(data)[0])
+
+        mask = np.ma.getmask(array)
+        if mask is np.ma.nomask:
+            return index, None
+        hidden = _buffer("hidden", (height, width), np.bool_)
+        np.logical_and.reduce(mask, axis=0, out=hidden)
+        return index, hidden
+
+
+def compile_pipeline(rescale: Optional[Tuple[float, float]], color_map: Optional[str]) -> Optional[RenderPipeline]:
+    """Shared pipeline for normalized parameters, or None when there is nothing to post-process"""
+    if not rescale and not color_map:
+        return None
+    key = (tuple(rescale) if rescale else None, color_map.lower() if color_map else None)
+    with _lock:
+        pipeline = _pipelines.get(key)
+    if pipeline is None:
+        pipeline = RenderPipeline(*key)
+        with _lock:
+            _pipelines[key] = pipeline
+    return pipeline
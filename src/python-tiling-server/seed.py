@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Pre-seed a task's tile pyramid from the command line
+
+    python -m seed <task_id> [--minzoom 14] [--maxzoom 21] [--format png] ...
+
+Tiles are written to the shared on-disk tile tier (TILE_CACHE_DIR), which the
+running server reads; without it the rendered tiles would only live in this
+process. Interrupting the command (Ctrl-C) checkpoints the job, and running it
+again with the same arguments resumes where it stopped.
+"""
+
+import argparse
+import asyncio
+import sys
+
+from fastapi import HTTPException
+
+from main import (
+    SeedRequest,
+    metadata_resolver,
+    prepare_seed,
+    render_executor,
+    reader_pool,
+    seed_concurrency,
+    settings,
+    tile_seeder,
+)
+from tile_seeder import seed_job_id
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m seed", description="Pre-render a task's tile pyramid")
+    parser.add_argument("task_id")
+    parser.add_argument("--minzoom", type=int, default=None)
+    parser.add_argument("--maxzoom", type=int, default=None)
+    parser.add_argument("--bounds", default=None, help="west,south,east,north (default: the COG's bounds)")
+    parser.add_argument("--format", default="png")
+    parser.add_argument("--size", type=int, default=settings.default_tile_size)
+    parser.add_argument("--rescale", default=None, help="min,max")
+    parser.add_argument("--color-map", default=None)
+    parser.add_argument("--nodata", default=None)
+    parser.add_argument("--no-webp", action="store_true", help="seed the PNG variant for clients without WebP")
+    parser.add_argument("--profile", default=None, help="encoder profile (default: ENCODER_PROFILE)")
+    parser.add_argument("--expression", default=None, help='band math, e.g. "where(b1 > 45, b1, nan)"')
+    parser.add_argument("--concurrency", type=int, default=None)
+    parser.add_argument("--backend-base-url", default=None)
+    parser.add_argument("--cancel", action="store_true", help="cancel the job if it runs in another process")
+    return parser.parse_args(argv)
+
+
+async def seed(args: argparse.Namespace) -> int:
+    body = SeedRequest(
+        minzoom=args.minzoom,
+        maxzoom=args.maxzoom,
+        bounds=[float(v) for v in args.bounds.split(",")] if args.bounds else None,
+        format=args.format,
+        size=args.size,
+        rescale=args.rescale,
+        color_map=args.color_map,
+        nodata=args.nodata,
+        webp=not args.no_webp,
+        profile=args.profile,
+        expression=args.expression,
+    )
+    await metadata_resolver.start()
+    try:
+        try:
+            spec, version, tiles, produce = await prepare_seed(args.task_id, body, args.backend_base_url)
+        except HTTPException as e:
+            print(f"Cannot seed task {args.task_id}: {e.detail}", file=sys.stderr)
+            return 1
+
+        if args.cancel:
+            state = tile_seeder.cancel(seed_job_id(args.task_id, spec))
+            print(f"Cancellation requested: {state.model_dump_json() if state else 'no such job'}")
+            return 0
+
+        if not settings.tile_cache_dir:
+            print("Warning: TILE_CACHE_DIR is not set; seeded tiles will not be visible to the server",
+                  file=sys.stderr)
+        print(f"Seeding {len(tiles)} tiles of task {args.task_id} (z{spec['minzoom']}-{spec['maxzoom']})")
+        try:
+            state = await tile_seeder.run(
+                args.task_id, spec, version, tiles, produce, args.concurrency or seed_concurrency()
+            )
+        except RuntimeError as e:
+            print(str(e), file=sys.stderr)
+            return 1
+        print(state.model_dump_json(indent=2))
+        return 0 if state.state == "completed" else 1
+    finally:
+        await metadata_resolver.close()
+        render_executor.shutdown()
+        reader_pool.close()
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    try:
+        return asyncio.run(seed(args))
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume", file=sys.stderr)
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
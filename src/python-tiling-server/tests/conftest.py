@@ -0,0 +1,110 @@
+"""
+Shared fixtures: the server modules import each other flatly, so put them on the path
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import mercantile
+import numpy as np
+import pytest
+import rasterio
+import rasterio.shutil
+from rasterio.io import MemoryFile
+from rasterio.transform import from_bounds
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main.py creates its caches at import time
+os.environ.setdefault("COG_CACHE_DIR", tempfile.mkdtemp(prefix="tiler-tests-"))
+
+
+def write_cog(path, data, tile=(10, 512, 511), nodata=0, overviews=4):
+    """
+    Write (bands, height, width) ``data`` as a COG in EPSG:3857 covering
+    ``tile`` exactly, with ``overviews`` averaged overview levels
+    """
+    bounds = mercantile.xy_bounds(*_xyz(tile))
+    count, height, width = data.shape
+    with MemoryFile() as memfile:
+        with memfile.open(
+            driver="GTiff", width=width, height=height, count=count, dtype=data.dtype,
+            crs="EPSG:3857", transform=from_bounds(*bounds, width, height), nodata=nodata,
+        ) as dst:
+            dst.write(data)
+        # The COG driver puts every IFD up front, as streamed COGs expect
+        rasterio.shutil.copy(
+            memfile.name, path, driver="COG", BLOCKSIZE=256, OVERVIEW_RESAMPLING="AVERAGE",
+            OVERVIEWS="IGNORE_EXISTING" if overviews else "NONE", OVERVIEW_COUNT=overviews or 1,
+        )
+    return path
+
+
+def _xyz(tile):
+    z, x, y = tile
+    return x, y, z
+
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static files with single byte-range support and an ETag, like a bucket"""
+
+    ranges: list
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        st = os.stat(path)
+        start, end = 0, st.st_size - 1
+        header = self.headers.get("Range")
+        if header:
+            first, last = header.split("=")[1].split("-")
+            start, end = int(first), min(int(last), st.st_size - 1) if last else st.st_size - 1
+        self.ranges.append((self.path, start, end) if header else (self.path, None, None))
+        f = open(path, "rb")
+        f.seek(start)
+        self.send_response(206 if header else 200)
+        if header:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{st.st_size}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", f'"{st.st_mtime_ns:x}-{st.st_size:x}"')
+        self.end_headers()
+        self._remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        outputfile.write(source.read(self._remaining))
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def cog_server(tmp_path):
+    """Serve ``tmp_path / "www"``; yields (base URL, list of (path, start, end) requests)"""
+    root = tmp_path / "www"
+    root.mkdir(exist_ok=True)
+    ranges = []
+    handler = type("Handler", (RangeRequestHandler,), {"ranges": ranges})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(handler, directory=str(root)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", ranges
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def gradient_cog(tmp_path):
+    """Three-band 1024x1024 COG over tile 10/512/511 with a nodata corner, served by ``cog_server``"""
+    rows, cols = np.mgrid[0:1024, 0:1024]
+    data = np.stack([(rows // 4) % 250 + 1, (cols // 4) % 250 + 1, ((rows + cols) // 8) % 250 + 1]).astype(np.uint8)
+    data[:, 768:, 768:] = 0
+    (tmp_path / "www").mkdir(exist_ok=True)
+    return write_cog(str(tmp_path / "www" / "gradient.tif"), data)
@@ -0,0 +1,38 @@
+import pytest
+
+from main import negotiate_format, parse_accept, parse_tile_params
+
+
+def test_parse_accept_keeps_the_best_q_per_range():
+    ranges = parse_accept("image/WebP;q=0.8, image/png , */*;q=0.1, image/webp;q=0.9, image/jpeg;q=bogus,,")
+    assert ranges == {"image/webp": 0.9, "image/png": 1.0, "*/*": 0.1, "image/jpeg": 0.0}
+
+
+@pytest.mark.parametrize("accept, expected", [
+    # Browsers that can decode WebP say so explicitly
+    ("image/avif,image/webp,image/apng,image/*,*/*;q=0.8", "webp"),
+    # Ties go to the server's preference
+    ("image/png,image/webp", "webp"),
+    ("image/jpeg,image/png", "png"),
+    ("image/png;q=0.5,image/jpeg", "jpg"),
+    ("image/webp;q=0.2,image/png;q=0.5", "png"),
+    # WebP and JPEG are never inferred from wildcards
+    ("image/*", "png"),
+    ("*/*", "png"),
+    ("image/webp;q=0, image/jpeg;q=0", "png"),
+    ("", "png"),
+    ("text/html", "png"),
+])
+def test_negotiate_format(accept, expected):
+    assert negotiate_format(parse_accept(accept)) == expected
+
+
+def test_explicit_format_wins_over_accept():
+    params = parse_tile_params(256, "jpg", None, None, None, "image/webp")
+    assert (params.format, params.negotiated, params.varies_on_accept) == ("jpg", False, False)
+
+
+def test_negotiated_format_varies_on_accept():
+    params = parse_tile_params(256, None, None, None, None, "image/webp,*/*")
+    assert (params.format, params.negotiated, params.varies_on_accept) == ("webp", True, True)
+    assert parse_tile_params(256, None, None, None, None, "*/*").format == "png"
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from band_expression import BandExpression, InvalidExpression
+
+
+def bands(*values):
+    return np.array([np.full((2, 2), v, dtype=np.float32) for v in values])
+
+
+@pytest.mark.parametrize("text", [
+    "b1.__class__",
+    "b1.real",
+    "__import__('os').system('true')",
+    "open('/etc/passwd')",
+    "b1[0]",
+    "b1[::2]",
+    "(lambda: b1)()",
+    "b1 if b2 else b3",
+    "[b1, b2]",
+    "abs(b1, key=b2)",
+    "np.sqrt(b1)",
+    "'b1'",
+    "True + b1",
+    "foo",
+    "b0",
+    "1 + 2",
+])
+def test_rejects_anything_outside_the_whitelist(text):
+    with pytest.raises(InvalidExpression):
+        BandExpression(text)
+
+
+def test_arithmetic_comparisons_and_functions():
+    expression = BandExpression("where((b1 > 1) & (b3 < 10), sqrt(b1) + b3 * 2, nan)")
+    assert expression.bands == (1, 3)
+    result = expression.evaluate(bands(4, 5))
+    np.testing.assert_array_equal(result, np.full((2, 2), 2 + 10, dtype=np.float32))
+
+
+def test_clip_propagates_nan():
+    expression = BandExpression("clip(b1, 0, 1)")
+    data = np.array([[[np.nan, -5], [0.5, 5]]], dtype=np.float32)
+    result = expression.evaluate(data)
+    assert np.isnan(result[0, 0])
+    np.testing.assert_array_equal(result.ravel()[1:], [0, 0.5, 1])
+
+
+def test_constant_where_drops_the_unused_branch():
+    expression = BandExpression("where(1 > 2, b4 / b5, b2 + 1)")
+    assert expression.bands == (2,)
+    np.testing.assert_array_equal(expression.evaluate(bands(3)), np.full((2, 2), 4, dtype=np.float32))
+
+
+def test_constant_result_reads_one_band_for_its_shape():
+    expression = BandExpression("where(1, 7, b3)")
+    assert expression.bands == (3,)
+    np.testing.assert_array_equal(expression.evaluate(bands(0)), np.full((2, 2), 7, dtype=np.float32))
+
+
+def test_inputs_are_not_modified():
+    data = bands(2, 3)
+    BandExpression("-(b1 * b2) + abs(b1)").evaluate(data)
+    np.testing.assert_array_equal(data, bands(2, 3))
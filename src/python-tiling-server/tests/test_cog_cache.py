@@ -0,0 +1,106 @@
+import fcntl
+import os
+
+import pytest
+
+from cog_cache import CogDiskCache
+from cog_downloader import CogDownloadManager
+
+
+def write(path, size, atime=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    if atime is not None:
+        os.utime(path, (atime, atime))
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / "cogs")
+
+
+def make_cache(cache_dir, max_bytes, **kwargs):
+    return CogDiskCache(CogDownloadManager(cache_dir), max_bytes=max_bytes, **kwargs)
+
+
+def test_budget_counts_derived_files_and_state_dirs(cache_dir, tmp_path):
+    outside = str(tmp_path / "metrics")
+    cache = make_cache(
+        cache_dir, 10_000,
+        state_dirs=[os.path.join(cache_dir, "seed"), outside],
+    )
+    write(os.path.join(cache_dir, "a.tif"), 1000)
+    write(os.path.join(cache_dir, "a.tif.meta.json"), 100)
+    write(os.path.join(cache_dir, "a.tif.coverage.npz"), 200)
+    write(os.path.join(cache_dir, "a.tif.lock"), 0)
+    write(os.path.join(cache_dir, "seed", "job.json"), 50)
+    # Outside the cache directory, and a subdirectory that is not state
+    write(os.path.join(outside, "worker.json"), 5000)
+    write(os.path.join(cache_dir, "stream", "block"), 5000)
+
+    entries, other = cache._entries()
+    assert [(path, size) for _, path, size in entries] == [(os.path.join(cache_dir, "a.tif"), 1300)]
+    assert other == 50
+    assert cache.usage_bytes() == 1350
+
+
+def test_sweep_evicts_cogs_to_make_room_for_state(cache_dir):
+    cache = make_cache(cache_dir, 3000, state_dirs=[os.path.join(cache_dir, "seed")])
+    for i, name in enumerate(["old", "mid", "new"]):
+        write(os.path.join(cache_dir, f"{name}.tif"), 800, atime=i + 1)
+        write(os.path.join(cache_dir, f"{name}.tif.meta.json"), 100)
+    write(os.path.join(cache_dir, "seed", "job.json"), 600)
+
+    assert cache.sweep() == 900
+    assert sorted(os.listdir(cache_dir)) == [
+        ".sweep.lock", "mid.tif", "mid.tif.meta.json", "new.tif", "new.tif.meta.json", "seed",
+    ]
+    assert cache.usage_bytes() == 2400
+
+
+def test_pinned_cog_survives_sweep_from_another_worker(cache_dir):
+    pinner = make_cache(cache_dir, 1000)
+    sweeper = make_cache(cache_dir, 1000)
+    write(os.path.join(cache_dir, "pinned.tif"), 800, atime=1)
+    write(os.path.join(cache_dir, "free.tif"), 800, atime=2)
+
+    assert pinner._pin("pinned") == os.path.join(cache_dir, "pinned.tif")
+    assert sweeper.sweep() == 800
+    assert sorted(n for n in os.listdir(cache_dir) if n.endswith(".tif")) == ["pinned.tif"]
+
+    pinner.release("pinned")
+    assert not pinner.is_pinned("pinned")
+    write(os.path.join(cache_dir, "free.tif"), 800, atime=3)
+    assert sweeper.sweep() == 800
+    assert sorted(n for n in os.listdir(cache_dir) if n.endswith(".tif")) == ["free.tif"]
+
+
+def test_pin_refuses_file_held_by_evictor(cache_dir):
+    cache = make_cache(cache_dir, 1000)
+    path = os.path.join(cache_dir, "a.tif")
+    write(path, 10)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        assert cache._pin("a") is None
+    finally:
+        os.close(fd)
+    assert cache._pin("a") == path
+    assert cache._pin("a") == path
+    assert cache._pins["a"].refs == 2
+
+
+def test_pin_moves_to_replaced_file(cache_dir):
+    cache = make_cache(cache_dir, 1000)
+    path = os.path.join(cache_dir, "a.tif")
+    write(path, 10)
+    cache._pin("a")
+    write(path + ".new", 20)
+    os.replace(path + ".new", path)
+
+    assert cache._pin("a") == path
+    pin = cache._pins["a"]
+    assert pin.refs == 2
+    assert os.fstat(pin.fd).st_size == 20
+    assert os.fstat(pin.fd).st_nlink == 1
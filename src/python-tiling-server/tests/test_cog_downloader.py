@@ -0,0 +1,67 @@
+import asyncio
+import hashlib
+import json
+import os
+
+import pytest
+
+import cog_downloader
+from cog_downloader import CogDownloadError, CogDownloadManager
+
+
+def leftovers(cache_dir):
+    return [name for name in os.listdir(cache_dir) if name.endswith(".part") or name.endswith(".tmp")]
+
+
+def test_concurrent_callers_share_one_download(tmp_path, cog_server, gradient_cog):
+    url, requests = cog_server
+    manager = CogDownloadManager(str(tmp_path / "cogs"), chunk_size=64 * 1024)
+
+    async def run():
+        return await asyncio.gather(*(manager.ensure("gradient", f"{url}/gradient.tif") for _ in range(8)))
+
+    paths = asyncio.run(run())
+    assert set(paths) == {manager.local_path("gradient")}
+    assert len(requests) == 1
+    assert manager.downloads == 1
+    with open(gradient_cog, "rb") as f:
+        expected = f.read()
+    with open(manager.local_path("gradient"), "rb") as f:
+        assert f.read() == expected
+    with open(manager.source_path("gradient")) as f:
+        assert json.load(f)["md5"] == hashlib.md5(expected).hexdigest()
+    assert manager.content_version("gradient") == hashlib.md5(expected).hexdigest()[:16]
+    assert leftovers(manager.cache_dir) == []
+
+
+def test_workers_download_once_under_the_file_lock(tmp_path, cog_server, gradient_cog):
+    url, requests = cog_server
+    workers = [CogDownloadManager(str(tmp_path / "cogs")) for _ in range(3)]
+
+    async def run():
+        return await asyncio.gather(*(w.ensure("gradient", f"{url}/gradient.tif") for w in workers))
+
+    asyncio.run(run())
+    assert len(requests) == 1
+    assert sum(w.downloads for w in workers) == 1
+
+
+def test_failed_verification_leaves_nothing_in_place(tmp_path, cog_server, gradient_cog, monkeypatch):
+    url, _ = cog_server
+    monkeypatch.setattr(cog_downloader, "_advertised_md5", lambda headers: b"\0" * 16)
+    manager = CogDownloadManager(str(tmp_path / "cogs"))
+
+    with pytest.raises(CogDownloadError, match="MD5 mismatch"):
+        asyncio.run(manager.ensure("gradient", f"{url}/gradient.tif"))
+    assert not os.path.exists(manager.local_path("gradient"))
+    assert leftovers(manager.cache_dir) == []
+    assert not manager.is_downloading("gradient")
+
+
+def test_http_error_is_a_download_error(tmp_path, cog_server):
+    url, _ = cog_server
+    manager = CogDownloadManager(str(tmp_path / "cogs"))
+    with pytest.raises(CogDownloadError):
+        asyncio.run(manager.ensure("missing", f"{url}/missing.tif"))
+    assert not os.path.exists(manager.local_path("missing"))
+    assert leftovers(manager.cache_dir) == []
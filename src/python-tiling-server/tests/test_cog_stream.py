@@ -0,0 +1,151 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+from rio_tiler.io import COGReader
+
+from cog_downloader import CogDownloadManager
+from cog_sidecar import build_sidecar
+from cog_stream import CogStreamSource, _runs
+
+TASK = "gradient"
+BLOCK_SIZE = 16 * 1024
+TILES = [(512, 511, 10), (1024, 1022, 11), (2049, 2045, 12), (2050, 2046, 12), (4101, 4093, 13)]
+
+
+@pytest.fixture
+def stream(tmp_path):
+    source = CogStreamSource(str(tmp_path / "blocks"), block_size=BLOCK_SIZE, readahead=2)
+    yield source
+    source.close()
+
+
+def download(tmp_path, url):
+    return asyncio.run(CogDownloadManager(str(tmp_path / "downloads")).ensure(TASK, url))
+
+
+def acquire(stream, url):
+    path = asyncio.run(stream.acquire(TASK, url))
+    return stream.dataset_path(TASK, path)
+
+
+def test_stream_mode_matches_download_mode(tmp_path, cog_server, gradient_cog, stream):
+    base_url, _ = cog_server
+    url = f"{base_url}/gradient.tif"
+    with COGReader(download(tmp_path, url)) as local, COGReader(acquire(stream, url)) as remote:
+        assert build_sidecar(remote, "v", 256) == build_sidecar(local, "v", 256)
+        for x, y, z in TILES:
+            expected, actual = local.tile(x, y, z), remote.tile(x, y, z)
+            assert actual.data.tobytes() == expected.data.tobytes()
+            assert actual.mask.tobytes() == expected.mask.tobytes()
+            assert actual.render(img_format="PNG") == expected.render(img_format="PNG")
+    assert stream.block_misses > 0
+
+
+def test_read_range_fetches_runs_with_readahead(cog_server, gradient_cog, stream):
+    base_url, requests = cog_server
+    acquire(stream, f"{base_url}/gradient.tif")
+    key = stream.content_version(TASK)
+    with open(gradient_cog, "rb") as f:
+        content = f.read()
+
+    requests.clear()
+    start, end = 3 * BLOCK_SIZE + 100, 5 * BLOCK_SIZE - 1
+    assert b"".join(stream.read_range(TASK, key, start, end)) == content[start:end + 1]
+    # Blocks 3-4 plus two blocks of read-ahead in one request
+    assert requests == [("/gradient.tif", 3 * BLOCK_SIZE, 7 * BLOCK_SIZE - 1)]
+
+    requests.clear()
+    start, end = 5 * BLOCK_SIZE, 7 * BLOCK_SIZE - 1
+    assert b"".join(stream.read_range(TASK, key, start, end)) == content[start:end + 1]
+    assert requests == []
+
+    # The last block is short and read-ahead stops at the end of the file
+    requests.clear()
+    start = len(content) - 10
+    assert b"".join(stream.read_range(TASK, key, start, start + BLOCK_SIZE)) == content[start:]
+    assert [r[2] for r in requests] == [len(content) - 1]
+
+
+def test_runs_group_contiguous_blocks():
+    assert list(_runs([8, 1, 2, 3, 7, 10])) == [(1, 3), (7, 8), (10, 10)]
+    assert list(_runs([])) == []
+
+
+def test_forget_revalidates_and_purge_drops_blocks(tmp_path, cog_server, gradient_cog, stream):
+    base_url, requests = cog_server
+    url = f"{base_url}/gradient.tif"
+    acquire(stream, url)
+    key = stream.content_version(TASK)
+    list(stream.read_range(TASK, key, 0, 4 * BLOCK_SIZE))
+    blocks_dir = tmp_path / "blocks" / f"{TASK}.blocks" / key
+    assert len(os.listdir(blocks_dir)) > 1
+
+    # Within the revalidation interval acquire does not go upstream...
+    requests.clear()
+    acquire(stream, url)
+    assert requests == []
+    # ...unless the task was forgotten; the unchanged object keeps its blocks
+    stream.forget(TASK)
+    acquire(stream, url)
+    assert len(requests) == 1
+    assert stream.content_version(TASK) == key
+    assert len(os.listdir(blocks_dir)) > 1
+
+    assert stream.purge(TASK)
+    assert not os.path.exists(stream.local_path(TASK))
+    assert not (tmp_path / "blocks" / f"{TASK}.blocks").exists()
+    assert stream.content_version(TASK) is None
+    assert not stream.purge(TASK)
+
+    # A replaced object gets a new identity and its old blocks are dropped
+    acquire(stream, url)
+    assert stream.content_version(TASK) == key
+    with open(gradient_cog, "ab") as f:
+        f.write(b"\0" * 10)
+    stream.forget(TASK)
+    acquire(stream, url)
+    assert stream.content_version(TASK) != key
+    assert not blocks_dir.exists()
+
+
+def test_block_server_ranges(cog_server, gradient_cog, stream):
+    base_url, _ = cog_server
+    url = acquire(stream, f"{base_url}/gradient.tif")[len("/vsicurl/"):]
+    with open(gradient_cog, "rb") as f:
+        content = f.read()
+    size = len(content)
+
+    with httpx.Client() as client:
+        head = client.head(url)
+        assert head.status_code == 200
+        assert int(head.headers["content-length"]) == size
+
+        response = client.get(url, headers={"Range": "bytes=100-40000"})
+        assert response.status_code == 206
+        assert response.headers["content-range"] == f"bytes 100-40000/{size}"
+        assert response.content == content[100:40001]
+
+        # Suffix range: the last N bytes
+        response = client.get(url, headers={"Range": "bytes=-500"})
+        assert response.status_code == 206
+        assert response.headers["content-range"] == f"bytes {size - 500}-{size - 1}/{size}"
+        assert response.content == content[-500:]
+
+        # Open-ended and past-the-end ranges are clamped to the file
+        response = client.get(url, headers={"Range": f"bytes={size - 10}-"})
+        assert response.content == content[-10:]
+        response = client.get(url, headers={"Range": f"bytes={size - 10}-{size + 1000}"})
+        assert response.headers["content-range"] == f"bytes {size - 10}-{size - 1}/{size}"
+
+        response = client.get(url, headers={"Range": f"bytes={size}-"})
+        assert response.status_code == 416
+        assert response.headers["content-range"] == f"bytes */{size}"
+
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.content == content
+
+        assert client.get(url.replace(".tif", "0.tif")).status_code == 404
+        assert client.get(url.rsplit("/", 2)[0] + "/other/key.tif").status_code == 404
@@ -0,0 +1,46 @@
+import asyncio
+import json
+
+from cog_downloader import CogDownloadManager
+from cog_transcoder import CogTranscoder
+from reader_pool import file_version, format_version
+
+
+def test_swap_records_a_new_content_version(tmp_path):
+    downloader = CogDownloadManager(str(tmp_path))
+    transcoder = CogTranscoder(downloader)
+    path = downloader.local_path("task")
+    with open(path, "wb") as f:
+        f.write(b"original")
+    before = downloader.record_source("task", "https://example.com/task.tif", '"etag"')
+    part_path = f"{path}.cog.part"
+    with open(part_path, "wb") as f:
+        f.write(b"transcoded")
+
+    version = format_version(file_version(path))
+    new_version = asyncio.run(transcoder._swap("task", path, part_path, version))
+
+    assert new_version == format_version(file_version(path))
+    after = downloader.content_version("task")
+    assert after is not None and after != before
+    with open(downloader.source_path("task")) as f:
+        source = json.load(f)
+    assert source["url"] == "https://example.com/task.tif"
+    assert source["etag"] == '"etag"'
+
+
+def test_swap_discards_result_when_file_changed(tmp_path):
+    downloader = CogDownloadManager(str(tmp_path))
+    transcoder = CogTranscoder(downloader)
+    path = downloader.local_path("task")
+    with open(path, "wb") as f:
+        f.write(b"original")
+    before = downloader.record_source("task")
+    part_path = f"{path}.cog.part"
+    with open(part_path, "wb") as f:
+        f.write(b"transcoded")
+
+    assert asyncio.run(transcoder._swap("task", path, part_path, "stale")) is None
+    assert downloader.content_version("task") == before
+    with open(path, "rb") as f:
+        assert f.read() == b"original"
@@ -0,0 +1,53 @@
+import os
+
+from disk_usage import SharedDiskUsage
+
+
+def listing(directory):
+    def files():
+        for name in os.listdir(directory):
+            if name.startswith("."):
+                continue
+            path = os.path.join(directory, name)
+            st = os.stat(path)
+            yield st.st_mtime, path, st.st_size
+    return files
+
+
+def write(directory, name, size, mtime):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    os.utime(path, (mtime, mtime))
+
+
+def test_workers_share_one_total(tmp_path):
+    directory = str(tmp_path)
+    first = SharedDiskUsage(directory, 1000, listing(directory))
+    second = SharedDiskUsage(directory, 1000, listing(directory))
+    write(directory, "a", 300, 1)
+    assert first.add(300) == 300
+    write(directory, "b", 300, 2)
+    assert second.add(300) == 600
+    assert first.total() == 600
+
+
+def test_over_budget_prunes_oldest_to_low_watermark(tmp_path):
+    directory = str(tmp_path)
+    usage = SharedDiskUsage(directory, 1000, listing(directory))
+    for i in range(5):
+        write(directory, f"f{i}", 300, i + 1)
+    # The first use counts the files other workers already wrote
+    assert usage.add(300) == 900
+    assert sorted(os.listdir(directory)) == [".prune.lock", ".usage", "f2", "f3", "f4"]
+    assert usage.prunes == 1
+
+
+def test_reset_recounts_from_disk(tmp_path):
+    directory = str(tmp_path)
+    usage = SharedDiskUsage(directory, 1000, listing(directory))
+    write(directory, "a", 200, 1)
+    usage.add(200)
+    os.remove(os.path.join(directory, "a"))
+    usage.reset()
+    assert usage.total() == 0
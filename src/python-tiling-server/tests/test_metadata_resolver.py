@@ -0,0 +1,128 @@
+import asyncio
+
+import httpx
+import pytest
+
+from metadata_resolver import MetadataFetchError, MetadataResolver, TaskNotFound
+
+DEFAULT = "http://backend.test"
+
+
+class Backend:
+    """httpx mock transport answering /api/tiles/{id}/info from ``tasks``"""
+
+    def __init__(self):
+        self.tasks = {}
+        self.status = None
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(str(request.url))
+        if self.status is not None:
+            return httpx.Response(self.status, text="down")
+        task_id = request.url.path.split("/")[3]
+        if task_id not in self.tasks:
+            return httpx.Response(404, text="not found")
+        return httpx.Response(200, json={"id": task_id, "version": self.tasks[task_id]})
+
+
+def make_resolver(backend, **kwargs):
+    resolver = MetadataResolver(DEFAULT, parse=lambda data: data["version"], ttl=10, stale_ttl=20,
+                                negative_ttl=5, **kwargs)
+    resolver._client = httpx.AsyncClient(transport=httpx.MockTransport(backend))
+    return resolver
+
+
+def age(resolver, task_id, seconds):
+    resolver._entries[task_id].fetched_at -= seconds
+
+
+def test_missing_tasks_are_negatively_cached():
+    backend = Backend()
+    resolver = make_resolver(backend)
+
+    async def run():
+        for _ in range(3):
+            with pytest.raises(TaskNotFound):
+                await resolver.resolve("gone")
+        assert len(backend.requests) == 1
+        assert resolver.negative_hits == 2
+
+        backend.tasks["gone"] = 1
+        age(resolver, "gone", 6)
+        assert await resolver.resolve("gone") == 1
+        assert len(backend.requests) == 2
+
+    asyncio.run(run())
+
+
+def test_stale_entries_are_served_while_revalidating():
+    backend = Backend()
+    backend.tasks["t"] = 1
+    resolver = make_resolver(backend)
+
+    async def run():
+        assert await resolver.resolve("t") == 1
+        assert await resolver.resolve("t") == 1
+        assert (len(backend.requests), resolver.hits) == (1, 1)
+
+        backend.tasks["t"] = 2
+        age(resolver, "t", 15)
+        # Served at once from the stale entry; one refresh runs in the background
+        assert await asyncio.gather(resolver.resolve("t"), resolver.resolve("t")) == [1, 1]
+        assert resolver.stale_hits == 2
+        await asyncio.sleep(0.01)
+        assert len(backend.requests) == 2
+        assert await resolver.resolve("t") == 2
+
+        # Too old to serve stale: wait for the backend
+        backend.tasks["t"] = 3
+        age(resolver, "t", 31)
+        assert await resolver.resolve("t") == 3
+
+    asyncio.run(run())
+
+
+def test_stale_entry_survives_a_failing_backend():
+    backend = Backend()
+    backend.tasks["t"] = 1
+    resolver = make_resolver(backend)
+
+    async def run():
+        await resolver.resolve("t")
+        backend.status = 503
+        age(resolver, "t", 15)
+        assert await resolver.resolve("t") == 1
+        await asyncio.sleep(0.01)
+        age(resolver, "t", 20)
+        assert await resolver.resolve("t") == 1
+        with pytest.raises(MetadataFetchError):
+            await resolver.resolve("other")
+
+    asyncio.run(run())
+
+
+def test_concurrent_misses_share_one_request():
+    backend = Backend()
+    backend.tasks["t"] = 1
+    resolver = make_resolver(backend)
+
+    async def run():
+        return await asyncio.gather(*(resolver.resolve("t") for _ in range(10)))
+
+    assert asyncio.run(run()) == [1] * 10
+    assert len(backend.requests) == 1
+
+
+def test_only_allowed_backends_are_contacted():
+    backend = Backend()
+    backend.tasks["t"] = 1
+    resolver = make_resolver(backend, allowed_backend_urls=["http://other.test/"])
+
+    async def run():
+        await resolver.resolve("t", "http://evil.test")
+        resolver.invalidate("t")
+        await resolver.resolve("t", "http://other.test")
+
+    asyncio.run(run())
+    assert backend.requests == [f"{DEFAULT}/api/tiles/t/info", "http://other.test/api/tiles/t/info"]
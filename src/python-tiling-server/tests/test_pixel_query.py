@@ -0,0 +1,107 @@
+import mercantile
+import numpy as np
+import pytest
+from rasterio.features import geometry_mask
+from rasterio.warp import transform, transform_geom
+from rio_tiler.io import COGReader
+
+from pixel_query import WGS84, _zonal_stats, query_areas, query_points
+
+TILE = mercantile.bounds(512, 511, 10)
+
+
+def box(fx0, fy0, fx1, fy1):
+    """WGS84 polygon over a fraction of the test COG's extent (x from west, y from north)"""
+    west, east = TILE.west + fx0 * (TILE.east - TILE.west), TILE.west + fx1 * (TILE.east - TILE.west)
+    north, south = TILE.north - fy0 * (TILE.north - TILE.south), TILE.north - fy1 * (TILE.north - TILE.south)
+    return {"type": "Polygon", "coordinates": [[(west, south), (east, south), (east, north), (west, north), (west, south)]]}
+
+
+def triangle(fx0, fy0, fx1, fy1):
+    polygon = box(fx0, fy0, fx1, fy1)
+    ring = polygon["coordinates"][0]
+    polygon["coordinates"] = [[ring[0], ring[1], ring[3], ring[0]]]
+    return polygon
+
+
+def reference(dataset, geometry):
+    """Statistics of one geometry from a full read and numpy masked reductions"""
+    data = dataset.read(masked=True).astype(np.float64)
+    inside = geometry_mask([transform_geom(WGS84, dataset.crs, geometry)], out_shape=data.shape[1:],
+                           transform=dataset.transform, invert=True)
+    pixels = int(inside.sum())
+    valid = inside & ~np.ma.getmaskarray(data).all(axis=0)
+    stats = {}
+    for b in range(dataset.count):
+        values = data[b][inside].compressed()
+        if len(values):
+            stats[str(b + 1)] = dict(count=len(values), min=values.min(), max=values.max(),
+                                     mean=values.mean(), std=values.std(), sum=values.sum())
+    return pixels, 100.0 * valid.sum() / pixels, stats
+
+
+def assert_matches(result, expected):
+    pixels, valid_percent, stats = expected
+    assert result.pixels == pixels
+    assert result.valid_percent == pytest.approx(valid_percent, abs=1e-4)
+    assert set(result.statistics) == set(stats)
+    for band, values in stats.items():
+        assert result.statistics[band].model_dump() == pytest.approx(values)
+
+
+def test_zonal_stats_match_a_loop_per_zone():
+    rng = np.random.default_rng(5)
+    data = np.ma.MaskedArray(rng.normal(size=(2, 40, 50)), mask=rng.random((2, 40, 50)) < 0.3)
+    labels = rng.integers(0, 5, size=(40, 50)).astype(np.int32)
+    labels[:, :3] = 4  # zone 4 is never empty, zone 3 may have no valid pixels in a band
+    pixels, valid_pixels, per_band = _zonal_stats(data, labels, 4)
+    for k in range(4):
+        inside = labels == k + 1
+        assert pixels[k] == inside.sum()
+        assert valid_pixels[k] == (inside & ~data.mask.all(axis=0)).sum()
+        for b, (count, minimum, maximum, mean, std, total) in enumerate(per_band):
+            values = data[b][inside].compressed()
+            assert count[k] == len(values)
+            if len(values):
+                assert (minimum[k], maximum[k], total[k]) == pytest.approx((values.min(), values.max(), values.sum()))
+                assert (mean[k], std[k]) == pytest.approx((values.mean(), values.std()))
+
+
+def test_query_areas_matches_brute_force(gradient_cog):
+    geometries = [
+        box(0.1, 0.1, 0.3, 0.2),
+        box(0.15, 0.12, 0.25, 0.4),  # overlaps the first, same read window
+        triangle(0.6, 0.6, 0.95, 0.95),  # crosses the nodata corner
+        box(0.8, 0.8, 0.9, 0.9),  # nodata only
+        box(0.4, 0.0, 0.42, 1.0),  # thin strip across every window
+        box(1.5, 1.5, 1.6, 1.6),  # outside the raster
+    ]
+    with COGReader(gradient_cog) as src:
+        results = query_areas(src, [(i, g) for i, g in enumerate(geometries)], max_size=2048, window_size=256)
+        for i, (result, geometry) in enumerate(zip(results, geometries[:-1])):
+            assert result.id == i and result.scale == 1
+            assert_matches(result, reference(src.dataset, geometry))
+    assert results[3].statistics == {} and results[3].valid_percent == 0
+    assert results[-1].pixels == 0 and results[-1].statistics == {}
+
+
+def test_large_areas_are_read_from_overviews(gradient_cog):
+    with COGReader(gradient_cog) as src:
+        (result,) = query_areas(src, [(None, box(0.0, 0.0, 0.7, 0.7))], max_size=256)
+    assert result.scale == 4
+    assert result.pixels == pytest.approx((1024 * 0.7 / 4) ** 2, rel=0.02)
+
+
+def test_query_points_reads_full_resolution_pixels(gradient_cog):
+    points = [(TILE.west + fx * (TILE.east - TILE.west), TILE.north - fy * (TILE.north - TILE.south))
+              for fx, fy in [(0.01, 0.01), (0.5, 0.25), (0.51, 0.26), (0.9, 0.9)]]
+    with COGReader(gradient_cog) as src:
+        data = src.dataset.read()
+        results = query_points(src, points + [(10.0, 10.0)], window_size=128)
+        for (lon, lat), result in zip(points, results):
+            xs, ys = transform(WGS84, src.dataset.crs, [lon], [lat])
+            row, col = src.dataset.index(xs[0], ys[0])
+            expected = [None if data[b, row, col] == 0 else float(data[b, row, col]) for b in range(3)]
+            assert result.values == expected
+    assert results[3].values == [None, None, None]
+    assert results[-1].values is None
@@ -0,0 +1,61 @@
+import asyncio
+import random
+
+import pytest
+
+from project_mosaic import MosaicLayer, ProjectIndexStore, RTree
+
+
+def random_boxes(rng, count):
+    boxes = []
+    for _ in range(count):
+        west, south = rng.uniform(-180, 170), rng.uniform(-85, 80)
+        boxes.append((west, south, west + rng.uniform(0.001, 10), south + rng.uniform(0.001, 5)))
+    return boxes
+
+
+def brute_force(boxes, query):
+    return [i for i, b in enumerate(boxes)
+            if b[0] < query[2] and b[2] > query[0] and b[1] < query[3] and b[3] > query[1]]
+
+
+@pytest.mark.parametrize("count, node_size", [(0, 16), (1, 16), (16, 16), (17, 16), (1000, 16), (300, 4)])
+def test_search_matches_brute_force(count, node_size):
+    rng = random.Random(count * node_size)
+    boxes = random_boxes(rng, count)
+    tree = RTree([(box, i) for i, box in enumerate(boxes)], node_size=node_size)
+    assert len(tree) == count
+    for query in random_boxes(rng, 200) + [(-180, -90, 180, 90)]:
+        # Results keep the input order (compositing order)
+        assert tree.search(query) == brute_force(boxes, query)
+
+
+def test_touching_edges_do_not_intersect():
+    tree = RTree([((0, 0, 1, 1), "a"), ((1, 0, 2, 1), "b")])
+    assert tree.search((1, 0, 1.5, 1)) == ["b"]
+    assert tree.search((0.5, 0.5, 1.5, 0.6)) == ["a", "b"]
+    assert tree.bounds == (0, 0, 2, 1)
+    assert RTree([]).search((0, 0, 1, 1)) == []
+    assert RTree([]).bounds is None
+
+
+def test_store_shares_builds_and_drops_projects_of_a_task():
+    loads = []
+
+    async def load(project_id, backend_base_url):
+        loads.append(project_id)
+        await asyncio.sleep(0.01)
+        return [MosaicLayer(f"task-{project_id}", "http://cog", (0, 0, 1, 1))]
+
+    store = ProjectIndexStore(load, ttl=60)
+
+    async def run():
+        indexes = await asyncio.gather(*(store.get(7) for _ in range(5)))
+        assert all(index is indexes[0] for index in indexes)
+        assert await store.get(7) is indexes[0]
+        await store.get(8)
+        assert store.invalidate_task("task-7") == [7]
+        await store.get(7)
+
+    asyncio.run(run())
+    assert loads == [7, 8, 7]
@@ -0,0 +1,143 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from render_executor import (
+    PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, JobContext, RenderDeadlineExceeded, RenderExecutor,
+    RenderQueueFull, _FairQueue, _Job, _client_of, job_context,
+)
+
+
+def queued(task, client, name):
+    return _Job(lambda: name, (), {}, JobContext(task=task, client=client))
+
+
+def test_fair_queue_takes_turns_over_tasks_then_clients():
+    queue = _FairQueue()
+    for task, client, name in [("a", "x", "x1"), ("a", "x", "x2"), ("a", "x", "x3"), ("a", "y", "y1"), ("b", "z", "z1")]:
+        queue.push(queued(task, client, name))
+    order = [queue.pop().fn() for _ in range(queue.size)]
+    assert order == ["x1", "z1", "y1", "x2", "x3"]
+    assert queue.size == 0
+
+
+def test_pop_hog_sheds_the_newest_job_of_the_busiest_client():
+    queue = _FairQueue()
+    jobs = [queued("a", "x", "x1"), queued("a", "x", "x2"), queued("b", "y", "y1")]
+    for job in jobs:
+        queue.push(job)
+    assert queue.pop_hog() is jobs[1]
+    assert queue.remove(jobs[1]) is False
+    assert [queue.pop().fn() for _ in range(queue.size)] == ["x1", "y1"]
+
+
+class Blocker:
+    """Occupies the executor's only thread until released"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.started.set()
+        self.release.wait(5)
+        return "blocker"
+
+
+async def occupy(executor):
+    blocker = Blocker()
+    running = asyncio.ensure_future(executor.run(blocker))
+    await asyncio.to_thread(blocker.started.wait, 5)
+    return blocker, running
+
+
+def test_urgent_jobs_shed_background_work_and_run_first():
+    executor = RenderExecutor(max_workers=1, max_pending=4)
+    order = []
+
+    async def run():
+        blocker, running = await occupy(executor)
+        background = []
+        for i, client in enumerate(["seeder", "seeder", "other"]):
+            with job_context(priority=PRIORITY_BACKGROUND, client=client):
+                background.append(asyncio.ensure_future(executor.run(order.append, f"background-{i}")))
+        await asyncio.sleep(0)
+        # Full: the interactive job takes the slot of the seeder's newest job
+        with job_context(priority=PRIORITY_INTERACTIVE):
+            interactive = asyncio.ensure_future(executor.run(order.append, "interactive"))
+        await asyncio.sleep(0)
+        with job_context(priority=PRIORITY_BACKGROUND):
+            with pytest.raises(RenderQueueFull):
+                await executor.run(order.append, "rejected")
+        blocker.release.set()
+        results = await asyncio.gather(running, interactive, *background, return_exceptions=True)
+        assert isinstance(results[3], RenderQueueFull)
+
+    asyncio.run(run())
+    executor.shutdown()
+    assert order == ["interactive", "background-0", "background-2"]
+    assert (executor.shed, executor.rejected) == (1, 1)
+
+
+def test_jobs_past_their_deadline_do_not_run():
+    executor = RenderExecutor(max_workers=1, max_pending=4)
+    ran = []
+
+    async def run():
+        blocker, running = await occupy(executor)
+        with job_context(deadline=time.monotonic() + 0.05):
+            late = asyncio.ensure_future(executor.run(ran.append, "late"))
+        await asyncio.sleep(0.1)
+        blocker.release.set()
+        await running
+        with pytest.raises(RenderDeadlineExceeded):
+            await late
+        with job_context(deadline=time.monotonic() - 1):
+            with pytest.raises(RenderDeadlineExceeded):
+                await executor.run(ran.append, "expired")
+
+    asyncio.run(run())
+    executor.shutdown()
+    assert ran == []
+    assert executor.shed == 2
+
+
+def test_cancelled_requests_drop_their_queued_jobs():
+    executor = RenderExecutor(max_workers=1, max_pending=4)
+    ran = []
+
+    async def run():
+        blocker, running = await occupy(executor)
+        queued_job = asyncio.ensure_future(executor.run(ran.append, "cancelled"))
+        await asyncio.sleep(0)
+        queued_job.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued_job
+        assert executor.queue_depth == 0
+        blocker.release.set()
+        await running
+
+    asyncio.run(run())
+    executor.shutdown()
+    assert ran == []
+    assert executor.cancelled == 1
+
+
+def scope(forwarded=None, peer="10.0.0.9"):
+    headers = [(b"x-forwarded-for", value.encode()) for value in forwarded or []]
+    return {"headers": headers, "client": (peer, 1234)}
+
+
+@pytest.mark.parametrize("forwarded, trusted, expected", [
+    (["203.0.113.5"], 1, "203.0.113.5"),
+    # Hops before the trusted proxy's are whatever the client sent
+    (["1.2.3.4, 203.0.113.5"], 1, "203.0.113.5"),
+    (["1.2.3.4", "203.0.113.5, 10.0.0.2"], 2, "203.0.113.5"),
+    (["203.0.113.5"], 2, "10.0.0.9"),
+    (["203.0.113.5"], 0, "10.0.0.9"),
+    (None, 1, "10.0.0.9"),
+])
+def test_client_is_the_trusted_proxys_hop(forwarded, trusted, expected):
+    assert _client_of(scope(forwarded), trusted) == expected
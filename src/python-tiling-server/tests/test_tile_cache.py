@@ -0,0 +1,99 @@
+import asyncio
+import os
+
+import pytest
+from starlette.requests import Request
+
+from band_expression import BandExpression
+from tile_cache import CachedTile, TileCache, etag_matches, make_etag, make_key
+from tile_render import TileParams
+
+
+def tile(content=b"png bytes"):
+    return CachedTile(content=content, media_type="image/png", etag=make_etag(content))
+
+
+def request(**headers):
+    raw = [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw, "query_string": b""})
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ("", False),
+    ("*", True),
+    ('"{etag}"', True),
+    ('W/"{etag}"', True),
+    ('"other", "{etag}"', True),
+    ('"other"', False),
+])
+def test_etag_matches(header, expected):
+    etag = make_etag(b"tile")
+    if header is not None:
+        header = header.replace('"{etag}"', etag)
+    assert etag_matches(header, etag) is expected
+
+
+def test_keys_follow_version_and_normalized_parameters():
+    png = TileParams(size=256, format="png")
+    assert make_key("t", "v1", *png.cache_parts()) == make_key("t", "v1", *TileParams(256, "png").cache_parts())
+    assert make_key("t", "v1", *png.cache_parts()) != make_key("t", "v2", *png.cache_parts())
+    assert make_key("t", "v1", *png.cache_parts()) != make_key("u", "v1", *png.cache_parts())
+    assert TileParams(256, "jpeg").cache_parts() == TileParams(256, "jpg").cache_parts()
+    assert TileParams(256, "png", color_map="Viridis").cache_parts() == \
+        TileParams(256, "png", color_map="viridis").cache_parts()
+    assert TileParams(256, "png", nodata=float("nan")).cache_parts() == \
+        TileParams(256, "png", nodata=float("nan")).cache_parts()
+    assert TileParams(256, "png", webp_ok=True).cache_parts() != png.cache_parts()
+    assert TileParams(256, "jpg", webp_ok=True).cache_parts() == TileParams(256, "jpg").cache_parts()
+    spaced = TileParams(256, "png", expression=BandExpression("b1+b2"))
+    assert spaced.cache_parts() == TileParams(256, "png", expression=BandExpression("b1 + b2")).cache_parts()
+
+
+def test_memory_tier_is_a_byte_budgeted_lru():
+    cache = TileCache(max_bytes=20)
+    cache.put_sync(("t", "a"), tile(b"x" * 8))
+    cache.put_sync(("t", "b"), tile(b"x" * 8))
+    assert cache.get_memory(("t", "a")) is not None
+    cache.put_sync(("t", "c"), tile(b"x" * 8))
+    assert cache.get_memory(("t", "b")) is None
+    assert cache.get_memory(("t", "a")) is not None
+    cache.put_sync(("t", "huge"), tile(b"x" * 21))
+    assert cache.get_memory(("t", "huge")) is None
+    assert cache.snapshot()["bytes"] == 16
+
+
+def test_disk_tier_is_shared_and_invalidated(tmp_path):
+    disk_dir = str(tmp_path / "tiles")
+    writer = TileCache(max_bytes=1024, disk_dir=disk_dir, disk_max_bytes=1 << 20)
+    reader = TileCache(max_bytes=1024, disk_dir=disk_dir, disk_max_bytes=1 << 20)
+    key = make_key("../../etc", "v1", 256, "png")
+    stored = tile()
+    asyncio.run(writer.put(key, stored))
+
+    assert asyncio.run(reader.get(key)) == stored
+    assert reader.disk_hits == 1
+    # The task id is hashed, never used as a path component
+    assert not os.path.exists(tmp_path / "etc")
+    assert len(os.listdir(disk_dir)) == 2  # the task's directory and the shared .usage counter
+
+    writer.invalidate("../../etc")
+    assert asyncio.run(TileCache(1024, disk_dir, 1 << 20).get(key)) is None
+
+
+def test_revalidation_answers_304_with_the_etag():
+    from main import tile_response
+
+    stored = tile()
+    fresh = tile_response(stored, request())
+    assert fresh.status_code == 200
+    assert fresh.headers["etag"] == stored.etag
+    assert fresh.body == stored.content
+
+    revalidated = tile_response(stored, request(if_none_match=stored.etag))
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == stored.etag
+    assert revalidated.body == b""
+
+    changed = tile_response(tile(b"new bytes"), request(if_none_match=stored.etag))
+    assert changed.status_code == 200
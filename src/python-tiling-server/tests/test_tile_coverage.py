@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from rio_tiler.io import COGReader
+
+import tile_coverage
+from conftest import write_cog
+from tile_coverage import EMPTY, FULL, PARTIAL, CoverageIndex, build_coverage, coverage_path
+
+# The test COGs cover tile 10/512/511; its z15 children are 32x32 pixels each
+Z, X0, Y0 = 15, 512 * 32, 511 * 32
+
+
+def sparse_cog(path, overviews=4):
+    data = np.zeros((1, 1024, 1024), dtype=np.uint8)
+    data[0, 0:160, 0:160] = 10  # a valid block...
+    data[0, 48, 48] = 0  # ...with a one-pixel hole
+    data[0, 500, 500] = 7  # a lone valid pixel
+    data[0, 900:1024:64, 100] = 3  # a sparse column of pixels
+    return write_cog(path, data, overviews=overviews)
+
+
+@pytest.mark.parametrize("max_size, shape", [(128, (128, 128)), (100, (64, 64))])
+def test_sparse_pixels_keep_their_cells(tmp_path, max_size, shape):
+    with COGReader(sparse_cog(str(tmp_path / "sparse.tif"))) as src:
+        coverage = build_coverage(src, "v1", max_size=max_size)
+    assert coverage.mask.shape == shape
+    assert coverage.classify(X0 + 500 // 32, Y0 + 500 // 32, Z) == PARTIAL
+    assert coverage.classify(X0 + 100 // 32, Y0 + 960 // 32, Z) == PARTIAL
+    assert coverage.classify(X0 + 3, Y0 + 3, Z) == FULL
+    assert coverage.classify(X0 + 25, Y0 + 5, Z) == EMPTY
+
+
+@pytest.mark.filterwarnings("ignore::rio_tiler.errors.NoOverviewWarning")
+def test_full_resolution_without_overviews(tmp_path):
+    with COGReader(sparse_cog(str(tmp_path / "flat.tif"), overviews=0)) as src:
+        coverage = build_coverage(src, "v1", max_size=200)
+    # 1024 pixels in cells of 6 pad the grid past the dataset's edges
+    assert coverage.mask.shape == (171, 171)
+    assert coverage.classify(X0 + 500 // 32, Y0 + 500 // 32, Z) == PARTIAL
+    # Read pixel for pixel, the one-pixel hole is not averaged into a full cell
+    assert coverage.classify(X0 + 1, Y0 + 1, Z) == PARTIAL
+    assert coverage.classify(X0 + 3, Y0 + 3, Z) == FULL
+    assert coverage.classify(X0 + 31, Y0 + 31, Z) == EMPTY
+
+
+@pytest.mark.filterwarnings("ignore::rio_tiler.errors.NoOverviewWarning")
+def test_downsampled_strips_without_overviews(tmp_path, monkeypatch):
+    # Far smaller than the dataset: every cell reduces 32x32 full-resolution pixels
+    monkeypatch.setattr(tile_coverage, "STRIP_PIXELS", 40_000)
+    with COGReader(sparse_cog(str(tmp_path / "flat.tif"), overviews=0)) as src:
+        coverage = build_coverage(src, "v1", max_size=32)
+    assert coverage.mask.shape == (32, 32)
+    assert coverage.classify(X0 + 500 // 32, Y0 + 500 // 32, Z) == PARTIAL
+    assert coverage.classify(X0 + 100 // 32, Y0 + 960 // 32, Z) == PARTIAL
+    assert coverage.classify(X0 + 1, Y0 + 1, Z) == PARTIAL
+    assert coverage.classify(X0 + 20, Y0 + 20, Z) == EMPTY
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = sparse_cog(str(tmp_path / "sparse.tif"))
+    with COGReader(path) as src:
+        coverage = build_coverage(src, "v1", max_size=128)
+    coverage.save(coverage_path(path))
+    loaded = CoverageIndex.load(coverage_path(path))
+    assert loaded.version == "v1"
+    assert np.array_equal(loaded.mask, coverage.mask)
+    assert loaded.classify(X0 + 500 // 32, Y0 + 500 // 32, Z) == PARTIAL
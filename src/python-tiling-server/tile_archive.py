@@ -0,0 +1,333 @@
+"""
+Pre-rendered tile archives (PMTiles / MBTiles): writing and memory-mapped serving
+"""
+
+import gzip
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from cachetools import LRUCache
+from pmtiles.tile import (
+    Compression,
+    TileType,
+    deserialize_directory,
+    deserialize_header,
+    find_tile,
+    zxy_to_tileid,
+)
+from pmtiles.writer import Writer as PMTilesWriter
+
+from tile_cache import CachedTile, make_etag
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMATS = ("pmtiles", "mbtiles")
+
+PMTILES_TILE_TYPES = {
+    "image/png": TileType.PNG,
+    "image/jpeg": TileType.JPEG,
+    "image/webp": TileType.WEBP,
+}
+
+
+def render_key(cache_parts: tuple) -> str:
+    """Serialized render parameters an archive was baked with (see ``TileParams.cache_parts``)"""
+    return json.dumps(list(cache_parts))
+
+
+def sniff_media_type(data: bytes) -> str:
+    """Media type of an encoded tile from its magic bytes"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    return "application/octet-stream"
+
+
+class PMTilesArchive:
+    """
+    Read-only PMTiles v3 archive served straight from a memory map.
+
+    The header, root directory and recently used leaf directories are parsed
+    once; a lookup is a binary search plus one slice of the mapping, with no
+    file I/O syscalls once the pages are resident.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        self.header = deserialize_header(self._map[:127])
+        raw = self._map[self.header["metadata_offset"]:self.header["metadata_offset"] + self.header["metadata_length"]]
+        if self.header["internal_compression"] == Compression.GZIP:
+            raw = gzip.decompress(raw)
+        self.metadata: Dict[str, Any] = json.loads(raw)
+        self._root = self._directory(self.header["root_offset"], self.header["root_length"])
+        self._leaves: LRUCache = LRUCache(maxsize=256)
+
+    def _directory(self, offset: int, length: int):
+        return deserialize_directory(self._map[offset:offset + length])
+
+    def get(self, z: int, x: int, y: int) -> Optional[bytes]:
+        tile_id = zxy_to_tileid(z, x, y)
+        entries = self._root
+        for _ in range(4):  # maximum directory depth
+            entry = find_tile(entries, tile_id)
+            if entry is None:
+                return None
+            if entry.run_length > 0:
+                offset = self.header["tile_data_offset"] + entry.offset
+                return self._map[offset:offset + entry.length]
+            leaf_offset = self.header["leaf_directory_offset"] + entry.offset
+            entries = self._leaves.get(leaf_offset)
+            if entries is None:
+                entries = self._directory(leaf_offset, entry.length)
+                self._leaves[leaf_offset] = entries
+        return None
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+
+class MBTilesArchive:
+    """
+    Read-only MBTiles archive opened immutable with SQLite's memory-mapped I/O,
+    so page reads are served from the mapping rather than ``read()`` calls
+    """
+
+    def __init__(self, path: str, mmap_size: int = 1 << 30):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+        self._conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        self.metadata: Dict[str, Any] = {
+            name: value for name, value in self._conn.execute("SELECT name, value FROM metadata")
+        }
+
+    def get(self, z: int, x: int, y: int) -> Optional[bytes]:
+        # MBTiles rows are numbered bottom-up (TMS)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, (1 << z) - 1 - y),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class TileArchiveWriter:
+    """
+    Write tiles into a new archive, atomically replacing ``path`` on finish.
+
+    PMTiles tiles should be added in ascending tile id order (see
+    ``zxy_to_tileid``) so the archive is clustered; identical tiles (e.g.
+    fully transparent ones) are stored once.
+    """
+
+    def __init__(self, path: str, archive_format: str):
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unknown archive format {archive_format}")
+        self.path = path
+        self.archive_format = archive_format
+        self.tmp_path = f"{path}.{os.getpid()}.tmp"
+        self.count = 0
+        self.media_types = set()
+        self.minzoom = self.maxzoom = None
+        if archive_format == "pmtiles":
+            self._file = open(self.tmp_path, "wb")
+            self._writer = PMTilesWriter(self._file)
+        else:
+            self._conn = sqlite3.connect(self.tmp_path, check_same_thread=False)
+            self._conn.executescript(
+                "CREATE TABLE metadata (name TEXT, value TEXT);"
+                "CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);"
+                "CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);"
+            )
+
+    def add(self, z: int, x: int, y: int, data: bytes) -> None:
+        self.media_types.add(sniff_media_type(data))
+        self.minzoom = z if self.minzoom is None else min(self.minzoom, z)
+        self.maxzoom = z if self.maxzoom is None else max(self.maxzoom, z)
+        if self.archive_format == "pmtiles":
+            self._writer.write_tile(zxy_to_tileid(z, x, y), data)
+        else:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)", (z, x, (1 << z) - 1 - y, data)
+            )
+        self.count += 1
+
+    def finish(self, metadata: Dict[str, Any], bounds: Tuple[float, float, float, float]) -> int:
+        """Write the directory/metadata and move the archive into place; returns the tile count"""
+        try:
+            if self.count == 0:
+                raise ValueError("No tiles to write")
+            if self.archive_format == "pmtiles":
+                self._finish_pmtiles(metadata, bounds)
+            else:
+                self._finish_mbtiles(metadata, bounds)
+            os.replace(self.tmp_path, self.path)
+        except BaseException:
+            self.abort()
+            raise
+        return self.count
+
+    def _finish_pmtiles(self, metadata: Dict[str, Any], bounds) -> None:
+        west, south, east, north = bounds
+        tile_type = TileType.UNKNOWN
+        if len(self.media_types) == 1:
+            tile_type = PMTILES_TILE_TYPES.get(next(iter(self.media_types)), TileType.UNKNOWN)
+        self._writer.finalize(
+            {
+                "tile_compression": Compression.NONE,
+                "tile_type": tile_type,
+                "min_lon_e7": int(west * 10_000_000),
+                "min_lat_e7": int(south * 10_000_000),
+                "max_lon_e7": int(east * 10_000_000),
+                "max_lat_e7": int(north * 10_000_000),
+                "center_zoom": self.minzoom,
+                "center_lon_e7": int((west + east) / 2 * 10_000_000),
+                "center_lat_e7": int((south + north) / 2 * 10_000_000),
+            },
+            metadata,
+        )
+        self._file.close()
+
+    def _finish_mbtiles(self, metadata: Dict[str, Any], bounds) -> None:
+        media_type = next(iter(self.media_types)) if len(self.media_types) == 1 else ""
+        rows = {
+            **{k: v if isinstance(v, str) else json.dumps(v) for k, v in metadata.items()},
+            "format": {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp"}.get(media_type, "png"),
+            "bounds": ",".join(str(v) for v in bounds),
+            "minzoom": str(self.minzoom),
+            "maxzoom": str(self.maxzoom),
+        }
+        self._conn.executemany("INSERT INTO metadata VALUES (?, ?)", rows.items())
+        self._conn.commit()
+        self._conn.close()
+
+    def abort(self) -> None:
+        try:
+            if self.archive_format == "pmtiles":
+                self._file.close()
+            else:
+                self._conn.close()
+        except Exception:
+            pass
+        try:
+            os.unlink(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class TileArchiveStore:
+    """
+    Serve tiles from ``<archive_dir>/<task_id>.pmtiles`` (or ``.mbtiles``).
+
+    An archive only answers requests whose normalized render parameters match
+    the ones it was baked with (its ``render_key`` metadata); everything else
+    falls through to live rendering. Open archives are kept per worker and
+    re-opened when the file on disk is replaced; the directory is re-checked
+    at most every ``check_interval`` seconds per task.
+    """
+
+    def __init__(self, archive_dir: str, check_interval: float = 1.0):
+        self.archive_dir = archive_dir
+        self.check_interval = check_interval
+        # task_id -> (checked_at, (path, ino, mtime_ns) or None, archive or None)
+        self._open: Dict[str, tuple] = {}
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def archive_path(self, task_id: str, archive_format: str) -> str:
+        return os.path.join(self.archive_dir, f"{task_id}.{archive_format}")
+
+    def get(self, task_id: str, z: int, x: int, y: int, key: str) -> Optional[CachedTile]:
+        """The archived tile for these render parameters, or None to render live"""
+        archive = self._archive(task_id)
+        if archive is None or archive.metadata.get("render_key") != key:
+            return None
+        data = archive.get(z, x, y)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return CachedTile(content=data, media_type=sniff_media_type(data), etag=make_etag(data))
+
+    def _archive(self, task_id: str):
+        now = time.monotonic()
+        entry = self._open.get(task_id)
+        if entry is not None and now - entry[0] < self.check_interval:
+            return entry[2]
+
+        found = None
+        for archive_format in ARCHIVE_FORMATS:
+            path = self.archive_path(task_id, archive_format)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            found = (path, st.st_ino, st.st_mtime_ns)
+            break
+
+        if entry is not None and entry[1] == found:
+            self._open[task_id] = (now, found, entry[2])
+            return entry[2]
+        if entry is not None and entry[2] is not None:
+            entry[2].close()
+
+        archive = None
+        if found is not None:
+            try:
+                cls = PMTilesArchive if found[0].endswith(".pmtiles") else MBTilesArchive
+                archive = cls(found[0])
+            except Exception as e:
+                logger.warning(f"Failed to open tile archive {found[0]}: {e}")
+        self._open[task_id] = (now, found, archive)
+        return archive
+
+    def invalidate(self, task_id: str) -> None:
+        entry = self._open.pop(task_id, None)
+        if entry is not None and entry[2] is not None:
+            entry[2].close()
+
+    def remove(self, task_id: str, keep: Optional[str] = None) -> None:
+        """Delete the task's archives (other than ``keep``)"""
+        for archive_format in ARCHIVE_FORMATS:
+            path = self.archive_path(task_id, archive_format)
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self.invalidate(task_id)
+
+    def close(self) -> None:
+        for task_id in list(self._open):
+            self.invalidate(task_id)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "open": sum(1 for entry in self._open.values() if entry[2] is not None),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
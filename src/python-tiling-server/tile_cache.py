@@ -0,0 +1,203 @@
+"""
+Two-tier (memory + optional disk) cache of rendered tiles with strong ETags
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from disk_usage import SharedDiskUsage
+
+logger = logging.getLogger(__name__)
+
+# (task_id, digest of the normalized render key)
+CacheKey = Tuple[str, str]
+
+
+@dataclass(frozen=True)
+class CachedTile:
+    content: bytes
+    media_type: str
+    etag: str
+
+
+def make_etag(content: bytes) -> str:
+    """Strong ETag derived from the encoded bytes"""
+    return '"' + hashlib.blake2b(content, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluate an If-None-Match header (weak comparison, as RFC 9110 requires)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def make_key(task_id: str, version: str, *parts: object) -> CacheKey:
+    """Build a cache key from the COG version and already-normalized render parameters"""
+    raw = "|".join([version, *(repr(p) for p in parts)])
+    return task_id, hashlib.blake2b(raw.encode(), digest_size=20).hexdigest()
+
+
+class TileCache:
+    """
+    Byte-budgeted in-memory LRU in front of an optional on-disk tier.
+
+    Disk entries live under ``<disk_dir>/<hash of task_id>/<digest>``, so a
+    task id never becomes a path component. They are written atomically so
+    several workers can share the directory; its size is tracked in a flock'd
+    counter file shared by those workers, and the disk tier is pruned
+    oldest-first once it exceeds ``disk_max_bytes``.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[CacheKey, CachedTile]" = OrderedDict()
+        self._bytes = 0
+        self._disk_usage: Optional[SharedDiskUsage] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            self._disk_usage = SharedDiskUsage(disk_dir, disk_max_bytes, self._disk_files)
+
+    async def get(self, key: CacheKey) -> Optional[CachedTile]:
+        tile = self.get_memory(key)
+        if tile is not None:
+            return tile
+        if self.disk_dir:
+            tile = await asyncio.to_thread(self._disk_get, key)
+            if tile is not None:
+                self.disk_hits += 1
+                self._memory_put(key, tile)
+                return tile
+        self.misses += 1
+        return None
+
+    def get_memory(self, key: CacheKey) -> Optional[CachedTile]:
+        with self._lock:
+            tile = self._entries.get(key)
+            if tile is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+            return tile
+
+    async def put(self, key: CacheKey, tile: CachedTile) -> None:
+        self._memory_put(key, tile)
+        if self.disk_dir:
+            await asyncio.to_thread(self._disk_put, key, tile)
+
+    def put_sync(self, key: CacheKey, tile: CachedTile) -> None:
+        """Blocking variant for callers already on a worker thread"""
+        self._memory_put(key, tile)
+        if self.disk_dir:
+            self._disk_put(key, tile)
+
+    def invalidate(self, task_id: str) -> None:
+        """Drop every cached tile of a task from both tiers"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == task_id]:
+                self._bytes -= len(self._entries.pop(key).content)
+        if self.disk_dir:
+            shutil.rmtree(self._task_dir(task_id), ignore_errors=True)
+            self._disk_usage.reset()
+
+    def keys(self, task_id: Optional[str] = None) -> Iterable[CacheKey]:
+        with self._lock:
+            return [k for k in self._entries if task_id is None or k[0] == task_id]
+
+    # Memory tier
+
+    def _memory_put(self, key: CacheKey, tile: CachedTile) -> None:
+        size = len(tile.content)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous.content)
+            self._entries[key] = tile
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.content)
+
+    # Disk tier
+
+    def _task_dir(self, task_id: str) -> str:
+        return os.path.join(self.disk_dir, hashlib.blake2b(task_id.encode(), digest_size=16).hexdigest())
+
+    def _disk_path(self, key: CacheKey) -> str:
+        return os.path.join(self._task_dir(key[0]), key[1])
+
+    def _disk_get(self, key: CacheKey) -> Optional[CachedTile]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                media_type = f.readline().rstrip(b"\n").decode()
+                etag = f.readline().rstrip(b"\n").decode()
+                content = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return CachedTile(content=content, media_type=media_type, etag=etag)
+
+    def _disk_put(self, key: CacheKey, tile: CachedTile) -> None:
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(tile.media_type.encode() + b"\n" + tile.etag.encode() + b"\n")
+                f.write(tile.content)
+                size = f.tell()
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write tile cache entry {path}: {e}")
+            return
+        self._disk_usage.add(size - replaced)
+
+    def _disk_files(self):
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if name.endswith(".tmp") or name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield st.st_mtime, path, st.st_size
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "disk_enabled": bool(self.disk_dir),
+            }
@@ -0,0 +1,169 @@
+"""
+Per-COG-version coverage index: classify tiles as empty, full or partial without reading the dataset
+"""
+
+import io
+import logging
+import math
+import os
+
+import mercantile
+import numpy as np
+import rasterio
+from pyproj import Transformer
+from rasterio.crs import CRS
+from rasterio.windows import Window
+from rio_tiler.io import COGReader
+
+logger = logging.getLogger(__name__)
+
+EMPTY = "empty"
+FULL = "full"
+PARTIAL = "partial"
+
+# Bumped when the meaning of the stored grid changes, so older files are rebuilt
+COVERAGE_FORMAT = 2
+
+# Mask pixels read at once while reducing a dataset to its coverage grid
+STRIP_PIXELS = 16 * 1024 * 1024
+
+
+def coverage_path(local_path: str) -> str:
+    return f"{local_path}.coverage.npz"
+
+
+def _dilate(a: np.ndarray) -> np.ndarray:
+    """3x3 binary dilation"""
+    padded = np.pad(a, 1)
+    out = np.zeros_like(a)
+    h, w = a.shape
+    for dy in range(3):
+        for dx in range(3):
+            out |= padded[dy:dy + h, dx:dx + w]
+    return out
+
+
+def _integral(a: np.ndarray) -> np.ndarray:
+    """Summed-area table with a leading zero row/column"""
+    table = np.zeros((a.shape[0] + 1, a.shape[1] + 1), dtype=np.int64)
+    table[1:, 1:] = a.astype(np.int64).cumsum(axis=0).cumsum(axis=1)
+    return table
+
+
+class CoverageIndex:
+    """
+    Coarse validity grid of a COG in its native CRS.
+
+    ``mask`` holds one cell per block of mask pixels: 0 means no valid pixel
+    under that cell, 255 means every pixel is valid and anything in between
+    partial. Cells next to valid data are treated as possibly valid (and cells
+    next to gaps as possibly partial), so an ``EMPTY`` verdict is conservative;
+    summed-area tables make each classification O(1).
+    """
+
+    def __init__(self, version: str, mask: np.ndarray, bounds, crs_wkt: str):
+        self.version = version
+        self.mask = mask
+        self.bounds = tuple(float(v) for v in bounds)  # native CRS (left, bottom, right, top)
+        self.crs_wkt = crs_wkt
+        height, width = mask.shape
+        left, bottom, right, top = self.bounds
+        self._res_x = (right - left) / width
+        self._res_y = (top - bottom) / height
+        self._any = _integral(_dilate(mask > 0))
+        self._all = _integral(~_dilate(mask < 255))
+        self._transformer = Transformer.from_crs("EPSG:3857", CRS.from_wkt(crs_wkt).to_wkt(), always_xy=True)
+
+    def classify(self, x: int, y: int, z: int) -> str:
+        """EMPTY (no valid pixel), FULL (no nodata pixel) or PARTIAL"""
+        tile = mercantile.xy_bounds(x, y, z)
+        minx, miny, maxx, maxy = self._transformer.transform_bounds(
+            tile.left, tile.bottom, tile.right, tile.top, densify_pts=5
+        )
+        left, bottom, right, top = self.bounds
+        height, width = self.mask.shape
+        col0 = math.floor((minx - left) / self._res_x)
+        col1 = math.ceil((maxx - left) / self._res_x)
+        row0 = math.floor((top - maxy) / self._res_y)
+        row1 = math.ceil((top - miny) / self._res_y)
+        c0, c1 = max(col0, 0), min(col1, width)
+        r0, r1 = max(row0, 0), min(row1, height)
+        if c0 >= c1 or r0 >= r1:
+            return EMPTY
+        if self._window_sum(self._any, r0, r1, c0, c1) == 0:
+            return EMPTY
+        inside = (c0, c1, r0, r1) == (col0, col1, row0, row1)
+        if inside and self._window_sum(self._all, r0, r1, c0, c1) == (r1 - r0) * (c1 - c0):
+            return FULL
+        return PARTIAL
+
+    @staticmethod
+    def _window_sum(table: np.ndarray, r0: int, r1: int, c0: int, c1: int) -> int:
+        return int(table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0])
+
+    def save(self, path: str) -> None:
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer, mask=self.mask, version=self.version, bounds=np.array(self.bounds), crs=self.crs_wkt,
+            format=COVERAGE_FORMAT,
+        )
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CoverageIndex":
+        with np.load(path) as data:
+            if int(data["format"]) != COVERAGE_FORMAT:
+                raise ValueError(f"Coverage index {path} has an old format")
+            return cls(str(data["version"]), data["mask"], data["bounds"], str(data["crs"]))
+
+
+def build_coverage(src: COGReader, version: str, max_size: int) -> CoverageIndex:
+    """
+    Reduce the dataset mask to a grid of at most ``max_size`` cells per side (blocking).
+
+    The mask is read pixel for pixel at the coarsest overview that is still
+    at least as fine as the grid (at full resolution without one), in strips,
+    and each cell records whether any or all of the pixels under it are
+    valid, so a single valid pixel keeps its cell from being empty (resampled
+    mask reads average or skip sparse pixels away). The grid is as precise as
+    that overview's mask.
+    """
+    dataset = src.dataset
+    scale = max(dataset.width, dataset.height) / max_size
+    levels = [i for i, factor in enumerate(dataset.overviews(1)) if factor <= scale]
+    if levels:
+        with rasterio.open(dataset.name, overview_level=levels[-1]) as overview:
+            mask, height, width = _reduce_mask(overview, max_size)
+    else:
+        mask, height, width = _reduce_mask(dataset, max_size)
+
+    # Padding extends the last row and column of cells past the dataset's edges
+    step = math.ceil(max(height, width) / max_size)
+    left, bottom, right, top = dataset.bounds
+    right = left + (right - left) * mask.shape[1] * step / width
+    bottom = top - (top - bottom) * mask.shape[0] * step / height
+    return CoverageIndex(version, mask, (left, bottom, right, top), dataset.crs.to_wkt())
+
+
+def _reduce_mask(dataset, max_size: int):
+    """(grid, height, width): any/all validity of ``dataset``'s mask per cell of at most ``max_size`` per side"""
+    height, width = dataset.height, dataset.width
+    step = math.ceil(max(height, width) / max_size)
+    rows, cols = math.ceil(height / step), math.ceil(width / step)
+    any_valid = np.zeros((rows, cols), dtype=bool)
+    all_valid = np.zeros((rows, cols), dtype=bool)
+    strip = max(1, STRIP_PIXELS // (cols * step * step))  # rows of cells per read
+    for row0 in range(0, rows, strip):
+        row1 = min(row0 + strip, rows)
+        y0 = row0 * step
+        window = Window(0, y0, width, min(row1 * step, height) - y0)
+        padded = np.zeros(((row1 - row0) * step, cols * step), dtype=bool)
+        padded[:window.height, :width] = dataset.read_masks(1, window=window) > 0
+        blocks = padded.reshape(row1 - row0, step, cols, step)
+        any_valid[row0:row1] = blocks.any(axis=(1, 3))
+        all_valid[row0:row1] = blocks.all(axis=(1, 3))
+    mask = np.where(all_valid, 255, np.where(any_valid, 128, 0)).astype(np.uint8)
+    return mask, height, width
@@ -0,0 +1,283 @@
+"""
+Tile rendering: reading single tiles or metatiles, post-processing and encoding
+"""
+
+import io
+import math
+import time
+from dataclasses import dataclass
+from typing import Collection, Dict, List, Optional, Tuple
+
+import numpy as np
+from morecantile import Tile
+from PIL import Image
+from rio_tiler.io import COGReader
+from rio_tiler.models import ImageData
+from rio_tiler.utils import render
+
+from band_expression import BandExpression
+from encoder_profiles import EncoderProfile, encoder_stats
+from metrics import timed
+from render_pipeline import compile_pipeline
+
+
+@dataclass(frozen=True)
+class TileParams:
+    """Validated render parameters shared by every tile of a request"""
+    size: int
+    format: str
+    rescale: Optional[Tuple[float, float]] = None
+    color_map: Optional[str] = None
+    nodata: Optional[float] = None
+    webp_ok: bool = False
+    profile: EncoderProfile = EncoderProfile()
+    negotiated: bool = False  # format picked from the Accept header
+    expression: Optional[BandExpression] = None  # band math rendered instead of the bands
+
+    def cache_parts(self) -> tuple:
+        """Normalized parameters for cache keys"""
+        # "jpg" and "jpeg" (and "tif"/"tiff") render identically
+        fmt = {"jpeg": "jpg", "tiff": "tif"}.get(self.format, self.format)
+        nodata_key = "nan" if self.nodata is not None and math.isnan(self.nodata) else self.nodata
+        parts = (
+            self.size,
+            fmt,
+            self.rescale,
+            self.color_map.lower() if self.color_map else None,
+            nodata_key,
+            # Only PNG requests switch to WebP based on Accept
+            fmt == "png" and self.webp_ok,
+        )
+        # Keys of the default profile predate profiles
+        if self.profile.name != "default":
+            parts += (self.profile.name,)
+        if self.expression is not None:
+            parts += (("expression", self.expression.source),)
+        return parts
+
+    @property
+    def indexes(self) -> Optional[Tuple[int, ...]]:
+        """Bands to read: only those the expression references, else all"""
+        return self.expression.bands if self.expression is not None else None
+
+    def evaluate(self, image: ImageData) -> ImageData:
+        """The image to post-process: the expression's result, or the bands as read"""
+        if self.expression is None:
+            return image
+        with timed("expression"):
+            return self.expression.apply(image)
+
+    @property
+    def varies_on_accept(self) -> bool:
+        """Whether the response depends on the Accept header (for ``Vary``)"""
+        return self.negotiated or self.format == "png"
+
+
+def encode_palette_png(index: np.ndarray, hidden: Optional[np.ndarray], palette: np.ndarray, zlevel: int) -> bytes:
+    """
+    8-bit palette PNG of colormap indices. Fully masked pixels take palette
+    entry 0 (made transparent), so index 0 is folded into 1 when any exist.
+    """
+    alpha = palette[:, 3].copy()
+    if hidden is not None and hidden.any():
+        np.maximum(index, 1, out=index)
+        np.copyto(index, 0, where=hidden)
+        alpha[0] = 0
+    image = Image.fromarray(index, "P")
+    image.putpalette(palette[:, :3].tobytes())
+    options = {"transparency": alpha.tobytes()} if (alpha < 255).any() else {}
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=zlevel, **options)
+    return buffer.getvalue()
+
+
+def encode_tile(tile: ImageData, params: TileParams, opaque: bool = False) -> Tuple[bytes, str]:
+    """
+    Post-process and encode a tile with the request's encoder profile; returns (bytes, media type).
+
+    ``opaque`` means the coverage index found no nodata under the tile, so the
+    transparency scan that picks WebP over PNG (or lossless WebP) is skipped.
+    Expressions mask their non-finite results, so it does not apply to them.
+    """
+    started = time.perf_counter()
+    profile = params.profile
+    opaque = opaque and params.expression is None
+
+    # Determine output format
+    if params.format in ["jpg", "jpeg"]:
+        driver = "JPEG"
+        media_type = "image/jpeg"
+    elif params.format == "webp":
+        driver = "WEBP"
+        media_type = "image/webp"
+    elif params.format in ["tif", "tiff"]:
+        driver = "GTiff"
+        media_type = "image/tiff"
+    else:  # png
+        driver = "PNG"
+        media_type = "image/png"
+
+    # Rescale and/or color map in one lookup-table pass
+    pipeline = compile_pipeline(params.rescale, params.color_map)
+    tile_bytes = None
+    if driver == "PNG" and profile.png_palette and pipeline is not None:
+        with timed("process"):
+            indices = pipeline.palette_indices(tile)
+        # Transparent tiles still switch to WebP when the client takes it
+        if indices is not None and not (params.webp_ok and indices[1] is not None and indices[1].any()):
+            with timed("encode"):
+                tile_bytes = encode_palette_png(*indices, pipeline.palette, profile.png_zlevel)
+
+    if tile_bytes is None:
+        with timed("process"):
+            if pipeline is not None:
+                data, mask = pipeline.apply(tile)
+            else:
+                data, mask = None, tile.mask
+
+            transparent = False
+            if not opaque and (driver == "WEBP" or (params.format == "png" and params.webp_ok)):
+                # Check if tile has transparency
+                transparent = not np.equal(mask, 255).all()
+
+        # Auto-detect format based on transparency if not specified
+        if params.format == "png" and params.webp_ok and transparent:
+            driver = "WEBP"
+            media_type = "image/webp"
+
+        options = profile.options(driver, transparent)
+
+        # Render tile to bytes
+        with timed("encode"):
+            if data is None:
+                tile_bytes = tile.render(
+                    img_format=driver,
+                    **options
+                )
+            else:
+                if driver == "GTiff":
+                    options = {**options, "transform": tile.transform, "crs": tile.crs}
+                tile_bytes = render(data, mask, img_format=driver, **options)
+
+    encoder_stats.record(profile.name, media_type, time.perf_counter() - started, len(tile_bytes))
+    return tile_bytes, media_type
+
+
+def read_tile(src: COGReader, x: int, y: int, z: int, params: TileParams) -> ImageData:
+    """Read one tile without encoding it (blocking; runs on the render executor)"""
+    with timed("read"):
+        tile = src.tile(
+            x, y, z,
+            tilesize=params.size,
+            indexes=params.indexes,
+            nodata=params.nodata,
+            resampling_method="nearest"
+        )
+    return params.evaluate(tile)
+
+
+def render_tile(src: COGReader, x: int, y: int, z: int, params: TileParams,
+                opaque: bool = False) -> Tuple[bytes, str]:
+    """Read, post-process and encode one tile (blocking; runs on the render executor)"""
+    return encode_tile(read_tile(src, x, y, z, params), params, opaque)
+
+
+def read_preview(src: COGReader, bounds: Tuple[float, float, float, float], width: int, height: int,
+                 params: TileParams) -> ImageData:
+    """
+    Read Web Mercator ``bounds`` at ``width`` x ``height`` pixels with one read.
+
+    The read is decimated through a warped VRT whose implicit overviews mirror
+    the COG's, so GDAL serves it from the coarsest overview that still has the
+    output resolution rather than from the full-resolution image.
+    """
+    dst_crs = src.tms.rasterio_crs
+    with timed("read"):
+        image = src.part(
+            bounds,
+            dst_crs=dst_crs,
+            bounds_crs=dst_crs,
+            width=width,
+            height=height,
+            max_size=None,
+            indexes=params.indexes,
+            nodata=params.nodata,
+            resampling_method="nearest",
+        )
+    return params.evaluate(image)
+
+
+def render_preview(src: COGReader, bounds: Tuple[float, float, float, float], width: int, height: int,
+                   params: TileParams) -> Tuple[bytes, str]:
+    """Read, post-process and encode a preview image (blocking; runs on the render executor)"""
+    return encode_tile(read_preview(src, bounds, width, height, params), params)
+
+
+def metatile_origin(x: int, y: int, n: int) -> Tuple[int, int]:
+    """Top-left tile of the n x n metatile containing (x, y)"""
+    return (x // n) * n, (y // n) * n
+
+
+def metatile_members(mx: int, my: int, z: int, n: int) -> List[Tuple[int, int]]:
+    """Tiles of a metatile, clipped to the zoom level's grid"""
+    limit = 2 ** z
+    return [
+        (x, y)
+        for y in range(my, min(my + n, limit))
+        for x in range(mx, min(mx + n, limit))
+    ]
+
+
+def read_metatile(
+    src: COGReader, mx: int, my: int, z: int, n: int, params: TileParams
+) -> Dict[Tuple[int, int], ImageData]:
+    """
+    Read an n x n block of tiles with one windowed read and one reprojection,
+    then slice it into per-tile images.
+
+    The block uses the same Web Mercator pixel grid as individual ``tile``
+    reads, so the slices match what ``render_tile`` would have produced.
+    """
+    members = metatile_members(mx, my, z, n)
+    cols = len({x for x, _ in members})
+    rows = len({y for _, y in members})
+    top_left = src.tms.xy_bounds(Tile(x=mx, y=my, z=z))
+    bottom_right = src.tms.xy_bounds(Tile(x=mx + cols - 1, y=my + rows - 1, z=z))
+    dst_crs = src.tms.rasterio_crs
+    with timed("read"):
+        block = src.part(
+            (top_left.left, bottom_right.bottom, bottom_right.right, top_left.top),
+            dst_crs=dst_crs,
+            bounds_crs=dst_crs,
+            width=cols * params.size,
+            height=rows * params.size,
+            max_size=None,
+            indexes=params.indexes,
+            nodata=params.nodata,
+            resampling_method="nearest",
+        )
+    # The expression runs once over the whole block
+    block = params.evaluate(block)
+
+    size = params.size
+    tiles = {}
+    for x, y in members:
+        col, row = x - mx, y - my
+        window = (slice(None), slice(row * size, (row + 1) * size), slice(col * size, (col + 1) * size))
+        bounds = src.tms.xy_bounds(Tile(x=x, y=y, z=z))
+        tiles[(x, y)] = ImageData(
+            block.array[window],
+            assets=block.assets,
+            bounds=(bounds.left, bounds.bottom, bounds.right, bounds.top),
+            crs=block.crs,
+            band_names=block.band_names,
+            metadata=block.metadata,
+            dataset_statistics=block.dataset_statistics,
+        )
+    return tiles
+
+
+def encode_tiles(tiles: Dict[Tuple[int, int], ImageData], params: TileParams,
+                 opaque: Collection[Tuple[int, int]] = ()) -> Dict[Tuple[int, int], Tuple[bytes, str]]:
+    """Encode several tiles (one render-executor job per metatile row); ``opaque`` as for ``encode_tile``"""
+    return {xy: encode_tile(tile, params, xy in opaque) for xy, tile in tiles.items()}
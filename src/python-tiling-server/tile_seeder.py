@@ -0,0 +1,289 @@
+"""
+Background pre-seeding of a task's tile pyramid into the rendered-tile cache
+"""
+
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import mercantile
+from pydantic import BaseModel
+
+from render_executor import RenderQueueFull
+
+logger = logging.getLogger(__name__)
+
+# Returns "done" for a rendered/cached tile or "skipped" for one outside the raster
+SeedProduce = Callable[[int, int, int], Awaitable[str]]
+
+
+class SeedState(BaseModel):
+    job_id: str
+    task_id: str
+    spec: Dict[str, Any]
+    version: str
+    state: str  # running, completed, cancelled, failed
+    total: int
+    cursor: int = 0  # every tile before this index has been processed
+    done: int = 0
+    skipped: int = 0
+    failed: int = 0
+    started_at: float
+    updated_at: float
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("completed", "cancelled", "failed")
+
+
+def seed_job_id(task_id: str, spec: Dict[str, Any]) -> str:
+    """Stable id for a task and seed spec, so resubmitting the same spec resumes it"""
+    raw = json.dumps([task_id, spec], sort_keys=True)
+    return hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
+
+def seed_tiles(bounds: List[float], minzoom: int, maxzoom: int, metatile_size: int) -> List[Tuple[int, int, int]]:
+    """
+    Every (z, x, y) covering ``bounds`` from minzoom to maxzoom, in a stable
+    order that keeps the tiles of each metatile next to each other so
+    concurrent seed workers share metatile renders
+    """
+    n = max(1, metatile_size)
+    west, south, east, north = bounds
+    tiles = []
+    for z in range(minzoom, maxzoom + 1):
+        level = [(t.z, t.x, t.y) for t in mercantile.tiles(west, south, east, north, [z])]
+        level.sort(key=lambda t: (t[2] // n, t[1] // n, t[2], t[1]))
+        tiles.extend(level)
+    return tiles
+
+
+class TileSeeder:
+    """
+    Run seed jobs with a bounded number of concurrent tile renders.
+
+    Job state is checkpointed to ``<state_dir>/<job_id>.json`` so any worker
+    (or the CLI) can report progress, and a job interrupted by a restart or a
+    cancellation resumes from its cursor when it is started again for the same
+    COG version. A job holds an exclusive ``flock`` on ``<job_id>.lock`` while
+    running, so one spec is seeded by at most one process at a time;
+    cancellation from another process is signalled with a ``<job_id>.cancel``
+    marker that the owner checks at every checkpoint.
+
+    Seeding yields to live traffic: a full render queue makes the seed worker
+    back off and retry instead of failing the tile.
+    """
+
+    def __init__(self, state_dir: str, checkpoint_interval: float = 5.0, retry_delay: float = 1.0):
+        self.state_dir = state_dir
+        self.checkpoint_interval = checkpoint_interval
+        self.retry_delay = retry_delay
+        self._jobs: Dict[str, asyncio.Task] = {}
+        self._states: Dict[str, SeedState] = {}
+        os.makedirs(state_dir, exist_ok=True)
+
+    def _path(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.state_dir, f"{job_id}.{suffix}")
+
+    # State
+
+    def status(self, job_id: str) -> Optional[SeedState]:
+        """Progress of a job running here, or its last checkpoint on disk"""
+        state = self._states.get(job_id)
+        if state is not None and job_id in self._jobs:
+            return state
+        return self._load(job_id)
+
+    def _load(self, job_id: str) -> Optional[SeedState]:
+        try:
+            with open(self._path(job_id, "json"), "rb") as f:
+                return SeedState.model_validate_json(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, state: SeedState) -> None:
+        state.updated_at = time.time()
+        path = self._path(state.job_id, "json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(state.model_dump_json())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to checkpoint seed job {state.job_id}: {e}")
+
+    # Control
+
+    def start(self, task_id: str, spec: Dict[str, Any], version: str,
+              tiles: List[Tuple[int, int, int]], produce: SeedProduce, concurrency: int) -> SeedState:
+        """Start (or resume) a job in the background and return its current state"""
+        job_id = seed_job_id(task_id, spec)
+        if job_id in self._jobs:
+            return self._states[job_id]
+
+        lock_fd = self._try_lock(job_id)
+        if lock_fd is None:
+            # Another worker or the CLI is seeding this spec
+            return self._load(job_id) or self._new_state(job_id, task_id, spec, version, len(tiles))
+
+        state = self._resume_state(job_id, task_id, spec, version, len(tiles))
+        self._states[job_id] = state
+        self._save(state)
+        task = asyncio.ensure_future(self._run(state, tiles, produce, concurrency, lock_fd))
+        self._jobs[job_id] = task
+        task.add_done_callback(lambda _t: self._jobs.pop(job_id, None))
+        return state
+
+    async def run(self, task_id: str, spec: Dict[str, Any], version: str,
+                  tiles: List[Tuple[int, int, int]], produce: SeedProduce, concurrency: int) -> SeedState:
+        """Start (or resume) a job and wait for it to finish"""
+        state = self.start(task_id, spec, version, tiles, produce, concurrency)
+        task = self._jobs.get(state.job_id)
+        if task is None:
+            raise RuntimeError(f"Seed job {state.job_id} is already running in another process")
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Checkpoint before propagating so the job can be resumed
+            task.cancel()
+            await asyncio.wait({task})
+            raise
+        return self._states[state.job_id]
+
+    def cancel(self, job_id: str) -> Optional[SeedState]:
+        """Cancel a job here, or ask the process running it to stop"""
+        task = self._jobs.get(job_id)
+        if task is not None:
+            task.cancel()
+            return self._states[job_id]
+        state = self._load(job_id)
+        if state is not None and not state.finished:
+            try:
+                with open(self._path(job_id, "cancel"), "w"):
+                    pass
+            except OSError as e:
+                logger.warning(f"Failed to request cancellation of seed job {job_id}: {e}")
+        return state
+
+    async def close(self) -> None:
+        """Cancel local jobs, leaving checkpoints to resume from"""
+        tasks = list(self._jobs.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+
+    def _try_lock(self, job_id: str) -> Optional[int]:
+        fd = os.open(self._path(job_id, "lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _new_state(self, job_id: str, task_id: str, spec: Dict[str, Any], version: str, total: int) -> SeedState:
+        now = time.time()
+        return SeedState(
+            job_id=job_id, task_id=task_id, spec=spec, version=version,
+            state="running", total=total, started_at=now, updated_at=now,
+        )
+
+    def _resume_state(self, job_id: str, task_id: str, spec: Dict[str, Any], version: str, total: int) -> SeedState:
+        try:
+            os.unlink(self._path(job_id, "cancel"))
+        except FileNotFoundError:
+            pass
+        previous = self._load(job_id)
+        if (
+            previous is not None
+            and previous.state != "completed"
+            and previous.version == version
+            and previous.total == total
+        ):
+            logger.info(f"Resuming seed job {job_id} for task {task_id} at {previous.cursor}/{total}")
+            previous.state = "running"
+            previous.done = previous.cursor
+            previous.skipped = previous.failed = 0
+            previous.finished_at = previous.error = None
+            return previous
+        return self._new_state(job_id, task_id, spec, version, total)
+
+    # Worker pool
+
+    async def _run(self, state: SeedState, tiles: List[Tuple[int, int, int]],
+                   produce: SeedProduce, concurrency: int, lock_fd: int) -> None:
+        next_index = state.cursor
+        finished = set()
+        last_checkpoint = time.monotonic()
+        stop = asyncio.Event()
+
+        def advance(index: int) -> None:
+            finished.add(index)
+            while state.cursor in finished:
+                finished.discard(state.cursor)
+                state.cursor += 1
+
+        async def checkpoint() -> None:
+            nonlocal last_checkpoint
+            if time.monotonic() - last_checkpoint < self.checkpoint_interval:
+                return
+            last_checkpoint = time.monotonic()
+            if os.path.exists(self._path(state.job_id, "cancel")):
+                stop.set()
+            await asyncio.to_thread(self._save, state)
+            logger.info(f"Seeding task {state.task_id}: {state.done}/{state.total} tiles")
+
+        async def worker() -> None:
+            nonlocal next_index
+            while not stop.is_set() and next_index < len(tiles):
+                index = next_index
+                next_index += 1
+                z, x, y = tiles[index]
+                while True:
+                    try:
+                        outcome = await produce(z, x, y)
+                        break
+                    except RenderQueueFull:
+                        # Live traffic has the renderer busy; back off
+                        await asyncio.sleep(self.retry_delay)
+                    except Exception as e:
+                        logger.warning(f"Seeding tile {z}/{x}/{y} of task {state.task_id} failed: {e}")
+                        outcome = "failed"
+                        break
+                if outcome == "skipped":
+                    state.skipped += 1
+                elif outcome == "failed":
+                    state.failed += 1
+                state.done += 1
+                advance(index)
+                await checkpoint()
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+            state.state = "cancelled" if stop.is_set() else "completed"
+        except asyncio.CancelledError:
+            state.state = "cancelled"
+        except Exception as e:
+            logger.error(f"Seed job {state.job_id} for task {state.task_id} failed: {e}")
+            state.state = "failed"
+            state.error = str(e)
+        finally:
+            state.finished_at = time.time()
+            self._save(state)
+            try:
+                os.unlink(self._path(state.job_id, "cancel"))
+            except FileNotFoundError:
+                pass
+            os.close(lock_fd)
+            logger.info(
+                f"Seed job {state.job_id} for task {state.task_id} {state.state}: "
+                f"{state.done}/{state.total} tiles ({state.skipped} skipped, {state.failed} failed)"
+            )
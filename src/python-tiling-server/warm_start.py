@@ -0,0 +1,178 @@
+"""
+Hot working set recorded by every worker and replayed by new ones, plus import-time preloading
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def preload() -> None:
+    """
+    Initialize GDAL drivers and Pillow plugins.
+
+    Called when ``main`` is imported, which with gunicorn's ``--preload`` is
+    once in the master before it forks, so workers start with them ready
+    instead of each paying for them on its first request. Nothing that holds
+    files, threads or PROJ database handles is created here, as those must
+    not cross ``fork()``.
+    """
+    started = time.perf_counter()
+    import rasterio
+    from PIL import Image
+
+    with rasterio.Env():  # registers the GDAL drivers
+        pass
+    Image.init()  # imports every Pillow format plugin
+    logger.info(f"Preloaded GDAL and Pillow in {time.perf_counter() - started:.2f}s")
+
+
+# (task_id, z, x, y, render parameters as sorted JSON)
+TileKey = Tuple[str, int, int, int, str]
+
+
+class HotSet:
+    """
+    Recently active tasks and the most requested tiles of this worker.
+
+    Scores count requests and decay with a ``half_life`` in seconds. Every
+    ``interval`` seconds the worker writes them with each task's metadata to
+    ``<directory>/hot-<pid>.json``; ``load`` merges the files of all workers,
+    including recycled ones, decaying each by its age. Files older than
+    ``max_age`` seconds are removed.
+    """
+
+    def __init__(self, directory: str, interval: float = 60.0, half_life: float = 3600.0,
+                 max_tasks: int = 50, max_tiles: int = 500, max_age: float = 86400.0):
+        self.directory = directory
+        self.interval = interval
+        self.half_life = half_life
+        self.max_tasks = max_tasks
+        self.max_tiles = max_tiles
+        self.max_age = max_age
+        self._tasks: Dict[str, float] = {}
+        self._tiles: Dict[TileKey, float] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def worker_path(self) -> str:
+        return os.path.join(self.directory, f"hot-{os.getpid()}.json")
+
+    def touch_task(self, task_id: str) -> None:
+        self._tasks[task_id] = self._tasks.get(task_id, 0.0) + 1
+
+    def touch_tile(self, task_id: str, z: int, x: int, y: int, params: Dict[str, Any]) -> None:
+        key = (task_id, z, x, y, json.dumps(params, sort_keys=True))
+        self._tiles[key] = self._tiles.get(key, 0.0) + 1
+        if len(self._tiles) > 4 * self.max_tiles:
+            self._tiles = dict(_top(self._tiles, 2 * self.max_tiles))
+
+    def collect(self, metadata_of: Callable[[str], Optional[Tuple[dict, float]]]) -> Dict[str, Any]:
+        """This worker's hot set (on the event loop, which records it), decaying its scores"""
+        tasks = []
+        for task_id, score in _top(self._tasks, self.max_tasks):
+            entry = {"id": task_id, "score": score}
+            metadata = metadata_of(task_id)
+            if metadata is not None:
+                entry["metadata"], entry["fetched_at"] = metadata
+            tasks.append(entry)
+        tiles = [
+            {"task": key[0], "z": key[1], "x": key[2], "y": key[3], "params": json.loads(key[4]), "score": score}
+            for key, score in _top(self._tiles, self.max_tiles)
+        ]
+        factor = 0.5 ** (self.interval / self.half_life)
+        self._tasks = _decay(self._tasks, factor)
+        self._tiles = _decay(self._tiles, factor)
+        return {"written_at": time.time(), "tasks": tasks, "tiles": tiles}
+
+    def write(self, data: Dict[str, Any]) -> None:
+        if not (data["tasks"] or data["tiles"]):
+            return
+        path = self.worker_path
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def load(self) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Hottest tasks (with their newest metadata) and tiles of every worker, hottest first"""
+        tasks: Dict[str, Dict[str, Any]] = {}
+        tiles: Dict[TileKey, Dict[str, Any]] = {}
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not (name.startswith("hot-") and name.endswith(".json")):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.stat(path).st_mtime > self.max_age:
+                    os.unlink(path)
+                    continue
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping hot set {path}: {e}")
+                continue
+            # Older files count for less, at the rate scores decay
+            weight = 0.5 ** (max(0.0, now - data.get("written_at", now)) / self.half_life)
+            for entry in data.get("tasks", []):
+                merged = tasks.setdefault(entry["id"], {"id": entry["id"], "score": 0.0})
+                merged["score"] += entry["score"] * weight
+                if entry.get("fetched_at", 0) > merged.get("fetched_at", 0):
+                    merged["metadata"], merged["fetched_at"] = entry["metadata"], entry["fetched_at"]
+            for entry in data.get("tiles", []):
+                key = (entry["task"], entry["z"], entry["x"], entry["y"], json.dumps(entry["params"], sort_keys=True))
+                merged = tiles.setdefault(key, dict(entry, score=0.0))
+                merged["score"] += entry["score"] * weight
+        by_score = lambda entry: -entry["score"]
+        return (
+            sorted(tasks.values(), key=by_score)[:self.max_tasks],
+            sorted(tiles.values(), key=by_score)[:self.max_tiles],
+        )
+
+    def start_flusher(self, metadata_of: Callable[[str], Optional[Tuple[dict, float]]]) -> None:
+        async def loop():
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    await asyncio.to_thread(self.write, self.collect(metadata_of))
+                except Exception as e:
+                    logger.warning(f"Failed to write hot set: {e}")
+
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(loop())
+
+    async def stop_flusher(self, metadata_of: Callable[[str], Optional[Tuple[dict, float]]]) -> None:
+        if self._flusher is None:
+            return
+        self._flusher.cancel()
+        try:
+            await self._flusher
+        except asyncio.CancelledError:
+            pass
+        self._flusher = None
+        # The replacement worker starts from what this one saw last
+        try:
+            self.write(self.collect(metadata_of))
+        except Exception as e:
+            logger.warning(f"Failed to write hot set: {e}")
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "tasks": len(self._tasks),
+            "tiles": len(self._tiles),
+        }
+
+
+def _top(scores: Dict[Any, float], n: int) -> List[Tuple[Any, float]]:
+    return sorted(scores.items(), key=lambda item: -item[1])[:n]
+
+
+def _decay(scores: Dict[Any, float], factor: float) -> Dict[Any, float]:
+    # A single request is forgotten after about four half-lives
+    return {key: score * factor for key, score in scores.items() if score * factor >= 0.05}
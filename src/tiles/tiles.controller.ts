@@ -224,6 +224,27 @@ export class TilesController {
     return this.tilesService.getTaskInfo(taskId);
   }
 
+  /**
+   * List a project's completed tasks with a COG, for the tiling server's
+   * project mosaics
+   * @param projectId Project ID
+   * @param req Request object
+   * @returns Task information of every task in the project
+   */
+  @Get("projects/:projectId/tasks")
+  @UseGuards(JwtOrApiKeyAuthGuard)
+  async getProjectTasks(
+    @Param("projectId", ParseIntPipe) projectId: number,
+    @Req() req: Request,
+  ) {
+    this.logger.debug(`Project tasks request for project ${projectId}`);
+
+    const authorizationHeader = req.headers["authorization"];
+    const userId = getSubIdFromToken(authorizationHeader);
+
+    return this.tilesService.getProjectTasks(projectId, userId);
+  }
+
   /**
    * List accessible tasks for the current user
    * @param projectId Optional project ID filter
@@ -23,20 +23,28 @@ export class TilesService {
   ) {}
 
   /**
-   * Validate task access for a user
-   * @param taskId Task ID
-   * @param userId User ID (optional for public tasks)
-   * @returns Task information if accessible
+   * Whether getSubIdFromToken returned a user ID rather than a missing or
+   * invalid token indicator
+   * @param userId Value returned by getSubIdFromToken
    */
-  private async validateTaskAccess(taskId: string, userId?: string) {
-    // Normalize missing or invalid token indicators
-    if (
+  private isUserId(userId?: string): boolean {
+    return !(
       userId === undefined ||
       userId === null ||
       userId === "No token found" ||
       userId === "Invalid token or missing subject" ||
       userId === "Error decoding token"
-    ) {
+    );
+  }
+
+  /**
+   * Validate task access for a user
+   * @param taskId Task ID
+   * @param userId User ID (optional for public tasks)
+   * @returns Task information if accessible
+   */
+  private async validateTaskAccess(taskId: string, userId?: string) {
+    if (!this.isUserId(userId)) {
       userId = undefined;
     }
 
@@ -194,6 +202,55 @@ export class TilesService {
     };
   }
 
+  /**
+   * List a project's completed tasks with a COG
+   * @param projectId Project ID
+   * @param userId User ID (optional; API key callers see every project)
+   * @returns Task information, in the same shape as getTaskInfo
+   */
+  async getProjectTasks(projectId: number, userId?: string) {
+    this.logger.debug(`Getting tasks of project ${projectId}, user ${userId}`);
+
+    const project = await this.prisma.project.findUnique({
+      where: { id: projectId },
+      select: { userId: true },
+    });
+
+    if (!project) {
+      throw new NotFoundException(`Project ${projectId} not found`);
+    }
+
+    if (this.isUserId(userId) && project.userId !== userId) {
+      throw new ForbiddenException(`Access denied to project ${projectId}`);
+    }
+
+    return this.prisma.thermalProcessingTask.findMany({
+      where: {
+        projectId,
+        status: "completed",
+        cogUrl: {
+          not: null,
+        },
+      },
+      select: {
+        id: true,
+        projectId: true,
+        status: true,
+        cogUrl: true,
+        tileServiceUrl: true,
+        bounds: true,
+        maxZoom: true,
+        minZoom: true,
+        cogCreatedAt: true,
+        createdAt: true,
+        updatedAt: true,
+      },
+      orderBy: {
+        createdAt: "asc",
+      },
+    });
+  }
+
   /**
    * List accessible tasks for a user
    * @param userId User ID